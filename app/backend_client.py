@@ -1,7 +1,8 @@
-import httpx
 import json
 from typing import List, Dict, Any, Optional
 
+from .http_pool import get_http_client
+from .metrics import ERRORS, stage_timer
 from .config import BACKEND_URL, BACKEND_API_PREFIX, DEFAULT_AUTH_TOKEN, REQUEST_TIMEOUT, logger
 
 class BackendClient:
@@ -16,14 +17,15 @@ class BackendClient:
     async def check_status(self) -> bool:
         """Check if backend API is available"""
         try:
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                response = await client.get(f"{self.base_url}")
-                return response.status_code == 200
+            response = await get_http_client("backend").get(f"{self.base_url}", timeout=5.0)
+            return response.status_code == 200
         except Exception as e:
             logger.error(f"Error checking backend API status: {e}")
             return False
             
-    async def fetch_user_photos(self, max_photos: int = 50, auth_token: Optional[str] = None) -> Dict[str, Any]:
+    async def fetch_user_photos(self, max_photos: int = 50, auth_token: Optional[str] = None,
+                                since: Optional[str] = None, offset: int = 0) -> Dict[str, Any]:
+        """Fetch a page of the user's and friends' photos, newer than `since` (createdAt) when given"""
         try:
             # Use provided token or default
             token = auth_token or DEFAULT_AUTH_TOKEN
@@ -33,7 +35,12 @@ class BackendClient:
                 raise ValueError("No valid auth token provided. Authentication required to fetch photos.")
             
             # Construct API URL
-            api_url = f"{self.base_url}{self.api_prefix}/photos/ai/user-content?max_photos={max_photos}"
+            api_url = f"{self.base_url}{self.api_prefix}/photos/ai/user-content"
+            params = {"max_photos": max_photos}
+            if since:
+                params["since"] = since
+            if offset:
+                params["offset"] = offset
             
             # Set up headers with auth token
             headers = {
@@ -42,18 +49,21 @@ class BackendClient:
             }
             
             # Make API request
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.get(api_url, headers=headers)
-                
-                # Check response status
-                if response.status_code != 200:
-                    error_msg = f"Backend API request failed: {response.status_code}"
-                    logger.error(error_msg)
-                    raise ValueError(error_msg)
-                
-                # Parse response
-                data = response.json()        
-                return data
+            with stage_timer("backend_fetch"):
+                response = await get_http_client("backend").get(
+                    api_url, params=params, headers=headers, timeout=self.timeout
+                )
+
+            # Check response status
+            if response.status_code != 200:
+                error_msg = f"Backend API request failed: {response.status_code}"
+                logger.error(error_msg)
+                raise ValueError(error_msg)
+
+            # Parse response
+            data = response.json()
+            return data
                 
         except Exception as e:
+            ERRORS.labels("backend_fetch").inc()
             raise 
\ No newline at end of file
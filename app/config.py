@@ -10,10 +10,126 @@ BACKEND_URL = config["BACKEND_URL"]
 BACKEND_API_PREFIX = config["BACKEND_API_PREFIX"]
 YOLO_MODEL_PATH = config["YOLO_MODEL_PATH"]
 YOLO_GENERAL_CLS_MODEL_PATH = config["YOLO_GENERAL_CLS_MODEL_PATH"]
+EMBEDDING_MODEL_NAME = config.get("EMBEDDING_MODEL_NAME") or "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+CHROMA_PATH = config.get("CHROMA_PATH") or "./chroma_db"
+CHROMA_COLLECTION = "vietnamese_food_images"
+# Model runtime: torch, onnx or openvino (export with `python -m app.inference_engine convert`)
+INFERENCE_BACKEND = (config.get("INFERENCE_BACKEND") or "torch").lower()
+INFERENCE_INT8 = (config.get("INFERENCE_INT8") or "false").lower() == "true"
+# Load models in the background on startup (otherwise on first indexing request)
+WARMUP_ON_STARTUP = (config.get("WARMUP_ON_STARTUP") or "true").lower() == "true"
 DEFAULT_AUTH_TOKEN = config["DEFAULT_AUTH_TOKEN"]
 REQUEST_TIMEOUT = float(config["REQUEST_TIMEOUT"])
-OLLAMA_BASE_URL = "http://localhost:11434"  
-OLLAMA_MODEL = "llama3.1:8b"  
+# Indexing pipeline
+CLASSIFY_BATCH_SIZE = int(config.get("CLASSIFY_BATCH_SIZE") or 16)
+CLASSIFY_BATCH_WAIT = float(config.get("CLASSIFY_BATCH_WAIT") or 0.05)
+CLASSIFIER_IMAGE_SIZE = int(config.get("CLASSIFIER_IMAGE_SIZE") or 224)
+IN_MEMORY_IMAGES = (config.get("IN_MEMORY_IMAGES") or "true").lower() == "true"
+BULK_INDEXING = (config.get("BULK_INDEXING") or "true").lower() == "true"
+EMBED_BATCH_SIZE = int(config.get("EMBED_BATCH_SIZE") or 64)
+QUERY_EMBEDDING_CACHE_SIZE = int(config.get("QUERY_EMBEDDING_CACHE_SIZE") or 256)
+INDEXED_ID_CACHE_SIZE = int(config.get("INDEXED_ID_CACHE_SIZE") or 100000)
+PIPELINE_QUEUE_SIZE = int(config.get("PIPELINE_QUEUE_SIZE") or 16)
+PIPELINE_CONCURRENCY = {
+    stage: int(config.get(f"PIPELINE_{stage.upper()}_CONCURRENCY") or default)
+    for stage, default in {"download": 8, "decode": 2, "classify": 1, "embed": 1, "write": 1}.items()
+}
+# Persistent classifier results keyed by IPFS CID / content hash (and optionally perceptual hash)
+PREDICTION_CACHE_ENABLED = (config.get("PREDICTION_CACHE_ENABLED") or "true").lower() == "true"
+PREDICTION_CACHE_PATH = config.get("PREDICTION_CACHE_PATH") or "./prediction_cache.sqlite3"
+PREDICTION_CACHE_SIZE = int(config.get("PREDICTION_CACHE_SIZE") or 200000)
+PREDICTION_CACHE_PHASH = (config.get("PREDICTION_CACHE_PHASH") or "false").lower() == "true"
+# Optional inference server (python -m app.inference_server) shared by all workers
+INFERENCE_SOCKET = config.get("INFERENCE_SOCKET") or None
+INFERENCE_TIMEOUT = float(config.get("INFERENCE_TIMEOUT") or 120.0)
+
+# Ollama
+OLLAMA_BASE_URL = config.get("OLLAMA_BASE_URL") or "http://localhost:11434"
+OLLAMA_MODEL = config.get("OLLAMA_MODEL") or "llama3.1:8b"
+# How long Ollama keeps the model loaded after a request (Ollama duration, "-1" = forever)
+OLLAMA_KEEP_ALIVE = config.get("OLLAMA_KEEP_ALIVE") or "30m"
+# Load the model into Ollama at startup instead of on the first chat
+OLLAMA_PRELOAD = (config.get("OLLAMA_PRELOAD") or "false").lower() == "true"
+OLLAMA_NUM_CTX = int(config["OLLAMA_NUM_CTX"]) if config.get("OLLAMA_NUM_CTX") else None
+OLLAMA_NUM_PREDICT = int(config["OLLAMA_NUM_PREDICT"]) if config.get("OLLAMA_NUM_PREDICT") else None
+OLLAMA_TIMEOUT = float(config.get("OLLAMA_TIMEOUT") or 60.0)
+# Times a broken stream is resumed from the text generated so far
+OLLAMA_MAX_RETRIES = int(config.get("OLLAMA_MAX_RETRIES") or 2)
+
+# Shared HTTP connection pools, one per upstream
+def _pool_limits(prefix: str, max_connections: int, timeout: float) -> dict:
+    return {
+        "max_connections": int(config.get(f"{prefix}_MAX_CONNECTIONS") or max_connections),
+        "max_keepalive_connections": int(config.get(f"{prefix}_MAX_KEEPALIVE_CONNECTIONS") or max_connections),
+        "keepalive_expiry": float(config.get(f"{prefix}_KEEPALIVE_EXPIRY") or 30.0),
+        "timeout": timeout,
+    }
+
+HTTP_POOL_LIMITS = {
+    "backend": _pool_limits("BACKEND", 20, REQUEST_TIMEOUT),
+    "ipfs": _pool_limits("IPFS", 50, 10.0),
+    "ollama": _pool_limits("OLLAMA", 10, OLLAMA_TIMEOUT),
+    "groq": _pool_limits("GROQ", 20, 60.0),
+}
+HTTP2_UPSTREAMS = {u.strip() for u in (config.get("HTTP2_UPSTREAMS") or "").split(",") if u.strip()}
+
+# Background indexing jobs: concurrent jobs, queued jobs before 429, finished jobs kept for status,
+# and the SQLite file through which all workers share job state
+INDEXING_WORKERS = int(config.get("INDEXING_WORKERS") or 2)
+INDEXING_QUEUE_SIZE = int(config.get("INDEXING_QUEUE_SIZE") or 100)
+INDEXING_JOB_HISTORY = int(config.get("INDEXING_JOB_HISTORY") or 500)
+INDEXING_JOBS_PATH = config.get("INDEXING_JOBS_PATH") or "./indexing_jobs.sqlite3"
+# Delta sync with the backend: per-user watermarks, page size and page limit per /index-rag call
+SYNC_STATE_PATH = config.get("SYNC_STATE_PATH") or "./sync_state.sqlite3"
+SYNC_PAGE_SIZE = int(config.get("SYNC_PAGE_SIZE") or 50)
+SYNC_MAX_PAGES = int(config.get("SYNC_MAX_PAGES") or 40)
+# Friend lists kept in memory per worker (seconds), and how old a stored list may get
+# before the next sync re-reads the whole friend feed to drop removed friends
+FRIEND_GRAPH_TTL = float(config.get("FRIEND_GRAPH_TTL") or 300)
+FRIEND_LIST_MAX_AGE = float(config.get("FRIEND_LIST_MAX_AGE") or 86400)
+
+# Suggestion cache
+SUGGESTION_CACHE_SIZE = int(config.get("SUGGESTION_CACHE_SIZE") or 1024)
+SUGGESTION_CACHE_TTL = float(config.get("SUGGESTION_CACHE_TTL") or 600)
+
+# Suggestion prompt size: token budget (overridable per template as "key=tokens,..."),
+# and how much of each crawled dish description / address list is kept before trimming further
+PROMPT_TOKEN_BUDGET = int(config.get("PROMPT_TOKEN_BUDGET") or 1500)
+PROMPT_TOKEN_BUDGETS = {
+    key.strip(): int(value)
+    for key, _, value in (
+        entry.partition("=") for entry in (config.get("PROMPT_TOKEN_BUDGETS") or "").split(",") if "=" in entry
+    )
+}
+PROMPT_DESCRIPTION_SENTENCES = int(config.get("PROMPT_DESCRIPTION_SENTENCES") or 2)
+PROMPT_MAX_ADDRESSES = int(config.get("PROMPT_MAX_ADDRESSES") or 2)
+
+# Groq (any OpenAI-compatible server works through GROQ_BASE_URL, e.g. a local fake)
+GROQ_BASE_URL = config.get("GROQ_BASE_URL") or None
+GROQ_MAX_CONCURRENCY = int(config.get("GROQ_MAX_CONCURRENCY") or 16)
+
+# LLM provider router: preference order, circuit breaker, optional hedged requests, cached health probes
+LLM_PROVIDER_ORDER = [p.strip() for p in (config.get("LLM_PROVIDER_ORDER") or "groq,ollama").split(",") if p.strip()]
+LLM_STATS_WINDOW = int(config.get("LLM_STATS_WINDOW") or 100)
+LLM_BREAKER_FAILURES = int(config.get("LLM_BREAKER_FAILURES") or 3)
+LLM_BREAKER_ERROR_RATE = float(config.get("LLM_BREAKER_ERROR_RATE") or 0.5)
+LLM_BREAKER_COOLDOWN = float(config.get("LLM_BREAKER_COOLDOWN") or 30)
+LLM_HEDGE = (config.get("LLM_HEDGE") or "false").lower() == "true"
+LLM_HEDGE_MIN_DELAY = float(config.get("LLM_HEDGE_MIN_DELAY") or 0.5)
+LLM_HEALTH_TTL = float(config.get("LLM_HEALTH_TTL") or 15)
+
+# On-demand profiling: requests carrying X-Profile-Token: <PROFILING_TOKEN>, or a sampled
+# share of requests under PROFILING_PATHS, get a CPU profile kept in PROFILING_DIR
+PROFILING_TOKEN = config.get("PROFILING_TOKEN") or None
+PROFILING_SAMPLE_RATE = float(config.get("PROFILING_SAMPLE_RATE") or 0)
+# Profiling middleware is only installed when something can select a request
+PROFILING_ENABLED = bool(PROFILING_TOKEN) or PROFILING_SAMPLE_RATE > 0
+PROFILING_PATHS = [p.strip() for p in (config.get("PROFILING_PATHS") or "/index-rag,/suggest").split(",") if p.strip()]
+PROFILING_DIR = config.get("PROFILING_DIR") or "./profiles"
+PROFILING_MAX_FILES = int(config.get("PROFILING_MAX_FILES") or 50)
+# Event-loop lag probe period in seconds (0 = off)
+EVENT_LOOP_MONITOR_INTERVAL = float(config.get("EVENT_LOOP_MONITOR_INTERVAL") or 0.05)
+
 # Logger
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger("rag_indexer")
@@ -0,0 +1,61 @@
+import threading
+import time
+from typing import Dict, Iterable, List, Set, Tuple
+
+from .config import FRIEND_GRAPH_TTL
+from .sync_state import SyncState, sync_state
+
+
+class FriendGraph:
+    """Per-user friend sets from the backend's friend feed, persisted in the sync state.
+
+    A user's list is replaced on every full read of their feed. Lists read from
+    the sync state are kept in memory for `ttl` seconds, so changes written by
+    other workers show up after at most that long; empty lists are not cached.
+    """
+
+    def __init__(self, store: SyncState = sync_state, ttl: float = FRIEND_GRAPH_TTL):
+        self.store = store
+        self.ttl = ttl
+        self._friends: Dict[str, Tuple[float, Set[str]]] = {}
+        self._lock = threading.Lock()
+
+    def record_friends(self, user_id: str, friend_ids: Iterable[str]):
+        """Store the authoritative friend list for a user, mirroring edges into known friends' lists"""
+        user_id = str(user_id)
+        friends = {str(f) for f in friend_ids} - {user_id}
+        self.store.record_friends(user_id, friends)
+        now = time.monotonic()
+        with self._lock:
+            previous = self._friends.get(user_id, (now, set()))[1]
+            self._friends[user_id] = (now, friends)
+            # Only touch lists that are already known, a list holding just
+            # this one edge would look complete
+            for friend_id in friends | previous:
+                if friend_id in self._friends:
+                    if friend_id in friends:
+                        self._friends[friend_id][1].add(user_id)
+                    else:
+                        self._friends[friend_id][1].discard(user_id)
+
+    def cached_friends(self, user_id: str) -> Set[str]:
+        """Friends known in memory, without reading the sync state"""
+        return set(self._friends.get(str(user_id), (0.0, ()))[1])
+
+    def get_friends(self, user_id: str) -> List[str]:
+        user_id = str(user_id)
+        now = time.monotonic()
+        cached = self._friends.get(user_id)
+        if cached is not None and now - cached[0] < self.ttl:
+            return list(cached[1])
+        friends = self.store.friends(user_id)
+        with self._lock:
+            if friends:
+                self._friends[user_id] = (now, friends)
+            else:
+                # Not indexed yet (possibly by another worker right now): read again next time
+                self._friends.pop(user_id, None)
+        return list(friends)
+
+
+friend_graph = FriendGraph()
@@ -1,13 +1,25 @@
-import os
-from typing import AsyncGenerator
-import httpx
-from groq import Groq
-from .config import config
+import asyncio
+from typing import AsyncGenerator, Optional
+from groq import AsyncGroq
+from .config import config, GROQ_BASE_URL, GROQ_MAX_CONCURRENCY
+from .http_pool import get_http_client
 # Initialize Groq client with API key from environment
 groq_api_key = config["GROQ_API_KEY"]
-groq_client = Groq(api_key=groq_api_key) if groq_api_key else None
 default_model = config["CLOUD_MODEL"]
 
+# Shared async client on top of the pooled "groq" HTTP client
+_groq_client: Optional[AsyncGroq] = None
+# Caps in-flight Groq calls (streams hold a slot until they finish)
+_groq_slots = asyncio.Semaphore(GROQ_MAX_CONCURRENCY)
+
+def get_groq_client() -> AsyncGroq:
+    global _groq_client
+    http_client = get_http_client("groq")
+    # Rebuild if the pooled HTTP client was closed and recreated
+    if _groq_client is None or _groq_client._client is not http_client:
+        _groq_client = AsyncGroq(api_key=groq_api_key, base_url=GROQ_BASE_URL, http_client=http_client)
+    return _groq_client
+
 async def check_groq_status():
     """
     Check if Groq API is accessible and return status information
@@ -43,38 +55,39 @@ async def ask_groq(prompt: str, model: str = None, temperature: float = 0.7, max
         model = default_model
         
     try:
-        response = groq_client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "user", "content": prompt}
-            ],
-            temperature=temperature,
-            max_completion_tokens=max_tokens
-        )
-        
+        async with _groq_slots:
+            response = await get_groq_client().chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=temperature,
+                max_completion_tokens=max_tokens
+            )
+
         return response.choices[0].message.content
     except Exception as e:
         raise Exception(f"Error querying Groq: {str(e)}")
 
-async def stream_groq(
-    prompt: str, 
+async def iter_groq_stream(
+    prompt: str,
     model: str = None,
-    temperature: float = 0.7, 
+    temperature: float = 0.7,
     max_tokens: int = 1024
 ) -> AsyncGenerator[str, None]:
     """
-    Stream responses from Groq API
+    Yield content deltas from a Groq streaming completion, raising on errors.
+    Closing the generator (e.g. client disconnect) closes the upstream stream.
     """
     if not groq_api_key:
-        yield "Error: GROQ_API_KEY environment variable not set"
-        return
-    
+        raise Exception("GROQ_API_KEY environment variable not set")
+
     # Always use default_model if model is None
     if model is None:
         model = default_model
-    
-    try:
-        stream = groq_client.chat.completions.create(
+
+    async with _groq_slots:
+        stream = await get_groq_client().chat.completions.create(
             model=model,
             messages=[
                 {"role": "user", "content": prompt}
@@ -83,9 +96,28 @@ async def stream_groq(
             max_completion_tokens=max_tokens,
             stream=True
         )
-        
-        for chunk in stream:
-            if chunk.choices and chunk.choices[0].delta.content:
-                yield chunk.choices[0].delta.content
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await stream.close()
+
+async def stream_groq(
+    prompt: str, 
+    model: str = None,
+    temperature: float = 0.7, 
+    max_tokens: int = 1024
+) -> AsyncGenerator[str, None]:
+    """
+    Stream responses from Groq API
+    """
+    if not groq_api_key:
+        yield "Error: GROQ_API_KEY environment variable not set"
+        return
+
+    try:
+        async for content in iter_groq_stream(prompt, model, temperature, max_tokens):
+            yield content
     except Exception as e:
-        yield f"Error: {str(e)}" 
\ No newline at end of file
+        yield f"Error: {str(e)}"
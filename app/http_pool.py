@@ -0,0 +1,99 @@
+import httpx
+from functools import lru_cache
+from typing import Dict, Any
+
+from .config import HTTP_POOL_LIMITS, HTTP2_UPSTREAMS, logger
+
+# One pooled client per upstream, created on first use and closed on app shutdown
+_clients: Dict[str, httpx.AsyncClient] = {}
+_request_counts: Dict[str, int] = {}
+# Whether HTTP/2 is actually enabled per client, and the protocol the upstream last answered with
+_http2_enabled: Dict[str, bool] = {}
+_negotiated: Dict[str, str] = {}
+
+
+@lru_cache(maxsize=1)
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _create_client(upstream: str) -> httpx.AsyncClient:
+    limits = HTTP_POOL_LIMITS[upstream]
+    http2 = upstream in HTTP2_UPSTREAMS
+    if http2 and not _http2_available():
+        logger.warning(f"HTTP/2 requested for {upstream} but the 'h2' package is not installed, using HTTP/1.1")
+        http2 = False
+
+    async def count_request(request: httpx.Request):
+        _request_counts[upstream] = _request_counts.get(upstream, 0) + 1
+
+    async def record_protocol(response: httpx.Response):
+        _negotiated[upstream] = response.http_version
+
+    _http2_enabled[upstream] = http2
+    logger.info(f"Creating HTTP pool for {upstream}: {limits} http2={http2}")
+    return httpx.AsyncClient(
+        timeout=limits["timeout"],
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=limits["max_connections"],
+            max_keepalive_connections=limits["max_keepalive_connections"],
+            keepalive_expiry=limits["keepalive_expiry"],
+        ),
+        event_hooks={"request": [count_request], "response": [record_protocol]},
+    )
+
+
+def get_http_client(upstream: str) -> httpx.AsyncClient:
+    """Return the shared client for an upstream ("backend", "ipfs", "ollama" or "groq")"""
+    client = _clients.get(upstream)
+    if client is None or client.is_closed:
+        client = _create_client(upstream)
+        _clients[upstream] = client
+    return client
+
+
+async def close_http_clients():
+    """Close every pooled client; called from the app lifespan"""
+    for upstream, client in list(_clients.items()):
+        await client.aclose()
+        logger.info(f"Closed HTTP pool for {upstream}")
+    _clients.clear()
+
+
+def pool_stats() -> Dict[str, Any]:
+    """Connection pool utilization per upstream"""
+    stats = {}
+    for upstream, limits in HTTP_POOL_LIMITS.items():
+        entry = {
+            "max_connections": limits["max_connections"],
+            "max_keepalive_connections": limits["max_keepalive_connections"],
+            "http2_requested": upstream in HTTP2_UPSTREAMS,
+            # False when requested but the 'h2' package is missing
+            "http2": _http2_enabled.get(upstream, upstream in HTTP2_UPSTREAMS and _http2_available()),
+            "negotiated_protocol": _negotiated.get(upstream),
+            "requests_total": _request_counts.get(upstream, 0),
+            "open": False,
+        }
+        client = _clients.get(upstream)
+        if client is not None and not client.is_closed:
+            # httpx does not expose its httpcore pool publicly
+            pool = getattr(getattr(client, "_transport", None), "_pool", None)
+            connections = list(getattr(pool, "connections", []))
+            idle = sum(1 for c in connections if c.is_idle())
+            entry.update(
+                {
+                    "open": True,
+                    "connections": len(connections),
+                    "idle_connections": idle,
+                    "active_connections": len(connections) - idle,
+                    "queued_requests": sum(1 for r in getattr(pool, "_requests", []) if r.is_queued()),
+                    "utilization": round((len(connections) - idle) / limits["max_connections"], 3),
+                }
+            )
+        stats[upstream] = entry
+    return stats
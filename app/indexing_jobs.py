@@ -0,0 +1,347 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+from fastapi import HTTPException
+
+from .config import (
+    DEFAULT_AUTH_TOKEN,
+    INDEXING_WORKERS,
+    INDEXING_QUEUE_SIZE,
+    INDEXING_JOB_HISTORY,
+    INDEXING_JOBS_PATH,
+    logger,
+)
+from .rag_indexer import process_and_index_photos
+from .sync_state import token_key
+
+# The worker running a job refreshes its row this often (seconds); a queued or
+# running job not refreshed for _STALE_AFTER belongs to a worker that is gone
+_HEARTBEAT_INTERVAL = 2.0
+_STALE_AFTER = 30.0
+# How often a request waiting on another worker's job re-reads it
+_POLL_INTERVAL = 0.5
+
+ACTIVE_STATES = ("queued", "running")
+
+
+class IndexingJob:
+    """One /index-rag run for an auth token, shared by every request with that token while it is pending.
+
+    Jobs created in this worker are `local`: they hold the auth token and the
+    `done` event. Jobs read back from the store are snapshots without either.
+    """
+
+    def __init__(self, caller_key: str, auth_token: Optional[str], max_photos: int, full_sync: bool,
+                 job_id: Optional[str] = None, local: bool = True):
+        self.id = job_id or uuid.uuid4().hex
+        self.caller_key = caller_key
+        self.auth_token = auth_token
+        self.max_photos = max_photos
+        self.full_sync = full_sync
+        self.local = local
+        self.state = "queued"
+        self.progress: Dict[str, Any] = {"phase": "queued"}
+        self.requests = 1
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.done = asyncio.Event()
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "IndexingJob":
+        job = cls(row["caller_key"], None, row["max_photos"], bool(row["full_sync"]), row["id"], local=False)
+        job.state = row["state"]
+        job.progress = json.loads(row["progress"])
+        job.requests = row["requests"]
+        job.created_at = row["created_at"]
+        job.started_at = row["started_at"]
+        job.finished_at = row["finished_at"]
+        job.result = json.loads(row["result"]) if row["result"] else None
+        job.error = row["error"]
+        if job.active and row["updated_at"] < time.time() - _STALE_AFTER:
+            job.state, job.error = "error", "worker lost"
+            job.progress["phase"] = job.state
+        return job
+
+    @property
+    def active(self) -> bool:
+        return self.state in ACTIVE_STATES
+
+    def to_dict(self, include_result: bool = True) -> Dict[str, Any]:
+        data = {
+            "job_id": self.id,
+            "state": self.state,
+            "progress": dict(self.progress),
+            "coalesced_requests": self.requests,
+            "max_photos": self.max_photos,
+            "full_sync": self.full_sync,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+        if include_result:
+            data["result"] = self.result
+        return data
+
+
+class IndexingJobStore:
+    """Job rows shared by every worker through SQLite; auth tokens are never written"""
+
+    def __init__(self, path: str = INDEXING_JOBS_PATH):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        # Calls come from worker threads (asyncio.to_thread)
+        self._lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, caller_key TEXT NOT NULL, state TEXT NOT NULL,"
+                " max_photos INTEGER NOT NULL, full_sync INTEGER NOT NULL, progress TEXT NOT NULL,"
+                " requests INTEGER NOT NULL, created_at REAL NOT NULL, started_at REAL, finished_at REAL,"
+                " updated_at REAL NOT NULL, result TEXT, error TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_caller ON jobs (caller_key, state)")
+            self._conn = conn
+        return self._conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+
+    def claim(self, job: IndexingJob, allow_new: bool = True) -> Optional[IndexingJob]:
+        """The caller's active job, joined, or `job` inserted if there is none (None if not `allow_new`)"""
+        now = time.time()
+        with self._transaction() as db:
+            row = db.execute(
+                "SELECT * FROM jobs WHERE caller_key = ? AND state IN (?, ?) AND updated_at >= ?"
+                " ORDER BY created_at DESC LIMIT 1",
+                (job.caller_key, *ACTIVE_STATES, now - _STALE_AFTER),
+            ).fetchone()
+            if row is not None:
+                if row["state"] == "queued":
+                    # Not started yet, so it can still take on the larger request
+                    db.execute(
+                        "UPDATE jobs SET requests = requests + 1, max_photos = MAX(max_photos, ?),"
+                        " full_sync = MAX(full_sync, ?) WHERE id = ?",
+                        (job.max_photos, int(job.full_sync), row["id"]),
+                    )
+                else:
+                    db.execute("UPDATE jobs SET requests = requests + 1 WHERE id = ?", (row["id"],))
+                return IndexingJob.from_row(db.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+            if not allow_new:
+                return None
+            db.execute(
+                "INSERT INTO jobs (id, caller_key, state, max_photos, full_sync, progress, requests, created_at,"
+                " updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job.id, job.caller_key, job.state, job.max_photos, int(job.full_sync), json.dumps(job.progress),
+                 job.requests, job.created_at, now),
+            )
+            return job
+
+    def start(self, job: IndexingJob):
+        """Mark a local job running, taking on what requests from other workers merged into it"""
+        with self._transaction() as db:
+            row = db.execute("SELECT max_photos, full_sync, requests FROM jobs WHERE id = ?", (job.id,)).fetchone()
+            if row is not None:
+                job.max_photos, job.full_sync, job.requests = row[0], bool(row[1]), row[2]
+            db.execute(
+                "UPDATE jobs SET state = ?, started_at = ?, updated_at = ? WHERE id = ?",
+                (job.state, job.started_at, time.time(), job.id),
+            )
+
+    def finish(self, job: IndexingJob):
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE jobs SET state = ?, progress = ?, finished_at = ?, updated_at = ?, result = ?, error = ?"
+                " WHERE id = ?",
+                (job.state, json.dumps(job.progress), job.finished_at, time.time(),
+                 json.dumps(job.result) if job.result is not None else None, job.error, job.id),
+            )
+
+    def heartbeat(self, jobs: Iterable[IndexingJob]):
+        """Refresh progress and liveness of the jobs this worker holds"""
+        now = time.time()
+        rows = [(json.dumps(job.progress), now, job.id) for job in jobs]
+        if rows:
+            with self._transaction() as db:
+                db.executemany("UPDATE jobs SET progress = ?, updated_at = ? WHERE id = ?", rows)
+
+    def load(self, job_id: str) -> Optional[IndexingJob]:
+        with self._lock:
+            row = self._db().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return IndexingJob.from_row(row) if row else None
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT state, COUNT(*) FROM jobs WHERE state NOT IN (?, ?) OR updated_at >= ? GROUP BY state",
+                (*ACTIVE_STATES, time.time() - _STALE_AFTER),
+            ).fetchall()
+        return {state: count for state, count in rows}
+
+    def trim(self, history: int):
+        """Keep the newest `history` finished jobs, and forget jobs of workers that are gone"""
+        with self._transaction() as db:
+            db.execute(
+                "DELETE FROM jobs WHERE id IN (SELECT id FROM jobs WHERE state NOT IN (?, ?)"
+                " ORDER BY finished_at DESC LIMIT -1 OFFSET ?)",
+                (*ACTIVE_STATES, history),
+            )
+            db.execute(
+                "DELETE FROM jobs WHERE state IN (?, ?) AND updated_at < ?",
+                (*ACTIVE_STATES, time.time() - _STALE_AFTER * 10),
+            )
+
+
+class IndexingJobManager:
+    """Queue of indexing jobs run by a fixed number of workers, at most one active job per auth token.
+
+    Job state lives in a store shared by all uvicorn workers, so any worker can
+    report on a job, and a request joins the token's active job wherever it runs.
+    """
+
+    def __init__(self, workers: int = INDEXING_WORKERS, queue_size: int = INDEXING_QUEUE_SIZE,
+                 history: int = INDEXING_JOB_HISTORY, store: Optional[IndexingJobStore] = None):
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.history = history
+        self.store = store or IndexingJobStore()
+        # Queued and running jobs owned by this process
+        self._local: Dict[str, IndexingJob] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: list = []
+        self._heartbeat_task: Optional[asyncio.Task] = None
+
+    def _ensure_workers(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [task for task in self._tasks if not task.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._worker()))
+        if self._heartbeat_task is None or self._heartbeat_task.done():
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def submit(self, auth_token: Optional[str] = None, max_photos: int = 50,
+                     full_sync: bool = False) -> IndexingJob:
+        """Enqueue a job, or join the queued/running one started with the same token in any worker"""
+        token = auth_token or DEFAULT_AUTH_TOKEN
+        if not token:
+            raise HTTPException(status_code=401, detail="No valid auth token provided")
+
+        self._ensure_workers()
+        job = IndexingJob(token_key(token), auth_token, max_photos, full_sync)
+        claimed = await asyncio.to_thread(self.store.claim, job, not self._queue.full())
+        if claimed is None:
+            raise HTTPException(status_code=429, detail="Indexing queue is full, retry later")
+        if claimed is not job:
+            local = self._local.get(claimed.id)
+            if local is None:
+                return claimed
+            local.requests = claimed.requests
+            return local
+        self._local[job.id] = job
+        self._queue.put_nowait(job)
+        await asyncio.to_thread(self.store.trim, self.history)
+        return job
+
+    async def get(self, job_id: str) -> Optional[IndexingJob]:
+        job = await asyncio.to_thread(self.store.load, job_id)
+        local = self._local.get(job_id)
+        if job is not None and local is not None:
+            # Progress in the store lags by up to one heartbeat
+            job.progress = dict(local.progress)
+        return job
+
+    async def wait(self, job: IndexingJob) -> Optional[IndexingJob]:
+        """The job once finished; another worker's job is polled from the store"""
+        if job.local:
+            await job.done.wait()
+            return job
+        while True:
+            snapshot = await self.get(job.id)
+            if snapshot is None or not snapshot.active:
+                return snapshot
+            await asyncio.sleep(_POLL_INTERVAL)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            job.state, job.started_at = "running", time.time()
+            try:
+                await asyncio.to_thread(self.store.start, job)
+                job.result = await process_and_index_photos(
+                    auth_token=job.auth_token,
+                    max_photos=job.max_photos,
+                    full_sync=job.full_sync,
+                    progress=job.progress,
+                )
+                job.state = "done"
+            except asyncio.CancelledError:
+                job.state, job.error = "error", "cancelled"
+                raise
+            except Exception as e:
+                job.state = "error"
+                job.error = e.detail if isinstance(e, HTTPException) else str(e)
+                logger.error(f"Indexing job {job.id} failed: {job.error}")
+            finally:
+                job.finished_at = time.time()
+                job.progress["phase"] = job.state
+                job.auth_token = None
+                try:
+                    await asyncio.to_thread(self.store.finish, job)
+                except sqlite3.Error as e:
+                    logger.error(f"Indexing job {job.id}: could not store the result: {e}")
+                self._local.pop(job.id, None)
+                job.done.set()
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(_HEARTBEAT_INTERVAL)
+            try:
+                await asyncio.to_thread(self.store.heartbeat, list(self._local.values()))
+            except sqlite3.Error as e:
+                logger.warning(f"Indexing job heartbeat failed: {e}")
+
+    async def stop(self):
+        tasks = self._tasks + ([self._heartbeat_task] if self._heartbeat_task else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks, self._heartbeat_task = [], None
+
+    async def stats(self) -> Dict[str, Any]:
+        counts = await asyncio.to_thread(self.store.counts)
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "queue_size": self.queue_size,
+            "running": sum(1 for job in self._local.values() if job.state == "running"),
+            "jobs_tracked": sum(counts.values()),
+            "all_workers": {state: counts.get(state, 0) for state in (*ACTIVE_STATES, "done", "error")},
+        }
+
+
+indexing_jobs = IndexingJobManager()
@@ -0,0 +1,102 @@
+import asyncio
+import json
+import socket
+import struct
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .config import INFERENCE_SOCKET, INFERENCE_TIMEOUT
+
+# Wire format, both directions: 4-byte big-endian header length, JSON header,
+# then header["payload_size"] bytes of raw array data.
+_HEADER_SIZE = struct.Struct(">I")
+
+
+def encode_message(header: Dict[str, Any], payload: bytes = b"") -> bytes:
+    header = {**header, "payload_size": len(payload)}
+    raw_header = json.dumps(header).encode("utf-8")
+    return _HEADER_SIZE.pack(len(raw_header)) + raw_header + payload
+
+
+async def read_message(reader: asyncio.StreamReader) -> Tuple[Dict[str, Any], bytes]:
+    (header_size,) = _HEADER_SIZE.unpack(await reader.readexactly(_HEADER_SIZE.size))
+    header = json.loads(await reader.readexactly(header_size))
+    payload = await reader.readexactly(header["payload_size"]) if header["payload_size"] else b""
+    return header, payload
+
+
+def pack_images(images: List[Any]) -> Tuple[List[Dict[str, Any]], bytes]:
+    """Arrays travel as raw uint8 bytes; temp-file paths are sent as paths (same host)"""
+    entries, chunks = [], []
+    for image in images:
+        if isinstance(image, str):
+            entries.append({"path": image})
+        else:
+            image = np.ascontiguousarray(image, dtype=np.uint8)
+            entries.append({"shape": list(image.shape)})
+            chunks.append(image.tobytes())
+    return entries, b"".join(chunks)
+
+
+def unpack_images(entries: List[Dict[str, Any]], payload: bytes) -> List[Any]:
+    images, offset = [], 0
+    for entry in entries:
+        if "path" in entry:
+            images.append(entry["path"])
+            continue
+        size = int(np.prod(entry["shape"]))
+        images.append(np.frombuffer(payload, dtype=np.uint8, count=size, offset=offset).reshape(entry["shape"]))
+        offset += size
+    return images
+
+
+def _raise_for_error(header: Dict[str, Any]):
+    if not header.get("ok"):
+        raise RuntimeError(f"Inference server error: {header.get('error')}")
+
+
+async def _request(header: Dict[str, Any], payload: bytes = b"") -> Tuple[Dict[str, Any], bytes]:
+    reader, writer = await asyncio.wait_for(asyncio.open_unix_connection(INFERENCE_SOCKET), INFERENCE_TIMEOUT)
+    try:
+        writer.write(encode_message(header, payload))
+        await writer.drain()
+        response, data = await asyncio.wait_for(read_message(reader), INFERENCE_TIMEOUT)
+    finally:
+        writer.close()
+    _raise_for_error(response)
+    return response, data
+
+
+async def remote_classify(images: List[Any]) -> List[Tuple[Optional[str], bool, float]]:
+    """Food/general cascade on the inference server, batched with other workers' images"""
+    entries, payload = pack_images(images)
+    response, _ = await _request({"op": "classify", "images": entries}, payload)
+    return [tuple(p) for p in response["predictions"]]
+
+
+async def remote_embed(texts: List[str]) -> np.ndarray:
+    response, data = await _request({"op": "embed", "texts": texts})
+    return np.frombuffer(data, dtype=np.float32).reshape(response["shape"])
+
+
+async def remote_status() -> Dict[str, Any]:
+    try:
+        response, _ = await _request({"op": "status"})
+        return response["status"]
+    except Exception as e:
+        return {"indexing": False, "error": str(e)}
+
+
+def remote_embed_sync(texts: List[str]) -> np.ndarray:
+    """Blocking variant for sync callers (memoized query embeddings)"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(INFERENCE_TIMEOUT)
+        sock.connect(INFERENCE_SOCKET)
+        sock.sendall(encode_message({"op": "embed", "texts": texts}))
+        stream = sock.makefile("rb")
+        (header_size,) = _HEADER_SIZE.unpack(stream.read(_HEADER_SIZE.size))
+        response = json.loads(stream.read(header_size))
+        data = stream.read(response["payload_size"]) if response["payload_size"] else b""
+    _raise_for_error(response)
+    return np.frombuffer(data, dtype=np.float32).reshape(response["shape"])
@@ -0,0 +1,226 @@
+"""
+Selectable inference backend for the YOLO classifiers and the embedder.
+
+INFERENCE_BACKEND picks "torch" (stock ultralytics/SentenceTransformer), "onnx"
+(ONNX Runtime) or "openvino"; INFERENCE_INT8 picks the int8-quantized export.
+Exported artifacts live next to the original weights and are produced with:
+
+    python -m app.inference_engine convert --backend onnx --int8
+    python -m app.inference_engine compare --backend onnx --int8 --images ./samples --report report.json
+
+Missing artifacts fall back to the torch models with a warning.
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+from typing import Any, Dict, List
+
+from .config import (
+    INFERENCE_BACKEND,
+    INFERENCE_INT8,
+    YOLO_MODEL_PATH,
+    YOLO_GENERAL_CLS_MODEL_PATH,
+    EMBEDDING_MODEL_NAME,
+    CLASSIFIER_IMAGE_SIZE,
+    logger,
+)
+
+BACKENDS = ("torch", "onnx", "openvino")
+# Embedder exports go under ./weights next to the YOLO weights
+EMBEDDER_EXPORT_DIR = os.path.join(os.path.dirname(YOLO_MODEL_PATH) or ".", "embedder")
+ONNX_INT8_EMBEDDER_FILE = "onnx/model_qint8_avx2.onnx"
+
+
+def model_version(backend: str = INFERENCE_BACKEND, int8: bool = INFERENCE_INT8) -> str:
+    return f"{backend}-int8" if int8 and backend != "torch" else backend
+
+
+def classifier_artifact(weights_path: str, backend: str = INFERENCE_BACKEND, int8: bool = INFERENCE_INT8) -> str:
+    """Path ultralytics writes (and loads) the exported classifier at"""
+    stem, _ = os.path.splitext(weights_path)
+    if backend == "onnx":
+        return f"{stem}.int8.onnx" if int8 else f"{stem}.onnx"
+    if backend == "openvino":
+        return f"{stem}_int8_openvino_model" if int8 else f"{stem}_openvino_model"
+    return weights_path
+
+
+def embedder_artifact(backend: str = INFERENCE_BACKEND) -> str:
+    return f"{EMBEDDER_EXPORT_DIR}-{backend}"
+
+
+def load_classifier(weights_path: str, backend: str = INFERENCE_BACKEND, int8: bool = INFERENCE_INT8):
+    from ultralytics import YOLO
+
+    path = classifier_artifact(weights_path, backend, int8)
+    if backend != "torch" and not os.path.exists(path):
+        logger.warning(f"{path} not found, run `python -m app.inference_engine convert`; using torch weights")
+        path = weights_path
+    return YOLO(path, task="classify")
+
+
+def load_embedder(model_name: str = EMBEDDING_MODEL_NAME, backend: str = INFERENCE_BACKEND,
+                  int8: bool = INFERENCE_INT8):
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "torch":
+        return SentenceTransformer(model_name)
+
+    path = embedder_artifact(backend)
+    if not os.path.isdir(path):
+        logger.warning(f"{path} not found, run `python -m app.inference_engine convert`; using torch embedder")
+        return SentenceTransformer(model_name)
+    model_kwargs = {"file_name": ONNX_INT8_EMBEDDER_FILE} if int8 and backend == "onnx" else {}
+    return SentenceTransformer(path, backend=backend, model_kwargs=model_kwargs)
+
+
+def export_classifier(weights_path: str, backend: str, int8: bool) -> str:
+    from ultralytics import YOLO
+
+    model = YOLO(weights_path)
+    if backend == "openvino":
+        # ultralytics calibrates int8 OpenVINO exports itself
+        model.export(format="openvino", imgsz=CLASSIFIER_IMAGE_SIZE, dynamic=True, int8=int8)
+    else:
+        model.export(format="onnx", imgsz=CLASSIFIER_IMAGE_SIZE, dynamic=True)
+        if int8:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            quantize_dynamic(
+                classifier_artifact(weights_path, "onnx", False),
+                classifier_artifact(weights_path, "onnx", True),
+                weight_type=QuantType.QUInt8,
+            )
+    return classifier_artifact(weights_path, backend, int8)
+
+
+def export_embedder(model_name: str, backend: str, int8: bool) -> str:
+    from sentence_transformers import SentenceTransformer
+
+    path = embedder_artifact(backend)
+    # Loading with a non-torch backend exports the model on the fly
+    model = SentenceTransformer(model_name, backend=backend)
+    model.save(path)
+    if int8:
+        if backend == "onnx":
+            from sentence_transformers import export_dynamic_quantized_onnx_model
+            export_dynamic_quantized_onnx_model(model, "avx2", path)
+        else:
+            logger.warning("int8 embedder export is only supported for onnx; keeping fp32 OpenVINO embedder")
+    return path
+
+
+def _latency_summary(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        "mean_ms": round(statistics.mean(ordered) * 1000, 3),
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+    }
+
+
+def _compare_classifier(reference, candidate, images: List[Any]) -> Dict[str, Any]:
+    from .rag_indexer import predict_batch_with_model
+
+    results = {}
+    agree, conf_diff = 0, []
+    for name, model in (("reference", reference), ("candidate", candidate)):
+        predict_batch_with_model(images[:1], model, "Warmup")
+        per_image, predictions = [], []
+        for image in images:
+            started = time.perf_counter()
+            predictions.append(predict_batch_with_model([image], model, name))
+            per_image.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        predict_batch_with_model(images, model, name)
+        batch_seconds = time.perf_counter() - started
+        results[name] = {
+            "per_image": _latency_summary(per_image),
+            "batched_images_per_sec": round(len(images) / batch_seconds, 2),
+            "predictions": [p[0] for p in predictions],
+        }
+    for (ref_class, ref_score), (cand_class, cand_score) in zip(
+        results["reference"].pop("predictions"), results["candidate"].pop("predictions")
+    ):
+        agree += ref_class == cand_class
+        conf_diff.append(abs(ref_score - cand_score))
+    results["top1_agreement"] = round(agree / len(images), 4)
+    results["mean_abs_confidence_diff"] = round(statistics.mean(conf_diff), 4)
+    return results
+
+
+def _compare_embedder(reference, candidate, texts: List[str]) -> Dict[str, Any]:
+    import numpy as np
+
+    results = {}
+    vectors = {}
+    for name, model in (("reference", reference), ("candidate", candidate)):
+        model.encode(texts[:1])
+        per_text = []
+        for text in texts:
+            started = time.perf_counter()
+            model.encode([text])
+            per_text.append(time.perf_counter() - started)
+        vectors[name] = np.asarray(model.encode(texts, normalize_embeddings=True))
+        results[name] = {"per_text": _latency_summary(per_text)}
+    cosine = (vectors["reference"] * vectors["candidate"]).sum(axis=1)
+    results["mean_cosine_similarity"] = round(float(cosine.mean()), 5)
+    results["min_cosine_similarity"] = round(float(cosine.min()), 5)
+    return results
+
+
+def compare(images_dir: str, backend: str, int8: bool) -> Dict[str, Any]:
+    """Accuracy and latency of the exported models against the torch models on a sample set"""
+    from .rag_indexer import decode_image
+
+    paths = sorted(
+        os.path.join(images_dir, f) for f in os.listdir(images_dir)
+        if f.lower().endswith((".jpg", ".jpeg", ".png", ".webp"))
+    )
+    if not paths:
+        raise SystemExit(f"No images found in {images_dir}")
+    images = []
+    for path in paths:
+        with open(path, "rb") as f:
+            images.append(decode_image(f.read()))
+
+    report = {"backend": model_version(backend, int8), "images": len(images), "classifiers": {}}
+    for label, weights in (("food", YOLO_MODEL_PATH), ("general", YOLO_GENERAL_CLS_MODEL_PATH)):
+        report["classifiers"][label] = _compare_classifier(
+            load_classifier(weights, "torch", False), load_classifier(weights, backend, int8), images
+        )
+
+    reference_food = load_classifier(YOLO_MODEL_PATH, "torch", False)
+    texts = [f"Người dùng đăng ảnh món {name} vào ngày 2024-01-01." for name in list(reference_food.names.values())[:64]]
+    report["embedder"] = _compare_embedder(
+        load_embedder(EMBEDDING_MODEL_NAME, "torch", False), load_embedder(EMBEDDING_MODEL_NAME, backend, int8), texts
+    )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export and compare CPU inference backends")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("convert", "compare"):
+        cmd = sub.add_parser(name)
+        cmd.add_argument("--backend", choices=BACKENDS[1:], default="onnx")
+        cmd.add_argument("--int8", action="store_true")
+        if name == "compare":
+            cmd.add_argument("--images", required=True, help="Directory of sample images")
+            cmd.add_argument("--report", default="inference_report.json")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        for weights in (YOLO_MODEL_PATH, YOLO_GENERAL_CLS_MODEL_PATH):
+            print(f"Exported {weights} -> {export_classifier(weights, args.backend, args.int8)}")
+        print(f"Exported {EMBEDDING_MODEL_NAME} -> {export_embedder(EMBEDDING_MODEL_NAME, args.backend, args.int8)}")
+    else:
+        report = compare(args.images, args.backend, args.int8)
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Out-of-process inference server owning the YOLO classifiers and the embedder.
+
+API workers started with INFERENCE_SOCKET set send classification and embedding
+requests here over a Unix socket, so the models are loaded once per host and
+images from concurrent indexing runs in every worker are batched together.
+
+    python -m app.inference_server
+"""
+import asyncio
+import os
+from typing import Any, Callable, List
+
+import numpy as np
+
+from .config import (
+    INFERENCE_SOCKET,
+    CLASSIFY_BATCH_SIZE,
+    CLASSIFY_BATCH_WAIT,
+    EMBED_BATCH_SIZE,
+    logger,
+)
+from .inference_client import encode_message, read_message, unpack_images
+from .model_registry import get_embedding_model, readiness
+from . import rag_indexer
+from .rag_indexer import predict_food_or_general_scored_batch, run_inference, warmup
+
+# This process owns the models
+rag_indexer.remote_inference = False
+
+
+class CrossRequestBatcher:
+    """Merges items from concurrent requests into one model call of up to `max_items`"""
+
+    def __init__(self, name: str, run_batch: Callable[[List[Any]], Any], max_items: int, wait: float):
+        self.name = name
+        self.run_batch = run_batch
+        self.max_items = max_items
+        self.wait = wait
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    async def submit(self, items: List[Any]) -> List[Any]:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((items, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            requests = [await self.queue.get()]
+            count = len(requests[0][0])
+            deadline = loop.time() + self.wait
+            while count < self.max_items:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                requests.append(request)
+                count += len(request[0])
+
+            flat = [item for items, _ in requests for item in items]
+            try:
+                results = await run_inference(self.run_batch, flat)
+            except Exception as e:
+                for _, future in requests:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            logger.debug(f"[{self.name}] ran {len(flat)} items from {len(requests)} requests")
+            offset = 0
+            for items, future in requests:
+                if not future.done():
+                    future.set_result(results[offset:offset + len(items)])
+                offset += len(items)
+
+
+def _embed(texts: List[str]) -> np.ndarray:
+    return np.asarray(get_embedding_model().encode(texts, batch_size=EMBED_BATCH_SIZE), dtype=np.float32)
+
+
+classify_batcher = CrossRequestBatcher("classify", predict_food_or_general_scored_batch, CLASSIFY_BATCH_SIZE, CLASSIFY_BATCH_WAIT)
+embed_batcher = CrossRequestBatcher("embed", _embed, EMBED_BATCH_SIZE, CLASSIFY_BATCH_WAIT)
+
+
+async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            try:
+                header, payload = await read_message(reader)
+            except asyncio.IncompleteReadError:
+                break
+            try:
+                if header["op"] == "classify":
+                    images = unpack_images(header["images"], payload)
+                    predictions = await classify_batcher.submit(images)
+                    writer.write(encode_message({"ok": True, "predictions": [list(p) for p in predictions]}))
+                elif header["op"] == "embed":
+                    vectors = np.ascontiguousarray(await embed_batcher.submit(header["texts"]), dtype=np.float32)
+                    writer.write(encode_message({"ok": True, "shape": list(vectors.shape)}, vectors.tobytes()))
+                elif header["op"] == "status":
+                    writer.write(encode_message({"ok": True, "status": readiness(local_models=True, vector_store=False)}))
+                else:
+                    writer.write(encode_message({"ok": False, "error": f"Unknown op {header['op']}"}))
+            except Exception as e:
+                logger.error(f"Inference request failed: {e}")
+                writer.write(encode_message({"ok": False, "error": str(e)}))
+            await writer.drain()
+    finally:
+        writer.close()
+
+
+async def serve(socket_path: str):
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    # Load and warm the classifiers and the embedder before accepting work; Chroma
+    # belongs to the API workers, so it is not opened here
+    await run_inference(warmup, ["món ăn"], False)
+    batchers = [asyncio.create_task(classify_batcher.run()), asyncio.create_task(embed_batcher.run())]
+
+    server = await asyncio.start_unix_server(handle_connection, path=socket_path)
+    logger.info(f"Inference server listening on {socket_path}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        for task in batchers:
+            task.cancel()
+
+
+if __name__ == "__main__":
+    asyncio.run(serve(INFERENCE_SOCKET or "/tmp/truegift-inference.sock"))
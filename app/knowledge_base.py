@@ -0,0 +1,114 @@
+import difflib
+import json
+import os
+import re
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from .config import logger
+
+CRAWLED_JSON_PATH = "extracted_food_data.json"
+
+
+def normalize_food_name(name: str) -> str:
+    name = name.lower().strip()
+    name = re.sub(r"\s+", " ", name)
+    return name
+
+
+def trigrams(name: str) -> set:
+    padded = f"  {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FoodKnowledgeBase:
+    """Crawled food data loaded once and indexed by normalized name and by trigram.
+
+    The file's mtime is re-checked at most every `check_interval` seconds and the
+    indexes are rebuilt when it changes.
+    """
+
+    def __init__(self, path: str = CRAWLED_JSON_PATH, cutoff: float = 0.8,
+                 check_interval: float = 2.0, fuzzy_candidates: int = 25):
+        self.path = path
+        self.cutoff = cutoff
+        self.check_interval = check_interval
+        self.fuzzy_candidates = fuzzy_candidates
+
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._items: List[Dict[str, Any]] = []
+        self._by_name: Dict[str, Dict[str, Any]] = {}
+        self._trigram_index: Dict[str, List[str]] = {}
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.error(f"Lỗi khi đọc file JSON: {str(e)}")
+            return
+
+        # Lọc các mục không có error
+        items = [item for item in data if not item.get("error", False)]
+        by_name = {}
+        for item in items:
+            by_name.setdefault(normalize_food_name(item.get("name", "")), item)
+        trigram_index: Dict[str, List[str]] = {}
+        for name in by_name:
+            for gram in trigrams(name):
+                trigram_index.setdefault(gram, []).append(name)
+
+        # Swap the indexes in together so readers never see a half-built state
+        self._items, self._by_name, self._trigram_index = items, by_name, trigram_index
+        logger.debug(f"Đã đọc {len(items)} món ăn hợp lệ từ file JSON")
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if self._mtime is not None and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            if self._mtime is None:
+                logger.error(f"File {self.path} không tồn tại")
+                self._mtime = 0.0
+            return
+        if mtime != self._mtime:
+            self._mtime = mtime
+            self._load()
+
+    def items(self) -> List[Dict[str, Any]]:
+        self._maybe_reload()
+        return self._items
+
+    def get(self, food_name: str) -> Optional[Dict[str, Any]]:
+        """Exact lookup by normalized name"""
+        self._maybe_reload()
+        return self._by_name.get(normalize_food_name(food_name))
+
+    def closest_name(self, food_name: str) -> Optional[str]:
+        """Closest normalized name, scored with difflib on the best trigram candidates only"""
+        self._maybe_reload()
+        normalized_name = normalize_food_name(food_name)
+        overlap = Counter()
+        for gram in trigrams(normalized_name):
+            overlap.update(self._trigram_index.get(gram, ()))
+        candidates = [name for name, _ in overlap.most_common(self.fuzzy_candidates)]
+        closest = difflib.get_close_matches(normalized_name, candidates, n=1, cutoff=self.cutoff)
+        return closest[0] if closest else None
+
+    def lookup(self, food_name: str) -> tuple[Optional[Dict[str, Any]], bool]:
+        """Return (item, exact_match); falls back to the fuzzy index on a miss"""
+        item = self.get(food_name)
+        if item is not None:
+            return item, True
+        closest = self.closest_name(food_name)
+        if closest:
+            return self._by_name[closest], False
+        return None, False
+
+
+food_knowledge_base = FoodKnowledgeBase()
@@ -0,0 +1,281 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional
+
+from .config import (
+    LLM_PROVIDER_ORDER,
+    LLM_STATS_WINDOW,
+    LLM_BREAKER_FAILURES,
+    LLM_BREAKER_ERROR_RATE,
+    LLM_BREAKER_COOLDOWN,
+    LLM_HEDGE,
+    LLM_HEDGE_MIN_DELAY,
+    LLM_HEALTH_TTL,
+    logger,
+)
+from .metrics import ERRORS, LLM_SECONDS, LLM_TOKENS, LLM_TTFT_SECONDS
+from .prompt_builder import count_tokens
+from .groq_client import ask_groq, iter_groq_stream, check_groq_status
+from .ollama_client import ask_ollama, iter_ollama_stream, check_ollama_status
+
+# Error rates are only trusted once the window holds this many calls
+_MIN_SAMPLES = 10
+
+
+def _percentile(samples, q: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+class Provider:
+    """An LLM backend with rolling latency/error stats, a circuit breaker and a cached health probe"""
+
+    def __init__(
+        self,
+        name: str,
+        complete: Callable[..., Awaitable[str]],
+        stream: Callable[..., AsyncGenerator[str, None]],
+        probe: Callable[[], Awaitable[Dict[str, Any]]],
+        window: int = LLM_STATS_WINDOW,
+    ):
+        self.name = name
+        self._complete = complete
+        self._stream = stream
+        self._probe = probe
+        self.latencies: deque = deque(maxlen=window)
+        self.ttfts: deque = deque(maxlen=window)
+        self.outcomes: deque = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+        self._health: Optional[Dict[str, Any]] = None
+        self._health_at = 0.0
+        self._health_lock = asyncio.Lock()
+        # Metric children bound once, off the request path
+        self._complete_seconds = LLM_SECONDS.labels(name, "complete")
+        self._stream_seconds = LLM_SECONDS.labels(name, "stream")
+        self._ttft_seconds = LLM_TTFT_SECONDS.labels(name)
+        self._prompt_tokens = LLM_TOKENS.labels(name, "prompt")
+        self._completion_tokens = LLM_TOKENS.labels(name, "completion")
+        self._errors = ERRORS.labels(f"llm_{name}")
+
+    # Circuit breaker: closed -> open after failures -> one half-open trial after the cooldown
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= LLM_BREAKER_COOLDOWN:
+            return "half_open"
+        return "open"
+
+    def available(self) -> bool:
+        state = self.state
+        return state == "closed" or (state == "half_open" and not self._trial_running)
+
+    def _begin(self):
+        if self.state == "half_open":
+            self._trial_running = True
+
+    def record_success(self, latency: float, ttft: Optional[float] = None):
+        self.latencies.append(latency)
+        if ttft is not None:
+            self.ttfts.append(ttft)
+        self.outcomes.append(True)
+        self.consecutive_failures = 0
+        if self.opened_at is not None:
+            logger.info(f"LLM provider {self.name} recovered, closing circuit")
+        self.opened_at, self._trial_running = None, False
+
+    def record_failure(self, error: Exception):
+        self._errors.inc()
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+        self._trial_running = False
+        if self.opened_at is not None or self.consecutive_failures >= LLM_BREAKER_FAILURES or (
+            len(self.outcomes) >= _MIN_SAMPLES and self.error_rate() >= LLM_BREAKER_ERROR_RATE
+        ):
+            if self.opened_at is None:
+                logger.warning(f"LLM provider {self.name} failing ({error}), opening circuit")
+            self.opened_at = time.monotonic()
+
+    def error_rate(self) -> float:
+        return (self.outcomes.count(False) / len(self.outcomes)) if self.outcomes else 0.0
+
+    def p95(self) -> Optional[float]:
+        return _percentile(self.latencies, 0.95) if len(self.latencies) >= _MIN_SAMPLES else None
+
+    async def complete(self, prompt: str, **kwargs) -> str:
+        self._begin()
+        started = time.perf_counter()
+        try:
+            response = await self._complete(prompt, **kwargs)
+        except asyncio.CancelledError:
+            # Lost a hedge race: not the provider's fault
+            self._trial_running = False
+            raise
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        latency = time.perf_counter() - started
+        self.record_success(latency)
+        self._complete_seconds.observe(latency)
+        self._prompt_tokens.inc(count_tokens(prompt))
+        self._completion_tokens.inc(count_tokens(response))
+        return response
+
+    async def health(self) -> Dict[str, Any]:
+        """Upstream status, probed at most once per LLM_HEALTH_TTL however many callers ask"""
+        async with self._health_lock:
+            if self._health is None or time.monotonic() - self._health_at >= LLM_HEALTH_TTL:
+                self._health = await self._probe()
+                self._health_at = time.monotonic()
+        return {**self._health, "router": self.stats()}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "circuit": self.state,
+            "calls": len(self.outcomes),
+            "error_rate": round(self.error_rate(), 3),
+            "consecutive_failures": self.consecutive_failures,
+            "latency_p50_ms": round(_percentile(self.latencies, 0.5) * 1000, 1) if self.latencies else None,
+            "latency_p95_ms": round(_percentile(self.latencies, 0.95) * 1000, 1) if self.latencies else None,
+            "ttft_p50_ms": round(_percentile(self.ttfts, 0.5) * 1000, 1) if self.ttfts else None,
+            "ttft_p95_ms": round(_percentile(self.ttfts, 0.95) * 1000, 1) if self.ttfts else None,
+        }
+
+
+class LLMRouter:
+    """Sends each LLM call to the preferred healthy provider, failing over to the others.
+
+    Completions can be hedged: if the first provider has not answered within its
+    p95 latency, the next one is asked too and the first answer wins.
+    """
+
+    def __init__(self, providers: List[Provider], order: List[str] = LLM_PROVIDER_ORDER, hedge: bool = LLM_HEDGE):
+        self.providers = {p.name: p for p in providers}
+        self.order = [name for name in order if name in self.providers] or list(self.providers)
+        self.hedge = hedge
+
+    def candidates(self, preferred: Optional[str] = None) -> List[Provider]:
+        """Preferred provider first, then the configured order; open circuits go last"""
+        names = ([preferred] if preferred in self.providers else []) + [n for n in self.order if n != preferred]
+        ordered = [self.providers[n] for n in names]
+        # With every circuit open, still try them rather than fail outright
+        return [p for p in ordered if p.available()] + [p for p in ordered if not p.available()]
+
+    @staticmethod
+    def _kwargs_for(provider: Provider, preferred: Optional[str], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        # A model name only means something to the provider it was chosen for
+        if provider.name != (preferred or provider.name):
+            return {k: v for k, v in kwargs.items() if k != "model"}
+        return kwargs
+
+    async def complete(self, prompt: str, preferred: Optional[str] = None, **kwargs) -> str:
+        candidates = self.candidates(preferred)
+        errors = []
+        while candidates:
+            primary = candidates.pop(0)
+            delay = primary.p95()
+            if self.hedge and candidates and delay is not None:
+                backup = candidates.pop(0)
+                try:
+                    return await self._hedged(primary, backup, max(delay, LLM_HEDGE_MIN_DELAY), prompt, preferred, kwargs)
+                except Exception as e:
+                    errors.append(f"{primary.name}+{backup.name}: {e}")
+                    continue
+            try:
+                return await primary.complete(prompt, **self._kwargs_for(primary, preferred, kwargs))
+            except Exception as e:
+                logger.warning(f"LLM provider {primary.name} failed, trying next: {e}")
+                errors.append(f"{primary.name}: {e}")
+        raise Exception(f"All LLM providers failed: {'; '.join(errors)}")
+
+    async def _hedged(self, primary: Provider, backup: Provider, delay: float, prompt: str,
+                      preferred: Optional[str], kwargs: Dict[str, Any]) -> str:
+        first = asyncio.create_task(primary.complete(prompt, **self._kwargs_for(primary, preferred, kwargs)))
+        tasks = [first]
+        try:
+            done, _ = await asyncio.wait({first}, timeout=delay)
+            if not done or first.exception() is not None:
+                logger.info(f"Hedging LLM request to {backup.name} after {delay:.2f}s")
+                tasks.append(asyncio.create_task(backup.complete(prompt, **self._kwargs_for(backup, preferred, kwargs))))
+            error: Optional[Exception] = None
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    return await next_done
+                except Exception as e:
+                    error = e
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def stream(self, prompt: str, preferred: Optional[str] = None, **kwargs) -> AsyncGenerator[str, None]:
+        """Yield deltas from the first provider that produces any; mid-stream errors are raised"""
+        errors = []
+        for provider in self.candidates(preferred):
+            provider._begin()
+            started = time.perf_counter()
+            ttft = None
+            chunks = 0
+            stream = provider._stream(prompt, **self._kwargs_for(provider, preferred, kwargs))
+            try:
+                async for content in stream:
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+                        provider._ttft_seconds.observe(ttft)
+                    chunks += 1
+                    yield content
+            except Exception as e:
+                provider.record_failure(e)
+                if ttft is not None:
+                    raise
+                logger.warning(f"LLM provider {provider.name} failed before the first token, trying next: {e}")
+                errors.append(f"{provider.name}: {e}")
+                continue
+            finally:
+                await stream.aclose()
+                # A client disconnect ends the trial without a verdict
+                provider._trial_running = False
+                if ttft is not None:
+                    provider._prompt_tokens.inc(count_tokens(prompt))
+                    provider._completion_tokens.inc(chunks)
+            latency = time.perf_counter() - started
+            provider.record_success(latency, ttft)
+            provider._stream_seconds.observe(latency)
+            return
+        raise Exception(f"All LLM providers failed: {'; '.join(errors)}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "order": self.order,
+            "hedge": self.hedge,
+            "providers": {name: p.stats() for name, p in self.providers.items()},
+        }
+
+
+async def _ollama_complete(prompt: str, temperature: float = 0.7, max_tokens: Optional[int] = None, **_) -> str:
+    return await ask_ollama(prompt, temperature=temperature, max_tokens=max_tokens)
+
+
+def _ollama_stream(prompt: str, temperature: float = 0.7, max_tokens: Optional[int] = None,
+                   **_) -> AsyncGenerator[str, None]:
+    return iter_ollama_stream(prompt, temperature=temperature, max_tokens=max_tokens)
+
+
+llm_router = LLMRouter([
+    Provider("groq", ask_groq, iter_groq_stream, check_groq_status),
+    Provider("ollama", _ollama_complete, _ollama_stream, check_ollama_status),
+])
+
+
+async def stream_chat(prompt: str, preferred: Optional[str] = None, **kwargs) -> AsyncGenerator[str, None]:
+    """Routed stream for plain-text responses: errors become an "Error: ..." chunk like stream_groq"""
+    try:
+        async for content in llm_router.stream(prompt, preferred, **kwargs):
+            yield content
+    except Exception as e:
+        yield f"Error: {str(e)}"
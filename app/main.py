@@ -1,15 +1,49 @@
+import asyncio
+from contextlib import asynccontextmanager
 from typing import Optional
-from fastapi import FastAPI, HTTPException, Query
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 import uvicorn
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from .backend_client import BackendClient
-from .ollama_client import check_ollama_status, ask_ollama, stream_ollama
-from .groq_client import check_groq_status, ask_groq, stream_groq
-from .rag_indexer import process_and_index_photos, collection
-from .suggestion_service import generate_suggestion_by_prompt, get_available_prompts
-from pydantic import BaseModel
+from .http_pool import close_http_clients, pool_stats
+from .config import WARMUP_ON_STARTUP, INFERENCE_SOCKET, OLLAMA_PRELOAD, PROFILING_ENABLED
+from .inference_client import remote_status
+from .ollama_client import ask_ollama, preload_ollama_model
+from .groq_client import ask_groq
+from .llm_router import llm_router, stream_chat
+from .rag_indexer import run_inference, warmup
+from .photo_listing import list_food_photos
+from .indexing_jobs import indexing_jobs
+from .model_registry import readiness
+from .suggestion_service import (
+    generate_suggestion_by_prompt,
+    stream_suggestion_by_prompt,
+    get_available_prompts,
+    FOOD_QUERY,
+)
+from .suggestion_cache import suggestion_cache
+from .prediction_cache import prediction_cache
+from .metrics import registry
+from .profiling import profiler, ProfileMiddleware
+from pydantic import BaseModel, Field
 
-app = FastAPI(title="TrueGift RAG Indexer", debug=False)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if WARMUP_ON_STARTUP:
+        # Chat routes are served right away; indexing is ready once /ready says so
+        app.state.warmup_task = asyncio.create_task(run_inference(warmup, [FOOD_QUERY, "món ăn"]))
+    if OLLAMA_PRELOAD:
+        app.state.ollama_preload_task = asyncio.create_task(preload_ollama_model())
+    profiler.start_monitor()
+    yield
+    await profiler.stop_monitor()
+    await indexing_jobs.stop()
+    await close_http_clients()
+
+app = FastAPI(title="TrueGift RAG Indexer", debug=False, lifespan=lifespan)
+if PROFILING_ENABLED:
+    app.add_middleware(ProfileMiddleware)
 client = BackendClient()
 
 class OllamaRequest(BaseModel):
@@ -21,6 +55,11 @@ class GroqRequest(BaseModel):
     temperature: Optional[float] = 0.7
     max_tokens: Optional[int] = 1024
 
+class IndexJobRequest(BaseModel):
+    auth_token: Optional[str] = None
+    max_photos: int = Field(50, ge=1)
+    full: bool = False
+
 class ChatRequest(BaseModel):
     prompt: str
     model: Optional[str] = None
@@ -29,67 +68,142 @@ class ChatRequest(BaseModel):
     stream: Optional[bool] = True
     provider: Optional[str] = "groq"  # Change default from "ollama" to "groq"
 
+@app.get("/ready")
+async def ready(scope: str = "chat"):
+    """
+    Per-component load state. Returns 503 until the requested scope
+    ("chat" or "indexing") can be served.
+    """
+    status = readiness(local_models=not INFERENCE_SOCKET)
+    if INFERENCE_SOCKET:
+        status["inference_server"] = await remote_status()
+        status["indexing"] = status["indexing"] and status["inference_server"].get("indexing", False)
+    if not status.get(scope, False):
+        return JSONResponse(status_code=503, content=status)
+    return status
+
 @app.get("/index-rag")
 async def index_photos_for_current_user(
-    auth_token: Optional[str] = None
+    auth_token: Optional[str] = None,
+    max_photos: int = Query(50, ge=1),
+    full: bool = False,
 ):
+    """
+    Index photos added since the last sync; `full=true` ignores the sync watermarks.
+    Waits for the user's indexing job, joining it if one is already queued or running.
+    """
+    job = await indexing_jobs.submit(auth_token=auth_token, max_photos=max_photos, full_sync=full)
+    job = await indexing_jobs.wait(job)
+    if job is None:
+        raise HTTPException(status_code=500, detail="Indexing job lost")
+    if job.state != "done":
+        raise HTTPException(status_code=500, detail=job.error)
 
-    token = auth_token
-    try:
-       result = await process_and_index_photos(auth_token=token, max_photos=50)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return job.result
 
-    return result
+@app.post("/index-rag/jobs", status_code=202)
+async def enqueue_indexing_job(request: IndexJobRequest):
+    """
+    Queue an indexing job and return its id; a user with a pending job gets that job back
+    """
+    job = await indexing_jobs.submit(auth_token=request.auth_token, max_photos=request.max_photos, full_sync=request.full)
+    return job.to_dict(include_result=False)
 
-@app.get("/query-food-photos")
-def query_food_photos(user_id: Optional[str] = Query(None), limit: int = 10):
-    """Truy vấn các ảnh món ăn đã được index trong ChromaDB"""
+@app.get("/index-rag/jobs")
+async def indexing_job_stats():
+    """
+    Worker pool and queue occupancy of the indexing job runner
+    """
+    return await indexing_jobs.stats()
 
-    # Xây dựng filter
-    where_filter = {"is_food": True}
-    if user_id:
-        where_filter["user_id"] = user_id
+@app.get("/index-rag/jobs/{job_id}")
+async def indexing_job_status(job_id: str):
+    """
+    State, progress and (once finished) result of an indexing job
+    """
+    job = await indexing_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
 
-    try:
-        results = collection.query(
-            query_texts=["món ăn"],
-            n_results=limit,
-            where=where_filter,
-            include=["metadatas", "documents"]
-        )
+@app.get("/index-rag/cache-stats")
+async def prediction_cache_stats():
+    """
+    Hit rate and size of the persistent classification cache
+    """
+    return await asyncio.to_thread(prediction_cache.stats)
 
-        response = []
-        for meta, caption in zip(results["metadatas"][0], results["documents"][0]):
-            response.append({
-                "photo_id": meta["photo_id"],
-                "user_id": meta["user_id"],
-                "user_name": meta["user_name"],
-                "food_class": meta["food_class"],
-                "created_at": meta["created_at"],
-                "caption": caption
-            })
+@app.get("/query-food-photos")
+def query_food_photos(
+    user_id: Optional[str] = Query(None),
+    limit: int = Query(10, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = None,
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+):
+    """Liệt kê các ảnh món ăn đã được index trong ChromaDB, sắp xếp theo created_at.
 
-        return {"status": "ok", "results": response}
+    Phân trang bằng `limit`/`offset`, hoặc truyền `next_cursor` của trang trước vào `cursor`.
+    """
+    try:
+        page = list_food_photos(user_id, limit, offset, cursor, newest_first=order == "desc")
+        return {"status": "ok", **page}
 
+    except HTTPException:
+        raise
     except Exception as e:
         return {"status": "error", "detail": str(e)}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """
+    Prometheus metrics: per-stage latency histograms, LLM TTFT/latency/tokens per provider, error counts
+    """
+    return PlainTextResponse(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+def require_profiling_admin(request: Request):
+    if not profiler.is_admin(request):
+        raise HTTPException(status_code=403, detail="X-Profile-Token required")
+
+@app.get("/profiles")
+async def list_profiles(request: Request):
+    """
+    Saved request profiles, newest first (requires X-Profile-Token)
+    """
+    require_profiling_admin(request)
+    return {"profiles": await asyncio.to_thread(profiler.list)}
+
+@app.get("/profiles/{profile_id}")
+async def download_profile(request: Request, profile_id: str, format: str = Query("prof", pattern="^(prof|txt)$")):
+    """
+    A saved profile: `prof` is a pstats file (snakeviz, `python -m pstats`), `txt` a readable report
+    """
+    require_profiling_admin(request)
+    path = profiler.path_for(profile_id)
+    if format == "txt":
+        return PlainTextResponse(await asyncio.to_thread(profiler.report, profile_id))
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{profile_id}.prof")
+
+@app.get("/http-pool-stats")
+async def http_pool_stats():
+    """
+    Connection pool utilization per upstream (backend, IPFS gateway, Ollama)
+    """
+    return pool_stats()
+
 @app.get("/check-ollama-status")
 async def check_status():
     """
     Check if Ollama server is running and return available models
     """
-    result = await check_ollama_status()
-    return result
+    return await llm_router.providers["ollama"].health()
 
 @app.get("/check-groq-status")
 async def check_groq():
     """
     Check if Groq API is accessible and return available models
     """
-    result = await check_groq_status()
-    return result
+    return await llm_router.providers["groq"].health()
 
 @app.post("/ask-ollama")
 async def query_ollama(request: OllamaRequest):
@@ -127,47 +241,43 @@ async def query_groq(request: GroqRequest):
 @app.post("/api/chat")
 async def chat_with_llm(request: ChatRequest):
     """
-    Endpoint for streaming chat with LLM models that matches frontend expectations
+    Endpoint for streaming chat with LLM models that matches frontend expectations.
+    `provider` is a preference: the router fails over when it is slow or down.
     """
     try:
-        # Choose provider based on request
-        if request.provider == "ollama":  # Change logic to default to groq unless "ollama" is explicitly specified
-            if request.stream:
-                # Create a generator for streaming the response from Ollama
-                return StreamingResponse(
-                    stream_ollama(request.prompt, temperature=request.temperature),
-                    media_type="text/plain"
-                )
-            else:
-                # For non-streaming requests, use the existing ollama function
-                response = await ask_ollama(request.prompt)
-                return {"response": response}
-        else:  # Default to groq
-            # Set default values for parameters if not provided
-            max_tokens = request.max_tokens if request.max_tokens is not None else 1024
-            
-            if request.stream:
-                # Create a generator for streaming the response from Groq
-                return StreamingResponse(
-                    stream_groq(
-                        prompt=request.prompt, 
-                        model=request.model,  # model will be handled in stream_groq
-                        temperature=request.temperature,
-                        max_tokens=max_tokens
-                    ),
-                    media_type="text/plain"
-                )
-            else:
-                # For non-streaming requests, use the groq function
-                response = await ask_groq(
-                    prompt=request.prompt,
+        # Set default values for parameters if not provided
+        max_tokens = request.max_tokens if request.max_tokens is not None else 1024
+
+        if request.stream:
+            return StreamingResponse(
+                stream_chat(
+                    request.prompt,
+                    preferred=request.provider,
+                    model=request.model,
                     temperature=request.temperature,
                     max_tokens=max_tokens
-                )
-                return {"response": response}
+                ),
+                media_type="text/plain"
+            )
+        else:
+            response = await llm_router.complete(
+                request.prompt,
+                preferred=request.provider,
+                model=request.model,
+                temperature=request.temperature,
+                max_tokens=max_tokens
+            )
+            return {"response": response}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error in chat: {str(e)}")
 
+@app.get("/llm-router-stats")
+async def llm_router_stats():
+    """
+    Rolling latency, error rate and circuit state per LLM provider
+    """
+    return llm_router.stats()
+
 @app.get("/suggest/prompts")
 async def list_prompt_options():
     """
@@ -175,6 +285,25 @@ async def list_prompt_options():
     """
     return {"available_prompts": get_available_prompts()}
 
+@app.get("/suggest/cache-stats")
+async def suggestion_cache_stats():
+    """
+    Hit rate and size of the suggestion cache
+    """
+    return suggestion_cache.stats()
+
+@app.get("/suggest/{user_id}/{prompt_key}/stream")
+async def stream_suggestion(user_id: str, prompt_key: str):
+    """
+    Server-sent events: `metadata` (retrieved dishes) before generation, `token`
+    deltas as the LLM emits them, and `done` with time-to-first-token
+    """
+    return StreamingResponse(
+        stream_suggestion_by_prompt(user_id, prompt_key),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.get("/suggest/{user_id}/{prompt_key}")
 async def suggest_with_prompt(user_id: str, prompt_key: str):
     result = await generate_suggestion_by_prompt(user_id, prompt_key)
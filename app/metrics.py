@@ -0,0 +1,59 @@
+from typing import Dict, Tuple
+
+from prometheus_client import CollectorRegistry, Counter, Histogram
+from prometheus_client.context_managers import Timer
+
+# Seconds; covers sub-millisecond cache/Chroma calls up to slow LLM generations
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Only the app's own metrics, without the default process/platform collectors
+registry = CollectorRegistry()
+
+STAGE_SECONDS = Histogram(
+    "truegift_stage_seconds",
+    "Duration of indexing and retrieval steps (backend fetch, download, classifiers, embedding, Chroma)",
+    ["stage"], buckets=DEFAULT_BUCKETS, registry=registry,
+)
+LLM_TTFT_SECONDS = Histogram(
+    "truegift_llm_ttft_seconds", "Time to the first streamed token per LLM provider", ["provider"],
+    buckets=DEFAULT_BUCKETS, registry=registry,
+)
+LLM_SECONDS = Histogram(
+    "truegift_llm_seconds", "Total LLM call duration per provider and mode (complete, stream)", ["provider", "mode"],
+    buckets=DEFAULT_BUCKETS, registry=registry,
+)
+LLM_TOKENS = Counter(
+    "truegift_llm_tokens",
+    "LLM tokens per provider and kind (prompt, completion); streamed completions count one token per chunk",
+    ["provider", "kind"], registry=registry,
+)
+PROMPT_TOKENS = Histogram(
+    "truegift_suggestion_prompt_tokens", "Suggestion prompt size in tokens per template", ["prompt_key"],
+    buckets=(100, 250, 500, 750, 1000, 1500, 2000, 3000, 4000, 8000), registry=registry,
+)
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "truegift_event_loop_lag_seconds", "How late the event loop woke a periodic timer (time the loop was blocked)",
+    buckets=DEFAULT_BUCKETS, registry=registry,
+)
+ERRORS = Counter(
+    "truegift_errors", "Errors per component", ["component"], registry=registry,
+)
+
+
+def stage_timer(stage: str) -> Timer:
+    """`with stage_timer("chroma_query"): ...` records into truegift_stage_seconds"""
+    return STAGE_SECONDS.labels(stage).time()
+
+
+def stage_totals() -> Dict[str, Tuple[int, float]]:
+    """(count, seconds) observed so far per stage, for diffing over a time window"""
+    totals: Dict[str, Tuple[int, float]] = {}
+    for metric in STAGE_SECONDS.collect():
+        for sample in metric.samples:
+            count, seconds = totals.get(sample.labels["stage"], (0, 0.0))
+            if sample.name.endswith("_count"):
+                count = int(sample.value)
+            elif sample.name.endswith("_sum"):
+                seconds = sample.value
+            totals[sample.labels["stage"]] = (count, seconds)
+    return totals
@@ -0,0 +1,119 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from .config import (
+    YOLO_MODEL_PATH,
+    YOLO_GENERAL_CLS_MODEL_PATH,
+    EMBEDDING_MODEL_NAME,
+    CHROMA_PATH,
+    CHROMA_COLLECTION,
+    logger,
+)
+from .inference_engine import load_classifier, load_embedder
+
+
+class LazyComponent:
+    """A heavy resource created on first use, with its load state reported by /ready"""
+
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self.name = name
+        self.factory = factory
+        self.state = "not_loaded"
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self._value = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Any:
+        if self._value is not None:
+            return self._value
+        with self._lock:
+            if self._value is None:
+                self.state = "loading"
+                started = time.perf_counter()
+                try:
+                    self._value = self.factory()
+                except Exception as e:
+                    self.state, self.error = "error", str(e)
+                    logger.error(f"Failed to load {self.name}: {e}")
+                    raise
+                self.load_seconds = round(time.perf_counter() - started, 3)
+                self.state, self.error = "ready", None
+                logger.info(f"Loaded {self.name} in {self.load_seconds}s")
+        return self._value
+
+    def status(self) -> Dict[str, Any]:
+        return {"state": self.state, "load_seconds": self.load_seconds, "error": self.error}
+
+
+def _load_yolo(path: str):
+    # torch weights or their ONNX/OpenVINO export, depending on INFERENCE_BACKEND
+    return load_classifier(path)
+
+
+def _load_embedding_model():
+    return load_embedder(EMBEDDING_MODEL_NAME)
+
+
+def _open_chroma_client():
+    import chromadb
+    from chromadb.config import Settings
+    return chromadb.PersistentClient(path=CHROMA_PATH, settings=Settings(allow_reset=True))
+
+
+def _open_collection():
+    # Documents are embedded with the embedding model and queries go through
+    # embed_query, so Chroma's default embedding function is never needed (nor loaded)
+    return chroma_client.get().get_or_create_collection(name=CHROMA_COLLECTION, embedding_function=None)
+
+
+food_classifier = LazyComponent("food_classifier", lambda: _load_yolo(YOLO_MODEL_PATH))
+general_classifier = LazyComponent("general_classifier", lambda: _load_yolo(YOLO_GENERAL_CLS_MODEL_PATH))
+embedding_model = LazyComponent("embedding_model", _load_embedding_model)
+chroma_client = LazyComponent("chroma_client", _open_chroma_client)
+collection = LazyComponent("collection", _open_collection)
+
+COMPONENTS = [food_classifier, general_classifier, embedding_model, chroma_client, collection]
+
+# Background warmup progress, set by rag_indexer.warmup
+warmup_status: Dict[str, Any] = {"state": "not_started", "seconds": None, "error": None}
+
+
+def get_yolo_model():
+    return food_classifier.get()
+
+
+def get_general_cls_model():
+    return general_classifier.get()
+
+
+def get_embedding_model():
+    return embedding_model.get()
+
+
+def get_chroma_client():
+    return chroma_client.get()
+
+
+def get_collection():
+    return collection.get()
+
+
+def readiness(local_models: bool = True, vector_store: bool = True) -> Dict[str, Any]:
+    """Per-component load state; chat routes need none of the models.
+
+    With `local_models` off (API worker using an inference server) the models
+    live in the other process; with `vector_store` off (the inference server
+    itself) Chroma is never opened in this one.
+    """
+    components = {c.name: c.status() for c in COMPONENTS}
+    required = [food_classifier, general_classifier, embedding_model] if local_models else []
+    if vector_store:
+        required += [chroma_client, collection]
+    return {
+        "chat": True,
+        "indexing": all(c.state == "ready" for c in required),
+        "components": components,
+        "warmup": dict(warmup_status),
+    }
@@ -1,109 +1,158 @@
-import httpx
 import asyncio
 import json
-from .config import OLLAMA_BASE_URL, OLLAMA_MODEL
+from typing import AsyncGenerator, Dict, Optional
+
+import httpx
+
+from .config import (
+    OLLAMA_BASE_URL,
+    OLLAMA_MODEL,
+    OLLAMA_KEEP_ALIVE,
+    OLLAMA_NUM_CTX,
+    OLLAMA_NUM_PREDICT,
+    OLLAMA_MAX_RETRIES,
+    logger,
+)
+from .http_pool import get_http_client
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:  # orjson is optional, json.loads takes bytes too
+    _loads = json.loads
+
 
 async def check_ollama_status() -> dict:
     try:
-        async with httpx.AsyncClient() as client:
-            # Use the /api/tags endpoint to list models
-            resp = await client.get(f"{OLLAMA_BASE_URL}/api/tags")
-            resp.raise_for_status()
-            
-            # Return the full response as a dictionary
-            return {
-                "status": "ready" if resp.status_code == 200 else "error",
-                "models": resp.json().get("models", []),
-                "message": "Ollama server is running"
-            }
+        # Use the /api/tags endpoint to list models
+        resp = await get_http_client("ollama").get(f"{OLLAMA_BASE_URL}/api/tags")
+        resp.raise_for_status()
+
+        # Return the full response as a dictionary
+        return {
+            "status": "ready" if resp.status_code == 200 else "error",
+            "models": resp.json().get("models", []),
+            "message": "Ollama server is running"
+        }
     except Exception as e:
         return {
             "status": "error",
             "message": f"Failed to connect to Ollama server: {str(e)}"
         }
 
-async def ask_ollama(prompt: str, temperature: float = 0.7) -> str:
-    """
-    Ask Ollama a question and get a response.
-    Handles both streaming and non-streaming responses.
-    """
+async def preload_ollama_model():
+    """Load OLLAMA_MODEL into memory and keep it there for OLLAMA_KEEP_ALIVE"""
+    try:
+        resp = await get_http_client("ollama").post(
+            f"{OLLAMA_BASE_URL}/api/generate", json={"model": OLLAMA_MODEL, "keep_alive": OLLAMA_KEEP_ALIVE}
+        )
+        resp.raise_for_status()
+        logger.info(f"Ollama model {OLLAMA_MODEL} loaded (keep_alive={OLLAMA_KEEP_ALIVE})")
+    except Exception as e:
+        logger.warning(f"Could not preload Ollama model {OLLAMA_MODEL}: {e}")
+
+def _options(temperature: float, max_tokens: Optional[int]) -> Dict[str, object]:
+    options = {"temperature": temperature}
+    if OLLAMA_NUM_CTX:
+        options["num_ctx"] = OLLAMA_NUM_CTX
+    num_predict = max_tokens or OLLAMA_NUM_PREDICT
+    if num_predict:
+        options["num_predict"] = num_predict
+    return options
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, httpx.TransportError)
+
+async def _chat_stream(prompt: str, partial: str, options: Dict[str, object]) -> AsyncGenerator[str, None]:
+    """One /api/chat streaming call; a non-empty `partial` is sent as the assistant prefix to continue"""
+    messages = [{"role": "user", "content": prompt}]
+    if partial:
+        messages.append({"role": "assistant", "content": partial})
     payload = {
         "model": OLLAMA_MODEL,
-        "prompt": prompt,
-        "stream": True,  # Using streaming mode
-        "temperature": temperature
+        "messages": messages,
+        "stream": True,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "options": options,
     }
-    
-    full_response = ""
-    
+
+    async with get_http_client("ollama").stream("POST", f"{OLLAMA_BASE_URL}/api/chat", json=payload) as response:
+        response.raise_for_status()
+
+        # NDJSON: split raw bytes on newlines and parse each line as bytes
+        buffer = bytearray()
+        async for data in response.aiter_bytes():
+            buffer.extend(data)
+            start = 0
+            while (end := buffer.find(b"\n", start)) != -1:
+                content = _chunk_content(bytes(buffer[start:end]))
+                start = end + 1
+                if content:
+                    yield content
+            del buffer[:start]
+        # The last object may arrive without a trailing newline
+        content = _chunk_content(bytes(buffer))
+        if content:
+            yield content
+
+def _chunk_content(line: bytes) -> Optional[str]:
+    """Message text of one NDJSON line; blank and invalid lines yield None, Ollama errors raise"""
+    if not line.strip():
+        return None
     try:
-        async with httpx.AsyncClient() as client:
-            async with client.stream("POST", f"{OLLAMA_BASE_URL}/api/generate", 
-                                    json=payload, timeout=60.0) as response:
-                response.raise_for_status()
-                
-                # Process the streaming response line by line
-                async for line in response.aiter_lines():
-                    if not line.strip():
-                        continue
-                        
-                    try:
-                        chunk = json.loads(line)
-                        if "response" in chunk:
-                            full_response += chunk["response"]
-                            
-                    except json.JSONDecodeError:
-                        # Skip invalid JSON lines
-                        continue
-        
-        return full_response
-        
-    except Exception as e:
-        # If streaming fails, fall back to non-streaming
-        print(f"Error with streaming: {str(e)}, falling back to non-streaming")
-        payload["stream"] = False
-        
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(f"{OLLAMA_BASE_URL}/api/generate", json=payload)
-            resp.raise_for_status()
-            data = resp.json()
-            return data["response"]
-
-async def stream_ollama(prompt: str, temperature: float = 0.7):
+        chunk = _loads(line)
+    except ValueError:
+        # Skip invalid JSON lines
+        return None
+    if chunk.get("error"):
+        raise RuntimeError(f"Ollama error: {chunk['error']}")
+    return (chunk.get("message") or {}).get("content")
+
+async def iter_ollama_stream(
+    prompt: str, temperature: float = 0.7, max_tokens: Optional[int] = None
+) -> AsyncGenerator[str, None]:
+    """
+    Yield response fragments from Ollama, raising on errors.
+    A stream broken by a connection or server error is resumed from the text
+    generated so far (sent back as an assistant prefix) instead of starting over.
+    """
+    parts = []
+    options = _options(temperature, max_tokens)
+    for attempt in range(OLLAMA_MAX_RETRIES + 1):
+        try:
+            async for content in _chat_stream(prompt, "".join(parts), options):
+                parts.append(content)
+                yield content
+            return
+        except Exception as e:
+            if attempt == OLLAMA_MAX_RETRIES or not _is_retryable(e):
+                raise
+            logger.warning(f"Ollama stream interrupted after {len(parts)} chunks, resuming: {e}")
+            # Ollama streams one token per chunk; don't generate past the original budget
+            if "num_predict" in options:
+                options = {**options, "num_predict": max(1, options["num_predict"] - len(parts))}
+            await asyncio.sleep(0.5 * (attempt + 1))
+
+async def ask_ollama(prompt: str, temperature: float = 0.7, max_tokens: Optional[int] = None) -> str:
+    """
+    Ask Ollama a question and get the complete response.
+    """
+    parts = [content async for content in iter_ollama_stream(prompt, temperature, max_tokens)]
+    return "".join(parts)
+
+async def stream_ollama(prompt: str, temperature: float = 0.7, max_tokens: Optional[int] = None):
     """
     Stream Ollama responses to the client character by character to match frontend expectations.
     This function returns a generator that yields text incrementally.
     """
-    payload = {
-        "model": OLLAMA_MODEL,
-        "prompt": prompt,
-        "stream": True,
-        "temperature": temperature
-    }
-    
     try:
-        async with httpx.AsyncClient() as client:
-            async with client.stream("POST", f"{OLLAMA_BASE_URL}/api/generate", 
-                                    json=payload, timeout=60.0) as response:
-                response.raise_for_status()
-                
-                # Process the streaming response line by line
-                async for line in response.aiter_lines():
-                    if not line.strip():
-                        continue
-                        
-                    try:
-                        chunk = json.loads(line)
-                        if "response" in chunk:
-                            # Send each character separately to enable the streaming effect in the frontend
-                            yield chunk["response"]
-                            
-                    except json.JSONDecodeError:
-                        # Skip invalid JSON lines
-                        continue
-                
+        async for content in iter_ollama_stream(prompt, temperature, max_tokens):
+            # Send each character separately to enable the streaming effect in the frontend
+            yield content
+
     except Exception as e:
-        # If streaming fails, fall back to non-streaming
-        print(f"Error with streaming in generator: {str(e)}")
+        logger.error(f"Error with streaming in generator: {str(e)}")
         # Send error notification to the stream
         yield f"Error connecting to AI model: {str(e)}"
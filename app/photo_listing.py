@@ -0,0 +1,154 @@
+import base64
+import bisect
+import json
+import threading
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+
+from .metrics import stage_timer
+from .model_registry import get_collection
+
+# (created_at, zero-padded photo_id, chroma id); the first two form the sort key and the cursor
+ListingRow = Tuple[str, str, str]
+
+
+def _listing_key(metadata: Dict[str, Any]) -> Tuple[str, str]:
+    return str(metadata.get("created_at", "")), str(metadata.get("photo_id", "")).zfill(20)
+
+
+def encode_cursor(row: ListingRow) -> str:
+    return base64.urlsafe_b64encode(json.dumps(row[:2]).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        created_at, photo_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(created_at), str(photo_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+class FoodPhotoIndex:
+    """Indexed food photos sorted by created_at, overall and per user.
+
+    Chroma cannot sort by metadata, so the order is kept here: built from one
+    metadata-only scan of the collection on first use, then updated by every
+    write. A page then costs a bisect plus one Chroma get by id.
+
+    Other workers write to the same collection without updating this copy, so
+    every page first compares the collection's size with the ids known here
+    and rescans when they differ.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._all: Optional[List[ListingRow]] = None
+        self._by_user: Dict[str, List[ListingRow]] = {}
+        # chroma id -> (row, user_id), to move a photo when it is upserted again
+        self._rows: Dict[str, Tuple[ListingRow, str]] = {}
+        # Every id in the collection, food or not, to notice writes made elsewhere
+        self._ids: Set[str] = set()
+
+    def _load(self):
+        with stage_timer("chroma_get"):
+            matches = get_collection().get(include=["metadatas"])
+        self._all, self._by_user, self._rows, self._ids = [], {}, {}, set(matches["ids"])
+        for chroma_id, metadata in zip(matches["ids"], matches["metadatas"]):
+            if not metadata.get("is_food"):
+                continue
+            row = (*_listing_key(metadata), chroma_id)
+            user_id = str(metadata.get("user_id", ""))
+            self._all.append(row)
+            self._by_user.setdefault(user_id, []).append(row)
+            self._rows[chroma_id] = (row, user_id)
+        self._all.sort()
+        for rows in self._by_user.values():
+            rows.sort()
+
+    def _remove(self, chroma_id: str):
+        row, user_id = self._rows.pop(chroma_id)
+        for rows in (self._all, self._by_user[user_id]):
+            index = bisect.bisect_left(rows, row)
+            if index < len(rows) and rows[index] == row:
+                del rows[index]
+
+    def update(self, records: List[Dict[str, Any]]):
+        """Apply written index records; a no-op until the first listing loads the index"""
+        with self._lock:
+            if self._all is None:
+                return
+            for record in records:
+                self._ids.add(record["id"])
+                if record["id"] in self._rows:
+                    self._remove(record["id"])
+                metadata = record["metadata"]
+                if not metadata.get("is_food"):
+                    continue
+                row = (*_listing_key(metadata), record["id"])
+                user_id = str(metadata.get("user_id", ""))
+                bisect.insort(self._all, row)
+                bisect.insort(self._by_user.setdefault(user_id, []), row)
+                self._rows[record["id"]] = (row, user_id)
+
+    def clear(self):
+        """Forget the order, e.g. after the collection was reset; the next listing rescans"""
+        with self._lock:
+            self._all, self._by_user, self._rows, self._ids = None, {}, {}, set()
+
+    def page(self, user_id: Optional[str], limit: int, offset: int, after: Optional[Tuple[str, str]],
+             newest_first: bool) -> Tuple[List[ListingRow], bool, int]:
+        """Rows of one page, whether more follow, and the number of matching photos"""
+        with self._lock:
+            if self._all is None or get_collection().count() != len(self._ids):
+                self._load()
+            rows = self._by_user.get(str(user_id), []) if user_id else self._all
+            if newest_first:
+                end = bisect.bisect_left(rows, after) if after else len(rows)
+                end -= offset
+                page = rows[max(0, end - limit):max(0, end)][::-1]
+                has_more = end - limit > 0
+            else:
+                start = bisect.bisect_right(rows, (*after, "\U0010ffff")) if after else 0
+                start += offset
+                page = rows[start:start + limit]
+                has_more = start + limit < len(rows)
+            return page, has_more, len(rows)
+
+
+food_photo_index = FoodPhotoIndex()
+
+
+def list_food_photos(user_id: Optional[str] = None, limit: int = 10, offset: int = 0,
+                     cursor: Optional[str] = None, newest_first: bool = True) -> Dict[str, Any]:
+    """Page through indexed food photos sorted by created_at, without embeddings or a vector search.
+
+    `cursor` (the previous page's `next_cursor`) resumes right after the last
+    photo returned, so pages stay stable while photos are added.
+    """
+    after = decode_cursor(cursor) if cursor else None
+    page, has_more, total = food_photo_index.page(user_id, limit, offset, after, newest_first)
+
+    found = {}
+    if page:
+        with stage_timer("chroma_get"):
+            documents = get_collection().get(ids=[row[2] for row in page], include=["documents", "metadatas"])
+        found = {chroma_id: (doc, meta) for chroma_id, doc, meta in
+                 zip(documents["ids"], documents["documents"], documents["metadatas"])}
+
+    results = [
+        {
+            "photo_id": meta["photo_id"],
+            "user_id": meta["user_id"],
+            "user_name": meta["user_name"],
+            "food_class": meta["food_class"],
+            "created_at": meta["created_at"],
+            "caption": caption,
+        }
+        for caption, meta in (found[row[2]] for row in page if row[2] in found)
+    ]
+    return {
+        "results": results,
+        "total": total,
+        "next_cursor": encode_cursor(page[-1]) if page and has_more else None,
+    }
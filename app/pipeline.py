@@ -0,0 +1,147 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# Marks the end of a stage's input; every worker of a stage consumes exactly one
+_DONE = object()
+
+
+class PipelineStage:
+    """A pipeline stage: `concurrency` workers running `handler` over micro-batches of items.
+
+    Items are dicts. A handler finishes an item early by setting item["result"];
+    every other item is passed on to the next stage's bounded queue.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[List[Dict[str, Any]]], Awaitable[None]],
+        concurrency: int = 1,
+        batch_size: Optional[int] = 1,
+        batch_wait: float = 0.0,
+        queue_size: int = 16,
+    ):
+        self.name = name
+        self.handler = handler
+        self.concurrency = max(1, concurrency)
+        # None collects the whole input into one batch
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.queue_size = queue_size
+
+        self.processed = 0
+        self.finished = 0
+        self.batches = 0
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0
+        self._depth_total = 0
+        self._depth_samples = 0
+        self._first_item_at: Optional[float] = None
+        self._last_item_at: Optional[float] = None
+        # Called with the number of items this stage finished, for progress reporting
+        self.on_finished: Optional[Callable[[int], None]] = None
+
+    def _sample_depth(self, inbox: asyncio.Queue):
+        depth = inbox.qsize()
+        self.max_queue_depth = max(self.max_queue_depth, depth)
+        self._depth_total += depth
+        self._depth_samples += 1
+
+    async def _next_batch(self, inbox: asyncio.Queue) -> tuple[List[Dict[str, Any]], bool]:
+        """Wait for one item, then keep filling the batch for up to `batch_wait` seconds"""
+        self._sample_depth(inbox)
+        item = await inbox.get()
+        if item is _DONE:
+            return [], True
+
+        batch = [item]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_wait
+        while self.batch_size is None or len(batch) < self.batch_size:
+            timeout = deadline - loop.time()
+            try:
+                if self.batch_size is None:
+                    item = await inbox.get()
+                elif timeout <= 0:
+                    item = inbox.get_nowait()
+                else:
+                    item = await asyncio.wait_for(inbox.get(), timeout)
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+            if item is _DONE:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _work(self, inbox: asyncio.Queue, outbox: Optional[asyncio.Queue]):
+        done = False
+        while not done:
+            batch, done = await self._next_batch(inbox)
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            if self._first_item_at is None:
+                self._first_item_at = started
+            try:
+                await self.handler(batch)
+            except Exception as e:
+                for item in batch:
+                    item.setdefault("result", {"photo_id": item.get("id"), "status": "error", "error": str(e)})
+            self._last_item_at = time.perf_counter()
+            self.busy_seconds += self._last_item_at - started
+            self.batches += 1
+            self.processed += len(batch)
+
+            finished = 0
+            for item in batch:
+                if "result" in item:
+                    finished += 1
+                elif outbox is not None:
+                    await outbox.put(item)
+            self.finished += finished
+            if finished and self.on_finished:
+                self.on_finished(finished)
+
+    def stats(self) -> Dict[str, Any]:
+        active = (self._last_item_at or 0.0) - (self._first_item_at or 0.0)
+        return {
+            "concurrency": self.concurrency,
+            "batch_size": self.batch_size,
+            "queue_size": self.queue_size,
+            "processed": self.processed,
+            "finished_here": self.finished,
+            "batches": self.batches,
+            "busy_seconds": round(self.busy_seconds, 4),
+            "throughput_per_sec": round(self.processed / active, 2) if active > 0 else None,
+            "max_queue_depth": self.max_queue_depth,
+            "avg_queue_depth": round(self._depth_total / self._depth_samples, 2) if self._depth_samples else 0,
+        }
+
+
+async def run_pipeline(
+    items: List[Dict[str, Any]],
+    stages: List[PipelineStage],
+    on_finished: Optional[Callable[[int], None]] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """Push items through the stages connected by bounded queues; returns per-stage stats"""
+    for stage in stages:
+        stage.on_finished = on_finished
+    queues = [asyncio.Queue(maxsize=stage.queue_size) for stage in stages]
+
+    async def feed():
+        for item in items:
+            await queues[0].put(item)
+        for _ in range(stages[0].concurrency):
+            await queues[0].put(_DONE)
+
+    async def run_stage(index: int, stage: PipelineStage):
+        outbox = queues[index + 1] if index + 1 < len(stages) else None
+        await asyncio.gather(*(stage._work(queues[index], outbox) for _ in range(stage.concurrency)))
+        if outbox is not None:
+            for _ in range(stages[index + 1].concurrency):
+                await outbox.put(_DONE)
+
+    await asyncio.gather(feed(), *(run_stage(i, stage) for i, stage in enumerate(stages)))
+    return {stage.name: stage.stats() for stage in stages}
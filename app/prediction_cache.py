@@ -0,0 +1,184 @@
+import hashlib
+import io
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from PIL import Image
+
+from .config import (
+    PREDICTION_CACHE_ENABLED,
+    PREDICTION_CACHE_PATH,
+    PREDICTION_CACHE_SIZE,
+    PREDICTION_CACHE_PHASH,
+    logger,
+)
+
+# CIDv0 (Qm...) or CIDv1 (base32, b...) in a gateway path (/ipfs/<cid>) or subdomain (<cid>.ipfs.host)
+_CID_PATTERN = re.compile(r"(?:/ipfs/|//)(Qm[1-9A-HJ-NP-Za-km-z]{44}|b[a-z2-7]{58,})(?:[/.?#]|$)")
+
+# (food_class, is_food, score), as returned by predict_food_or_general_scored_batch
+Prediction = Tuple[Optional[str], bool, float]
+
+
+def cid_key(url: str) -> Optional[str]:
+    """Cache key from the IPFS CID in an image URL, known before downloading"""
+    match = _CID_PATTERN.search(url or "")
+    return f"cid:{match.group(1)}" if match else None
+
+
+def content_key(content: bytes) -> str:
+    return f"sha256:{hashlib.sha256(content).hexdigest()}"
+
+
+def perceptual_hash(content: bytes) -> str:
+    """64-bit difference hash, stable across re-encoding and resizing of the same picture"""
+    image = Image.open(io.BytesIO(content))
+    image.draft("L", (64, 64))
+    pixels = list(image.convert("L").resize((9, 8), Image.BILINEAR).getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return f"{bits:016x}"
+
+
+class PredictionCache:
+    """Persistent classifier output per image, shared by every worker through SQLite.
+
+    Entries are keyed by CID or content hash and tagged with the model version
+    that produced them; rows from another version never match. The least
+    recently used rows are evicted beyond `max_entries`.
+    """
+
+    def __init__(self, path: str = PREDICTION_CACHE_PATH, max_entries: int = PREDICTION_CACHE_SIZE,
+                 use_phash: bool = PREDICTION_CACHE_PHASH, enabled: bool = PREDICTION_CACHE_ENABLED):
+        self.enabled = enabled
+        self.path = path
+        self.max_entries = max_entries
+        self.use_phash = use_phash
+        self._conn: Optional[sqlite3.Connection] = None
+        # Lookups and stores come from the pipeline's worker threads
+        self._lock = threading.Lock()
+        self.hits: Dict[str, int] = {"cid": 0, "sha256": 0, "phash": 0}
+        self.misses = 0
+        self.evicted = 0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS predictions ("
+                " key TEXT PRIMARY KEY, phash TEXT, food_class TEXT, score REAL NOT NULL,"
+                " is_food INTEGER NOT NULL, model_version TEXT NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS predictions_phash ON predictions (phash, model_version)")
+            conn.execute("CREATE INDEX IF NOT EXISTS predictions_last_used ON predictions (last_used)")
+            self._conn = conn
+        return self._conn
+
+    def lookup(self, keys: Iterable[Optional[str]], model_version: str,
+               phash: Optional[str] = None, count_miss: bool = True) -> Optional[Prediction]:
+        """First prediction stored under `keys` (or a near-identical `phash`).
+
+        A lookup that is followed by another one for the same image passes
+        `count_miss=False`, so each image counts as at most one miss.
+        """
+        keys = [k for k in keys if k]
+        if not self.enabled:
+            return None
+        with self._lock:
+            try:
+                db = self._db()
+                row, kind = None, None
+                for key in keys:
+                    row = db.execute(
+                        "SELECT key, food_class, score, is_food FROM predictions WHERE key = ? AND model_version = ?",
+                        (key, model_version),
+                    ).fetchone()
+                    if row:
+                        kind = key.split(":", 1)[0]
+                        break
+                if row is None and phash and self.use_phash:
+                    row = db.execute(
+                        "SELECT key, food_class, score, is_food FROM predictions WHERE phash = ? AND model_version = ?",
+                        (phash, model_version),
+                    ).fetchone()
+                    kind = "phash"
+                if row is None:
+                    if count_miss:
+                        self.misses += 1
+                    return None
+                db.execute("UPDATE predictions SET last_used = ? WHERE key = ?", (time.time(), row[0]))
+                db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Prediction cache lookup failed: {e}")
+                return None
+            self.hits[kind] += 1
+            return row[1], bool(row[3]), row[2]
+
+    def store(self, keys: Iterable[Optional[str]], prediction: Prediction, model_version: str,
+              phash: Optional[str] = None):
+        self.store_many([(keys, prediction, phash)], model_version)
+
+    def store_many(self, entries: Iterable[Tuple[Iterable[Optional[str]], Prediction, Optional[str]]],
+                   model_version: str):
+        """Store (keys, prediction, phash) for a whole classifier batch in one transaction"""
+        if not self.enabled:
+            return
+        now = time.time()
+        rows = [
+            (key, phash, food_class, score, int(is_food), model_version, now)
+            for keys, (food_class, is_food, score), phash in entries
+            for key in keys if key
+        ]
+        if not rows:
+            return
+        with self._lock:
+            try:
+                db = self._db()
+                db.executemany("INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                self._evict(db)
+                db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Prediction cache store failed: {e}")
+
+    def _evict(self, db: sqlite3.Connection):
+        (count,) = db.execute("SELECT COUNT(*) FROM predictions").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            # Trim an extra 10% so eviction does not run on every store once full
+            excess += self.max_entries // 10
+            db.execute(
+                "DELETE FROM predictions WHERE key IN (SELECT key FROM predictions ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+            self.evicted += excess
+
+    def stats(self) -> Dict[str, Any]:
+        hits = sum(self.hits.values())
+        total = hits + self.misses
+        entries = None
+        with self._lock:
+            try:
+                if self.enabled:
+                    (entries,) = self._db().execute("SELECT COUNT(*) FROM predictions").fetchone()
+            except sqlite3.Error:
+                pass
+        return {
+            "enabled": self.enabled,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": hits,
+            "hits_by_key": dict(self.hits),
+            "misses": self.misses,
+            "hit_rate": round(hits / total, 3) if total else None,
+            "evicted": self.evicted,
+            "perceptual_hash": self.use_phash,
+        }
+
+
+prediction_cache = PredictionCache()
@@ -0,0 +1,275 @@
+import asyncio
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import secrets
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import HTTPException, Request
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .config import (
+    PROFILING_TOKEN,
+    PROFILING_SAMPLE_RATE,
+    PROFILING_PATHS,
+    PROFILING_DIR,
+    PROFILING_MAX_FILES,
+    EVENT_LOOP_MONITOR_INTERVAL,
+    logger,
+)
+from .metrics import EVENT_LOOP_LAG_SECONDS, stage_totals
+
+PROFILE_HEADER = "X-Profile-Token"
+# Loop lag above this counts as the loop being blocked
+_BLOCKED_THRESHOLD = 0.1
+_PROFILE_ID = re.compile(r"^[0-9]{8}T[0-9]{6}-[0-9a-f]{8}$")
+
+
+class ProfileSession:
+    """CPU profile of one request: the event-loop thread plus model calls made on worker threads.
+
+    The profile covers everything that ran in that window, so concurrent requests
+    show up in it too; `stage_seconds` is the per-stage time spent meanwhile.
+    """
+
+    def __init__(self, request: Request, reason: str):
+        self.id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.method = request.method
+        self.path = request.url.path
+        self.reason = reason
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self._stages = stage_totals()
+        self._loop_profile = cProfile.Profile()
+        self._thread_profiles: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+        self.lag_samples = 0
+        self.lag_max = 0.0
+        self.blocked_seconds = 0.0
+        self.blocked_count = 0
+
+    def start(self):
+        self._loop_profile.enable()
+
+    def record_lag(self, lag: float):
+        self.lag_samples += 1
+        self.lag_max = max(self.lag_max, lag)
+        if lag >= _BLOCKED_THRESHOLD:
+            self.blocked_seconds += lag
+            self.blocked_count += 1
+
+    def add_thread_profile(self, profile: cProfile.Profile):
+        with self._lock:
+            self._thread_profiles.append(profile)
+
+    def finish(self, status_code: Optional[int]) -> Dict[str, Any]:
+        """Stop profiling and write `<id>.prof` (pstats) and `<id>.json` (summary)"""
+        self._loop_profile.disable()
+        duration = time.perf_counter() - self._started
+        stats = pstats.Stats(self._loop_profile)
+        with self._lock:
+            for profile in self._thread_profiles:
+                stats.add(profile)
+
+        before = self._stages
+        stages = {}
+        for stage, (count, total) in stage_totals().items():
+            prev_count, prev_total = before.get(stage, (0, 0.0))
+            if count > prev_count:
+                stages[stage] = {"count": count - prev_count, "seconds": round(total - prev_total, 4)}
+
+        summary = {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "reason": self.reason,
+            "status_code": status_code,
+            "started_at": self.started_at,
+            "duration_ms": round(duration * 1000, 1),
+            "event_loop": {
+                "samples": self.lag_samples,
+                "max_lag_ms": round(self.lag_max * 1000, 1),
+                "blocked_ms": round(self.blocked_seconds * 1000, 1),
+                "blocked_count": self.blocked_count,
+            } if self.lag_samples else None,
+            "worker_thread_calls": len(self._thread_profiles),
+            "stage_seconds": stages,
+        }
+        os.makedirs(PROFILING_DIR, exist_ok=True)
+        stats.dump_stats(os.path.join(PROFILING_DIR, f"{self.id}.prof"))
+        with open(os.path.join(PROFILING_DIR, f"{self.id}.json"), "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False)
+        return summary
+
+
+class Profiler:
+    """Decides which requests get profiled, runs the session and keeps PROFILING_DIR bounded.
+
+    cProfile allows one active profiler per thread, so at most one request is
+    profiled at a time; requests arriving meanwhile run unprofiled.
+    """
+
+    def __init__(self):
+        self.active: Optional[ProfileSession] = None
+        self._monitor: Optional[asyncio.Task] = None
+
+    def is_admin(self, request: Request) -> bool:
+        token = request.headers.get(PROFILE_HEADER)
+        return bool(PROFILING_TOKEN and token and secrets.compare_digest(token, PROFILING_TOKEN))
+
+    def reason_for(self, request: Request) -> Optional[str]:
+        if self.active is not None or request.url.path.startswith("/profiles"):
+            return None
+        if self.is_admin(request):
+            return "header"
+        if PROFILING_SAMPLE_RATE > 0 and any(request.url.path.startswith(p) for p in PROFILING_PATHS):
+            if random.random() < PROFILING_SAMPLE_RATE:
+                return "sampled"
+        return None
+
+    def begin(self, request: Request, reason: str) -> Optional[ProfileSession]:
+        session = ProfileSession(request, reason)
+        try:
+            session.start()
+        except ValueError as e:  # another profiler is already running
+            logger.warning(f"Not profiling {session.path}: {e}")
+            return None
+        self.active = session
+        return session
+
+    def end(self, session: ProfileSession, status_code: Optional[int]):
+        if self.active is session:
+            self.active = None
+        try:
+            summary = session.finish(status_code)
+            logger.info(
+                f"Profiled {summary['method']} {summary['path']} ({summary['reason']}): "
+                f"{summary['duration_ms']}ms, event loop {summary['event_loop']} -> {session.id}"
+            )
+            self.prune()
+        except Exception as e:
+            logger.warning(f"Could not save profile {session.id}: {e}")
+
+    def wrap(self, func: Callable) -> Callable:
+        """Profile `func` on the thread it runs on while a request is being profiled"""
+        session = self.active
+        if session is None:
+            return func
+
+        def profiled(*args, **kwargs):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Python 3.12+ allows one profiler per process, and it already sees this thread
+                return func(*args, **kwargs)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.disable()
+                session.add_thread_profile(profile)
+
+        return profiled
+
+    def prune(self):
+        """Keep only the newest PROFILING_MAX_FILES profiles"""
+        for profile_id in [p["id"] for p in self.list()][PROFILING_MAX_FILES:]:
+            for suffix in (".prof", ".json"):
+                try:
+                    os.remove(os.path.join(PROFILING_DIR, profile_id + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Saved profile summaries, newest first"""
+        try:
+            names = os.listdir(PROFILING_DIR)
+        except FileNotFoundError:
+            return []
+        summaries = []
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(PROFILING_DIR, name), encoding="utf-8") as f:
+                    summaries.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return sorted(summaries, key=lambda s: s.get("started_at", 0), reverse=True)
+
+    def path_for(self, profile_id: str) -> str:
+        path = os.path.join(PROFILING_DIR, f"{profile_id}.prof")
+        if not _PROFILE_ID.match(profile_id) or not os.path.exists(path):
+            raise HTTPException(status_code=404, detail="Profile not found")
+        return path
+
+    def report(self, profile_id: str, sort: str = "cumulative", limit: int = 60) -> str:
+        """Text report: the summary followed by the top functions"""
+        stream = io.StringIO()
+        with open(os.path.join(PROFILING_DIR, f"{profile_id}.json"), encoding="utf-8") as f:
+            stream.write(json.dumps(json.load(f), ensure_ascii=False, indent=2) + "\n\n")
+        stats = pstats.Stats(self.path_for(profile_id), stream=stream)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+    # Event-loop lag: a timer that should wake every interval; any delay is time the loop was blocked
+    async def _monitor_loop(self, interval: float):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - started - interval)
+            EVENT_LOOP_LAG_SECONDS.observe(lag)
+            if self.active is not None:
+                self.active.record_lag(lag)
+
+    def start_monitor(self, interval: float = EVENT_LOOP_MONITOR_INTERVAL):
+        if interval > 0 and self._monitor is None:
+            self._monitor = asyncio.create_task(self._monitor_loop(interval))
+
+    async def stop_monitor(self):
+        if self._monitor is not None:
+            self._monitor.cancel()
+            await asyncio.gather(self._monitor, return_exceptions=True)
+            self._monitor = None
+
+
+profiler = Profiler()
+
+
+class ProfileMiddleware:
+    """ASGI middleware: profile a selected request until its last body chunk (streams included) is sent"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        request = Request(scope)
+        reason = profiler.reason_for(request)
+        session = profiler.begin(request, reason) if reason else None
+        if session is None:
+            return await self.app(scope, receive, send)
+
+        status_code = 500
+
+        async def send_profiled(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message).append("X-Profile-Id", session.id)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_profiled)
+        finally:
+            profiler.end(session, status_code)
@@ -0,0 +1,139 @@
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import (
+    PROMPT_TOKEN_BUDGET,
+    PROMPT_TOKEN_BUDGETS,
+    PROMPT_DESCRIPTION_SENTENCES,
+    PROMPT_MAX_ADDRESSES,
+    logger,
+)
+from .metrics import PROMPT_TOKENS
+
+NO_CRAWLED_INFO = "Không có thông tin bổ sung cho các món ăn này."
+
+# (crawled item, food name from the photo, exact match)
+CrawledMatch = Tuple[Dict[str, Any], str, bool]
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:  # tiktoken is optional (and may need to download its vocabulary)
+            logger.info(f"tiktoken unavailable, estimating prompt tokens from byte length: {e}")
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Token count with tiktoken's cl100k_base, or ~4 UTF-8 bytes per token without it"""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return (len(text.encode("utf-8")) + 3) // 4
+
+
+def first_sentences(text: str, n: int) -> str:
+    sentences = re.split(r"(?<=[.!?])\s+", text.strip())
+    return " ".join(sentences[:n])
+
+
+def split_addresses(addresses: str) -> List[str]:
+    """'A (addr, district), B (addr)' -> ['A (addr, district)', 'B (addr)']"""
+    return [a for a in re.split(r"(?<=\))\s*,\s*", addresses.strip()) if a]
+
+
+def format_crawled_item(
+    item: Dict[str, Any],
+    food_name: str,
+    exact: bool,
+    max_sentences: Optional[int] = None,
+    max_addresses: Optional[int] = None,
+) -> str:
+    """One dish line; the limits shorten the description and the address list (None = all, 0 = drop)"""
+    name = item["name"] if exact else f"{item['name']} (gần giống {food_name})"
+    description = item.get("description") or ""
+    if max_sentences is not None:
+        description = first_sentences(description, max_sentences)
+    addresses = item.get("popular_address") or ""
+    if max_addresses is not None:
+        addresses = ", ".join(split_addresses(addresses)[:max_addresses])
+
+    info = f"{name}: {description}".rstrip() if description else f"{name}:"
+    info += f" Giá: {item.get('price')}."
+    if addresses:
+        info += f" Địa chỉ: {addresses}"
+    return info
+
+
+def fit_crawled_info(matches: List[CrawledMatch], budget: int) -> str:
+    """Render the matched dishes within `budget` tokens.
+
+    Every dish is shortened the same way, one step at a time: configured
+    description/address limits, then one sentence and one address, then price
+    and one address only. If that still does not fit, dishes are dropped from
+    the end (the least relevant ones).
+    """
+    if not matches:
+        return NO_CRAWLED_INFO
+
+    levels = [
+        (PROMPT_DESCRIPTION_SENTENCES, PROMPT_MAX_ADDRESSES),
+        (min(PROMPT_DESCRIPTION_SENTENCES, 1), min(PROMPT_MAX_ADDRESSES, 1)),
+        (0, min(PROMPT_MAX_ADDRESSES, 1)),
+        (0, 0),
+    ]
+    kept = list(matches)
+    while kept:
+        for max_sentences, max_addresses in levels:
+            text = "\n- ".join(
+                format_crawled_item(item, food_name, exact, max_sentences, max_addresses)
+                for item, food_name, exact in kept
+            )
+            if count_tokens(text) <= budget:
+                return text
+        kept.pop()
+    return NO_CRAWLED_INFO
+
+
+def token_budget(prompt_key: str) -> int:
+    return PROMPT_TOKEN_BUDGETS.get(prompt_key, PROMPT_TOKEN_BUDGET)
+
+
+def build_prompt(prompt_key: str, template: str, context: str, matches: List[CrawledMatch]) -> Dict[str, Any]:
+    """Fill a suggestion template, fitting the crawled dish info into the template's token budget.
+
+    Templates keep their static instructions before `{context}`, so that part is
+    a byte-identical prefix across requests and can hit provider-side prompt caches.
+    Returns the prompt, the crawled info actually used and per-section token counts.
+    """
+    static_prefix = template.split("{context}", 1)[0]
+    tokens = {
+        "template": count_tokens(template.format(context="", crawled_info="")),
+        "static_prefix": count_tokens(static_prefix),
+        "context": count_tokens(context),
+    }
+    budget = token_budget(prompt_key)
+    crawled_budget = max(0, budget - tokens["template"] - tokens["context"])
+    crawled_info = fit_crawled_info(matches, crawled_budget)
+    tokens["crawled_info"] = count_tokens(crawled_info)
+    tokens["crawled_info_full"] = count_tokens(
+        "\n- ".join(format_crawled_item(*match) for match in matches) if matches else NO_CRAWLED_INFO
+    )
+
+    prompt = template.format(context=context, crawled_info=crawled_info)
+    tokens["total"] = count_tokens(prompt)
+    tokens["budget"] = budget
+    PROMPT_TOKENS.labels(prompt_key).observe(tokens["total"])
+    logger.info(
+        f"Prompt {prompt_key}: {tokens['total']}/{budget} tokens "
+        f"(template={tokens['template']}, static_prefix={tokens['static_prefix']}, "
+        f"context={tokens['context']}, crawled_info={tokens['crawled_info']}/{tokens['crawled_info_full']})"
+    )
+    return {"prompt": prompt, "crawled_info": crawled_info, "tokens": tokens}
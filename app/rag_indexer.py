@@ -1,84 +1,267 @@
 import os
 from fastapi import HTTPException
-import httpx
 import asyncio
+import io
 import tempfile
-from typing import List, Dict, Any, Optional
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, Dict, Any, Iterable, Optional
 from datetime import datetime
 
-from ultralytics import YOLO
-from sentence_transformers import SentenceTransformer
-import chromadb
-from chromadb.config import Settings
+import numpy as np
+from PIL import Image, ImageOps
 from .backend_client import BackendClient
+from .http_pool import get_http_client
+from .inference_client import remote_classify, remote_embed, remote_embed_sync
+from .pipeline import PipelineStage, run_pipeline
+from .suggestion_cache import suggestion_cache
+from .friend_graph import friend_graph
+from .photo_listing import food_photo_index
+from .inference_engine import model_version
+from .metrics import ERRORS, stage_timer
+from .profiling import profiler
+from .prediction_cache import prediction_cache, cid_key, content_key, perceptual_hash
+from .sync_state import sync_state, extend_watermark, photo_key, token_key, watermark_after
+
+from .model_registry import (
+    get_yolo_model,
+    get_general_cls_model,
+    get_embedding_model,
+    get_chroma_client,
+    get_collection,
+    warmup_status,
+)
 
 from .config import (
+    CLASSIFY_BATCH_SIZE,
+    CLASSIFY_BATCH_WAIT,
+    CLASSIFIER_IMAGE_SIZE,
+    IN_MEMORY_IMAGES,
+    PIPELINE_CONCURRENCY,
+    PIPELINE_QUEUE_SIZE,
+    BULK_INDEXING,
+    EMBED_BATCH_SIZE,
+    QUERY_EMBEDDING_CACHE_SIZE,
+    INDEXED_ID_CACHE_SIZE,
+    INFERENCE_SOCKET,
     YOLO_MODEL_PATH,
     YOLO_GENERAL_CLS_MODEL_PATH,
+    DEFAULT_AUTH_TOKEN,
+    FRIEND_LIST_MAX_AGE,
+    SYNC_PAGE_SIZE,
+    SYNC_MAX_PAGES,
+    logger,
 )
 
-# Load YOLO and Embedding model once
-yolo_model = YOLO(YOLO_MODEL_PATH)
-yolo_general_cls_model = YOLO(YOLO_GENERAL_CLS_MODEL_PATH)
-embedding_model = SentenceTransformer(
-    "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
-)
-
-# Init ChromaDB
-chroma_client = chromadb.PersistentClient(
-    path="./chroma_db", settings=Settings(allow_reset=True)
-)
-collection = chroma_client.get_or_create_collection(name="vietnamese_food_images")
 client = BackendClient()
 
-async def download_image(url: str) -> str:
-    """Download image from IPFS to a temp file"""
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url, timeout=10)
-        response.raise_for_status()
-        temp = tempfile.NamedTemporaryFile(delete=False, suffix=".jpg")
-        temp.write(response.content)
-        temp.close()
-        return temp.name
-
-def predict_with_model(image_path: str, model, label: str):
-        result = model(image_path)[0]
-        if result.probs:
+# Send classification and embedding to the inference server instead of loading
+# the models in this process; the server itself turns this off
+remote_inference = bool(INFERENCE_SOCKET)
+
+FOOD_CONFIDENCE_THRESHOLD = 0.6
+
+# All model calls run on this single worker thread: the event loop stays free
+# for chat streams and the models are never invoked concurrently.
+_inference_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+
+def decode_image(content: bytes, size: int = CLASSIFIER_IMAGE_SIZE) -> np.ndarray:
+    """Decode image bytes into a BGR array whose short side is at most `size`"""
+    image = Image.open(io.BytesIO(content))
+    # JPEGs are decoded straight at 1/2, 1/4 or 1/8 scale when that still covers `size`
+    image.draft("RGB", (size, size))
+    image = ImageOps.exif_transpose(image).convert("RGB")
+
+    scale = size / min(image.size)
+    if scale < 1:
+        image = image.resize(
+            (max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+            Image.BILINEAR,
+        )
+    # Ultralytics expects numpy inputs in OpenCV channel order
+    return np.ascontiguousarray(np.asarray(image)[:, :, ::-1])
+
+async def fetch_image(url: str) -> bytes:
+    """Download raw image bytes from IPFS"""
+    with stage_timer("image_download"):
+        response = await get_http_client("ipfs").get(url)
+    response.raise_for_status()
+    return response.content
+
+def prepare_image(content: bytes) -> np.ndarray | str:
+    """Decode in memory, or write a temp file when IN_MEMORY_IMAGES is off"""
+    if IN_MEMORY_IMAGES:
+        return decode_image(content)
+
+    temp = tempfile.NamedTemporaryFile(delete=False, suffix=".jpg")
+    temp.write(content)
+    temp.close()
+    return temp.name
+
+async def download_image(url: str) -> np.ndarray | str:
+    """Download image from IPFS, decoded in memory or written to a temp file when IN_MEMORY_IMAGES is off"""
+    content = await fetch_image(url)
+    return await asyncio.to_thread(prepare_image, content)
+
+def release_image(image: np.ndarray | str):
+    """Remove the temp file behind a downloaded image, if any"""
+    if isinstance(image, str) and os.path.exists(image):
+        os.remove(image)
+
+def predict_batch_with_model(images: List[Any], model, label: str) -> List[tuple[str | None, float]]:
+    """Classify a batch of images in a single forward pass"""
+    predictions = []
+    for result in model(images, batch=len(images), verbose=False):
+        if result.probs is not None:
             top_idx = result.probs.top1
             top_score = result.probs.top1conf.item()
             class_name = result.names[top_idx]
-            print(f"[{label}] Predicted: {class_name} ({top_score:.2f})")
-            return class_name, top_score
+            logger.debug(f"[{label}] Predicted: {class_name} ({top_score:.2f})")
+            predictions.append((class_name, top_score))
         else:
-            print(f"[{label}] No probs in result.")
-            return None, 0.0
-        
-def predict_food_or_general(image_path: str) -> tuple[str | None, bool]:
-    """Try food classifier first, fallback to general classifier if confidence too low"""
+            logger.debug(f"[{label}] No probs in result.")
+            predictions.append((None, 0.0))
+    return predictions
+
+def predict_with_model(image: np.ndarray | str, model, label: str):
+    return predict_batch_with_model([image], model, label)[0]
+
+def classifier_version() -> str:
+    """Identifies the classifier cascade whose outputs are in the prediction cache"""
+    return ":".join([
+        model_version(),
+        os.path.basename(YOLO_MODEL_PATH),
+        os.path.basename(YOLO_GENERAL_CLS_MODEL_PATH),
+        str(FOOD_CONFIDENCE_THRESHOLD),
+    ])
+
+def predict_food_or_general_scored_batch(images: List[Any]) -> List[tuple[str | None, bool, float]]:
+    """Food classifier on the whole batch, general classifier only on the low-confidence subset"""
+    predictions: List[tuple[str | None, bool, float]] = [(None, False, 0.0)] * len(images)
 
     # Step 1: Try fine-tuned food classifier
-    food_class, food_score = predict_with_model(image_path, yolo_model, "Food Classifier")
-    if food_score >= 0.6:
-        return food_class, True
+    low_confidence = []
+    model = get_yolo_model()
+    with stage_timer("food_classifier"):
+        food_predictions = predict_batch_with_model(images, model, "Food Classifier")
+    for i, (food_class, food_score) in enumerate(food_predictions):
+        if food_score >= FOOD_CONFIDENCE_THRESHOLD:
+            predictions[i] = (food_class, True, food_score)
+        else:
+            low_confidence.append(i)
 
     # Step 2: Fallback to general classifier
-    general_class, general_score = predict_with_model(image_path, yolo_general_cls_model, "General Classifier")
-    if general_class:
-        return general_class, False
+    if low_confidence:
+        model = get_general_cls_model()
+        with stage_timer("general_classifier"):
+            general_predictions = predict_batch_with_model(
+                [images[i] for i in low_confidence], model, "General Classifier"
+            )
+        for i, (general_class, general_score) in zip(low_confidence, general_predictions):
+            if general_class:
+                predictions[i] = (general_class, False, general_score)
+
+    # Step 3: Nothing found stays (None, False, 0.0)
+    return predictions
+
+def predict_food_or_general_batch(images: List[Any]) -> List[tuple[str | None, bool]]:
+    return [(food_class, is_food) for food_class, is_food, _ in predict_food_or_general_scored_batch(images)]
+
+def predict_food_or_general(image: np.ndarray | str) -> tuple[str | None, bool]:
+    """Try food classifier first, fallback to general classifier if confidence too low"""
+    return predict_food_or_general_batch([image])[0]
+
+def warmup(queries: List[str] = (), vector_store: bool = True):
+    """Open the vector store (unless `vector_store` is off), then load every model and run a dummy inference through each"""
+    warmup_status["state"] = "running"
+    started = time.perf_counter()
+    errors = []
+    if vector_store:
+        # First and on its own: an inference server that is not up yet must not keep Chroma closed
+        try:
+            get_collection().count()
+        except Exception as e:
+            errors.append(f"vector store: {e}")
+    try:
+        # With an inference server the classifiers live (and warm up) there
+        if not remote_inference:
+            dummy = np.zeros((CLASSIFIER_IMAGE_SIZE, CLASSIFIER_IMAGE_SIZE, 3), dtype=np.uint8)
+            predict_batch_with_model([dummy], get_yolo_model(), "Warmup")
+            predict_batch_with_model([dummy], get_general_cls_model(), "Warmup")
+        for query in queries:
+            embed_query(query)
+    except Exception as e:
+        errors.append(str(e))
+    if errors:
+        warmup_status.update({"state": "error", "error": "; ".join(errors)})
+        logger.error(f"Model warmup failed: {'; '.join(errors)}")
+        return
+    warmup_status.update({"state": "done", "seconds": round(time.perf_counter() - started, 3), "error": None})
+    logger.info(f"Model warmup finished in {warmup_status['seconds']}s")
+
+async def run_inference(func, *args):
+    """Run a blocking model call on the inference worker thread"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_inference_executor, profiler.wrap(func), *args)
+
+class IndexedIdCache:
+    """Chroma IDs known to be indexed, kept in sync with write_records.
 
-    # Step 3: Nothing found
-    return None, False
+    Bounded to the `size` most recently seen ids; an id that fell out is looked
+    up in Chroma again.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._ids: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def known(self, chroma_ids: Iterable[str]) -> set:
+        with self._lock:
+            found = {cid for cid in chroma_ids if cid in self._ids}
+            for cid in found:
+                self._ids.move_to_end(cid)
+        return found
+
+    def add(self, chroma_ids: Iterable[str]):
+        with self._lock:
+            for cid in chroma_ids:
+                self._ids[cid] = None
+                self._ids.move_to_end(cid)
+            while len(self._ids) > self.size:
+                self._ids.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+
+_indexed_ids = IndexedIdCache(INDEXED_ID_CACHE_SIZE)
+
+def indexed_photo_ids(photo_ids: List[Any]) -> set:
+    """Resolve which photo IDs are already in Chroma with a single get call"""
+    chroma_ids = {photo_id: f"photo:{photo_id}" for photo_id in photo_ids}
+    known = _indexed_ids.known(chroma_ids.values())
+    unknown = [cid for cid in chroma_ids.values() if cid not in known]
+    if unknown:
+        try:
+            collection = get_collection()
+            with stage_timer("chroma_get"):
+                result = collection.get(ids=unknown, include=[])
+            _indexed_ids.add(result.get("ids", []))
+            known.update(result.get("ids", []))
+        except Exception as e:
+            logger.warning(f"Bulk indexed check failed, treating {len(unknown)} photos as new: {e}")
+    return {photo_id for photo_id, cid in chroma_ids.items() if cid in known}
 
 def is_indexed(photo_id: str) -> bool:
     """Check if photo_id already in Chroma"""
-    try:
-        result = collection.get(ids=[f"photo:{photo_id}"])
-        return bool(result.get("ids"))
-    except:
-        return False
+    return photo_id in indexed_photo_ids([photo_id])
 
-def index_photo(photo: Dict[str, Any], food_class: str, is_food: bool):
-    """Embed and index photo with metadata"""
+def build_index_record(photo: Dict[str, Any], food_class: str, is_food: bool) -> Dict[str, Any]:
+    """Build the caption and metadata stored for a photo"""
     # Check if this is the user's own photo or a friend's photo
     is_own = photo.get("isOwnPhoto", True)
     is_friend = photo.get("isFriendPhoto", False)
@@ -106,85 +289,390 @@ def index_photo(photo: Dict[str, Any], food_class: str, is_food: bool):
         f"Món ăn này thuộc loại {'thức ăn' if is_food else 'đồ uống/khác'}."
     )
     
-    vector = embedding_model.encode([caption])[0]
-
-    collection.add(
-        ids=[f"photo:{photo['id']}"],
-        documents=[caption],
-        embeddings=[vector],
-        metadatas=[
-            {
-                "photo_id": photo["id"],
-                "user_id": user_id,
-                "food_class": food_class,
-                "user_name": photo["userName"],
-                "created_at": photo["createdAt"],
-                "is_own_photo": is_own,
-                "is_friend_photo": is_friend,
-                "is_food": is_food,
-                "indexed_at": datetime.utcnow().isoformat(),
-            }
-        ],
-    )
+    metadata = {
+        "photo_id": photo["id"],
+        "user_id": user_id,
+        "food_class": food_class,
+        "user_name": photo["userName"],
+        "created_at": photo["createdAt"],
+        "is_own_photo": is_own,
+        "is_friend_photo": is_friend,
+        "is_food": is_food,
+        "indexed_at": datetime.utcnow().isoformat(),
+    }
+    # Whose feed a friend photo came from; lets the friend graph be rebuilt from the index
+    if photo.get("friendOfUserId"):
+        metadata["friend_of"] = str(photo["friendOfUserId"])
+
+    return {"id": f"photo:{photo['id']}", "caption": caption, "metadata": metadata}
 
+def embed_records(records: List[Dict[str, Any]]):
+    """Attach caption embeddings to index records"""
+    model = get_embedding_model()
+    with stage_timer("embedding"):
+        vectors = model.encode([r["caption"] for r in records], batch_size=EMBED_BATCH_SIZE)
+    for record, vector in zip(records, vectors):
+        record["embedding"] = vector
 
-async def process_photo(photo: Dict[str, Any]) -> Dict[str, Any]:
-    """Handle a single photo: check, download, detect, embed, index"""
-    photo_id = photo["id"]
-    # logger.debug(f"Processing photo {photo_id}")
+@lru_cache(maxsize=QUERY_EMBEDDING_CACHE_SIZE)
+def _query_embedding(text: str) -> tuple:
+    if remote_inference:
+        with stage_timer("query_embedding"):
+            return tuple(remote_embed_sync([text])[0].tolist())
+    model = get_embedding_model()
+    with stage_timer("query_embedding"):
+        return tuple(model.encode([text])[0].tolist())
 
-    if is_indexed(photo_id):
-        # logger.debug(f"Photo {photo_id} already indexed, skipping")
-        return {"photo_id": photo_id, "status": "skipped"}
+def embed_query(text: str) -> List[float]:
+    """Embed a retrieval query with the indexing model; repeated queries are memoized"""
+    return list(_query_embedding(text))
 
+def max_write_batch_size() -> int:
+    """Largest batch Chroma accepts in a single add/upsert"""
     try:
-        # logger.debug(f"Downloading image from {photo['url']}")
-        img_path = await download_image(photo["url"])
-        
-        # logger.debug(f"Predicting food class for {photo_id}")
-        food_class, is_food = predict_food_or_general(img_path)
-        
-        # logger.debug(f"Removing temporary image file {img_path}")
-        os.remove(img_path)
+        return get_chroma_client().get_max_batch_size()
+    except AttributeError:
+        return getattr(get_chroma_client(), "max_batch_size", 5000)
+
+def write_records(records: List[Dict[str, Any]]):
+    """Upsert embedded records into the Chroma collection, chunked to Chroma's max batch size"""
+    chunk_size = max_write_batch_size()
+    collection = get_collection()
+    for start in range(0, len(records), chunk_size):
+        chunk = records[start:start + chunk_size]
+        with stage_timer("chroma_add"):
+            collection.upsert(
+                ids=[r["id"] for r in chunk],
+                documents=[r["caption"] for r in chunk],
+                embeddings=[r["embedding"] for r in chunk],
+                metadatas=[r["metadata"] for r in chunk],
+            )
+        _indexed_ids.add(r["id"] for r in chunk)
+        food_photo_index.update(chunk)
+    # Suggestions for these users, their friends, or built from their photos are now out of date
+    owners = {r["metadata"]["user_id"] for r in records}
+    affected = set(owners)
+    for owner in owners:
+        affected |= friend_graph.cached_friends(owner)
+    suggestion_cache.invalidate_users(affected)
+
+def index_photo(photo: Dict[str, Any], food_class: str, is_food: bool):
+    """Embed and index photo with metadata"""
+    record = build_index_record(photo, food_class, is_food)
+    embed_records([record])
+    write_records([record])
+
+
+async def download_stage(items: List[Dict[str, Any]]):
+    for item in items:
+        if "prediction" in item:
+            continue
+        try:
+            item["content"] = await fetch_image(item["photo"]["url"])
+        except Exception as e:
+            item["result"] = {"photo_id": item["id"], "status": "error", "error": str(e)}
+
+def lookup_or_prepare(item: Dict[str, Any], content: bytes):
+    """Reuse a cached prediction for these bytes, otherwise decode them for the classifier"""
+    item["cache_keys"].append(content_key(content))
+    if prediction_cache.use_phash:
+        item["phash"] = perceptual_hash(content)
+    # Photos with a CID were already looked up by it before download
+    cached = None
+    if not item["cache_keys"][0] or item.get("phash"):
+        cached = prediction_cache.lookup(item["cache_keys"][1:], classifier_version(), item.get("phash"))
+    if cached:
+        item["prediction"], item["cached"] = cached, True
+    else:
+        item["image"] = prepare_image(content)
 
+async def decode_stage(items: List[Dict[str, Any]]):
+    for item in items:
+        if "prediction" in item:
+            continue
+        try:
+            await asyncio.to_thread(lookup_or_prepare, item, item.pop("content"))
+        except Exception as e:
+            item["result"] = {"photo_id": item["id"], "status": "error", "error": str(e)}
+
+async def classify_stage(items: List[Dict[str, Any]]):
+    # Cache hits arrive with their prediction and skip both classifiers
+    pending = [item for item in items if "prediction" not in item]
+    if pending:
+        images = [item.pop("image") for item in pending]
+        try:
+            if remote_inference:
+                with stage_timer("remote_classify"):
+                    predictions = await remote_classify(images)
+            else:
+                predictions = await run_inference(predict_food_or_general_scored_batch, images)
+        finally:
+            for image in images:
+                release_image(image)
+        for item, prediction in zip(pending, predictions):
+            item["prediction"] = tuple(prediction)
+        await asyncio.to_thread(
+            prediction_cache.store_many,
+            [(item["cache_keys"], item["prediction"], item.get("phash")) for item in pending],
+            classifier_version(),
+        )
+
+    for item in items:
+        food_class, is_food, _ = item["prediction"]
         if not food_class:
-            # logger.debug(f"No food detected in photo {photo_id}")
-            return {"photo_id": photo_id, "status": "no_food_detected"}
+            item["result"] = {"photo_id": item["id"], "status": "no_food_detected"}
+            continue
+        item["food_class"], item["is_food"] = food_class, is_food
+        item["record"] = build_index_record(item["photo"], food_class, is_food)
 
-        # logger.debug(f"Indexing photo {photo_id} with food class {food_class}")
-        index_photo(photo, food_class, is_food)
-        
-        # logger.debug(f"Successfully processed photo {photo_id}")
-        return {"photo_id": photo_id, "status": "indexed", "food_class": food_class, "is_food": is_food}
+async def embed_stage(items: List[Dict[str, Any]]):
+    records = [item["record"] for item in items]
+    if remote_inference:
+        with stage_timer("remote_embedding"):
+            vectors = await remote_embed([r["caption"] for r in records])
+        for record, vector in zip(records, vectors):
+            record["embedding"] = vector
+    else:
+        await run_inference(embed_records, records)
 
-    except Exception as e:
-        # logger.error(f"Error processing photo {photo_id}: {str(e)}")
-        return {"photo_id": photo_id, "status": "error", "error": str(e)}
+async def write_stage(items: List[Dict[str, Any]]):
+    await asyncio.to_thread(profiler.wrap(write_records), [item.pop("record") for item in items])
+    for item in items:
+        item["result"] = {
+            "photo_id": item["id"],
+            "status": "indexed",
+            "food_class": item["food_class"],
+            "is_food": item["is_food"],
+            "cached": item.get("cached", False),
+        }
+
+def build_pipeline() -> List[PipelineStage]:
+    """download -> decode -> classify -> embed -> write, connected by bounded queues"""
+    def stage(name, handler, **kwargs):
+        return PipelineStage(
+            name, handler, concurrency=PIPELINE_CONCURRENCY[name], queue_size=PIPELINE_QUEUE_SIZE, **kwargs
+        )
+
+    return [
+        stage("download", download_stage),
+        stage("decode", decode_stage),
+        stage("classify", classify_stage, batch_size=CLASSIFY_BATCH_SIZE, batch_wait=CLASSIFY_BATCH_WAIT),
+        # Bulk mode embeds the whole run in one encode call and writes it in one upsert
+        stage("embed", embed_stage, batch_size=None if BULK_INDEXING else 1),
+        stage("write", write_stage, batch_size=None if BULK_INDEXING else 1),
+    ]
+
+def lookup_cached_predictions(items: List[Dict[str, Any]]):
+    """Photos whose IPFS CID was classified before skip download and classification"""
+    version = classifier_version()
+    for item in items:
+        item["cache_keys"] = [cid_key(item["photo"].get("url", ""))]
+        if item["cache_keys"][0]:
+            # With phash on, the downloaded bytes are looked up again after a miss here
+            cached = prediction_cache.lookup(item["cache_keys"], version, count_miss=not prediction_cache.use_phash)
+            if cached:
+                item["prediction"], item["cached"] = cached, True
+
+async def process_photos(photos: List[Dict[str, Any]], progress: Optional[Dict[str, Any]] = None
+                         ) -> tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Run new photos through the indexing pipeline; returns per-photo results and per-stage stats.
+
+    `progress["done"]` counts finished photos while the pipeline runs.
+    """
+    progress = progress if progress is not None else {}
+    progress.update({"total": len(photos), "done": 0})
+
+    def on_finished(count: int):
+        progress["done"] += count
+
+    # Filter already indexed photos up front so nothing is downloaded for them
+    indexed = await asyncio.to_thread(indexed_photo_ids, [photo["id"] for photo in photos])
+    items = [{"id": photo["id"], "photo": photo} for photo in photos]
+    for item in items:
+        if item["id"] in indexed:
+            item["result"] = {"photo_id": item["id"], "status": "skipped"}
+
+    pending = [item for item in items if "result" not in item]
+    on_finished(len(items) - len(pending))
+    await asyncio.to_thread(lookup_cached_predictions, pending)
+    stage_stats = await run_pipeline(pending, build_pipeline(), on_finished)
+    results = [
+        item.get("result", {"photo_id": item["id"], "status": "error", "error": "dropped by pipeline"})
+        for item in items
+    ]
+    failed = sum(1 for r in results if r["status"] == "error")
+    if failed:
+        ERRORS.labels("indexing").inc(failed)
+    return results, stage_stats
+
+# Cleared once the backend answers an `offset` with the first page again
+_backend_pages_by_offset = True
+
+async def fetch_new_photos(token: Optional[str], marks: Dict[str, Any]) -> Dict[str, Any]:
+    """Page through the backend feed, keeping only photos newer than each stream's watermark.
+
+    A backend that ignores `offset` is read with one request of up to
+    SYNC_MAX_PAGES pages' worth of photos; that is as far back as it reaches.
+    """
+    global _backend_pages_by_offset
+    # The backend filters by `since` when it supports it; the watermark check below covers it when not
+    since = min(marks["own"], marks["friends"])[0] if marks["own"] and marks["friends"] else None
+    # Continue a read that an earlier call cut short at SYNC_MAX_PAGES
+    resume = marks.get("resume")
+    start = resume["offset"] if _backend_pages_by_offset and resume and resume.get("since") == since else 0
+    page_size = SYNC_PAGE_SIZE if _backend_pages_by_offset else SYNC_PAGE_SIZE * SYNC_MAX_PAGES
+    user_photos: Dict[Any, Dict[str, Any]] = {}
+    friend_photos: Dict[Any, Dict[str, Any]] = {}
+    seen_ids: set = set()
+    requester_id = None
+    pages, complete, next_offset = 0, False, None
+
+    while True:
+        if pages == SYNC_MAX_PAGES:
+            next_offset = start + pages * SYNC_PAGE_SIZE
+            break
+        data = await client.fetch_user_photos(
+            max_photos=page_size, auth_token=token, since=since, offset=start + pages * SYNC_PAGE_SIZE
+        )
+        pages += 1
+        user_page, friend_page = data.get("userPhotos", []), data.get("friendPhotos", [])
+        if requester_id is None:
+            requester_id = data.get("userId") or (user_page[0].get("userId") if user_page else None)
+
+        page_ids = {photo["id"] for photo in user_page + friend_page}
+        if page_ids and not page_ids - seen_ids:
+            # The same page again: the backend ignores offset, so this is as far back as it reaches
+            logger.warning("Backend ignores `offset`; photos older than the first page cannot be synced")
+            _backend_pages_by_offset = False
+            complete = True
+            break
+        seen_ids |= page_ids
+        newer = 0
+        for page, mark, bucket in ((user_page, marks["own"], user_photos), (friend_page, marks["friends"], friend_photos)):
+            for photo in page:
+                if mark is None or photo_key(photo) > mark:
+                    bucket[photo["id"]] = photo
+                    newer += 1
+
+        # Stop at the end of the history or once a page holds nothing newer than
+        # the watermarks (the feed is newest first)
+        if max(len(user_page), len(friend_page)) < page_size or not newer or not _backend_pages_by_offset:
+            complete = True
+            break
+
+    return {
+        "requester_id": requester_id,
+        "user_photos": list(user_photos.values()),
+        "friend_photos": list(friend_photos.values()),
+        "since": since,
+        "pages": pages,
+        "start_offset": start,
+        "next_offset": next_offset,
+        "complete": complete,
+    }
+
+async def process_and_index_photos(auth_token: Optional[str] = None, max_photos: int = 50,
+                                   full_sync: bool = False, progress: Optional[Dict[str, Any]] = None
+                                   ) -> Dict[str, Any]:
+    """Index photos added since the last sync, oldest first, at most `max_photos` per call.
+
+    `progress` (if given) is updated with the current phase and photo counts.
+    """
+    progress = progress if progress is not None else {}
+    progress["phase"] = "fetching"
+    token = auth_token or DEFAULT_AUTH_TOKEN
+    caller_key = token_key(token) if token else None
+    # A reset vector store has lost everything the watermarks point past
+    collection_empty = await asyncio.to_thread(lambda: get_collection().count() == 0)
+    if collection_empty:
+        _indexed_ids.clear()
+        food_photo_index.clear()
+    if caller_key and (full_sync or collection_empty):
+        await asyncio.to_thread(sync_state.reset, caller_key)
+    marks = sync_state.watermarks(caller_key) if caller_key else {"own": None, "friends": None}
+    # Only a full read of the friend feed shows removed friends; force one once the stored list is old
+    if marks["friends"] and time.time() - (marks.get("friends_read_at") or 0) > FRIEND_LIST_MAX_AGE:
+        marks["friends"] = None
 
-async def process_and_index_photos(auth_token: Optional[str] = None, max_photos: int = 50) -> Dict[str, Any]:
-    token = auth_token
     try:
-        data = await client.fetch_user_photos(auth_token=token, max_photos=50)
+        fetched = await fetch_new_photos(token, marks)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    
-    # Get user and friend photos from new API structure
-    user_photos = data.get("userPhotos", [])
-    friend_photos = data.get("friendPhotos", [])
+
+    user_photos = fetched["user_photos"]
+    friend_photos = fetched["friend_photos"]
     
     # Mark photos with ownership information
     for photo in user_photos:
         photo["isOwnPhoto"] = True
     
+    # The friend feed is the backend's view of who this user's friends are
+    requester_id = fetched["requester_id"]
+    friend_ids = {str(p["userId"]) for p in friend_photos if p.get("userId") is not None}
+    if fetched["start_offset"]:
+        friend_ids |= set(marks["resume"].get("friend_ids", ()))
+    # A delta only shows friends with new photos, so only a full read replaces the friend list
+    if requester_id is not None and fetched["complete"] and marks["friends"] is None:
+        await asyncio.to_thread(friend_graph.record_friends, str(requester_id), friend_ids)
+
     for photo in friend_photos:
         photo["isOwnPhoto"] = False
         photo["isFriendPhoto"] = True
+        if requester_id is not None:
+            photo["friendOfUserId"] = requester_id
     
+    # Oldest first, so the watermarks never move past a photo left for the next call.
+    # Photos already in the index cost nothing, so only new ones count toward max_photos
+    new_photos = sorted(user_photos + friend_photos, key=photo_key)
+    indexed = await asyncio.to_thread(indexed_photo_ids, [p["id"] for p in new_photos])
+    batch, pending = [], 0
+    for photo in new_photos:
+        if photo["id"] not in indexed:
+            if pending == max_photos:
+                break
+            pending += 1
+        batch.append(photo)
+    deferred = sum(1 for p in new_photos[len(batch):] if p["id"] not in indexed)
+    user_photos = [p for p in batch if p["isOwnPhoto"]]
+    friend_photos = [p for p in batch if not p["isOwnPhoto"]]
+
     # Combine all photos for processing
     all_photos = user_photos + friend_photos
     
     # Process all photos
-    results = await asyncio.gather(*(process_photo(p) for p in all_photos))
+    progress["phase"] = "indexing"
+    started = time.perf_counter()
+    results, stage_stats = await process_photos(all_photos, progress)
+    elapsed = time.perf_counter() - started
+
+    # Watermarks earned by this call, carried on from the earlier calls of a resumed read
+    failed_ids = {r["photo_id"] for r in results if r["status"] == "error"}
+    own_failed = [p for p in user_photos if p["id"] in failed_ids]
+    friends_failed = [p for p in friend_photos if p["id"] in failed_ids]
+    own_mark = watermark_after(user_photos, own_failed)
+    friends_mark = watermark_after(friend_photos, friends_failed)
+    resume = marks["resume"] if fetched["start_offset"] else None
+    if resume:
+        own_mark = extend_watermark(tuple(resume["own"]) if resume.get("own") else None, own_mark, bool(own_failed))
+        friends_mark = extend_watermark(
+            tuple(resume["friends"]) if resume.get("friends") else None, friends_mark, bool(friends_failed)
+        )
+
+    # Only a read that reached the watermarks proves nothing in between was missed;
+    # a read cut short at the page limit continues from where it stopped next time.
+    # Photos deferred by max_photos in the middle of a resumed or cut-short read are
+    # read again next time instead, before the read moves on
+    if not caller_key or (deferred and (resume or not fetched["complete"])):
+        pass
+    elif fetched["complete"]:
+        await asyncio.to_thread(
+            sync_state.advance, caller_key, own_mark, friends_mark, friend_ids, marks["friends"] is None
+        )
+    elif fetched["next_offset"] is not None:
+        await asyncio.to_thread(
+            sync_state.set_resume, caller_key, fetched["next_offset"], fetched["since"], friend_ids,
+            own_mark, friends_mark,
+        )
 
     return {
         "status": "done",
@@ -193,6 +681,19 @@ async def process_and_index_photos(auth_token: Optional[str] = None, max_photos:
         "friend_photos_count": len(friend_photos),
         "indexed": len([r for r in results if r["status"] == "indexed"]),
         "skipped": len([r for r in results if r["status"] == "skipped"]),
+        "cache_hits": len([r for r in results if r.get("cached")]),
         "errors": [r for r in results if r["status"] == "error"],
-        "details": results
+        "details": results,
+        "sync": {
+            "since": fetched["since"],
+            "pages": fetched["pages"],
+            "start_offset": fetched["start_offset"],
+            "complete": fetched["complete"],
+            "deferred": deferred,
+        },
+        "pipeline": {
+            "elapsed_seconds": round(elapsed, 3),
+            "photos_per_sec": round(len(all_photos) / elapsed, 2) if elapsed > 0 else None,
+            "stages": stage_stats,
+        },
     }
\ No newline at end of file
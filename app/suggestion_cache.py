@@ -0,0 +1,81 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+from .config import SUGGESTION_CACHE_SIZE, SUGGESTION_CACHE_TTL
+
+
+def context_fingerprint(context: List[str], crawled_info: str) -> str:
+    """Hash of everything the LLM sees besides the static template"""
+    digest = hashlib.sha256()
+    for snippet in context:
+        digest.update(snippet.encode("utf-8"))
+        digest.update(b"\x00")
+    digest.update(crawled_info.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class SuggestionCache:
+    """LRU + TTL cache of generated suggestions keyed by (user_id, prompt_key, context fingerprint).
+
+    Each entry remembers which users' photos it was built from, so indexing new
+    photos for a user drops every suggestion that user affects.
+    """
+
+    def __init__(self, max_entries: int = SUGGESTION_CACHE_SIZE, ttl: float = SUGGESTION_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[tuple, tuple[float, str, frozenset]]" = OrderedDict()
+        # Invalidation is called from the indexing write thread
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: str, prompt_key: str, fingerprint: str) -> Optional[str]:
+        key = (user_id, prompt_key, fingerprint)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, user_id: str, prompt_key: str, fingerprint: str, value: str,
+            related_users: Iterable[str] = ()):
+        key = (user_id, prompt_key, fingerprint)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value, frozenset({user_id, *related_users}))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_users(self, user_ids: Iterable[str]) -> int:
+        """Drop entries for these users or built from their photos"""
+        user_ids = {str(u) for u in user_ids}
+        if not user_ids:
+            return 0
+        with self._lock:
+            stale = [key for key, (_, _, related) in self._entries.items() if related & user_ids]
+            for key in stale:
+                del self._entries[key]
+        return len(stale)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+        }
+
+
+suggestion_cache = SuggestionCache()
@@ -1,16 +1,24 @@
-import difflib
+import asyncio
 import json
-import os
-import random
-import re
-from typing import List, Dict, Any
+import time
+from typing import AsyncGenerator, List, Dict, Any, Optional, Set
 
-from app.groq_client import ask_groq
-from .rag_indexer import collection
+from .llm_router import llm_router
+from .rag_indexer import embed_query, run_inference
+from .model_registry import get_collection
 from .config import logger
-from .ollama_client import ask_ollama
+from .knowledge_base import food_knowledge_base
+from .metrics import ERRORS, stage_timer
+from .prompt_builder import CrawledMatch, build_prompt
+from .suggestion_cache import context_fingerprint, suggestion_cache
+from .friend_graph import friend_graph
+
+# Canonical retrieval query, embedded once with the indexing model
+FOOD_QUERY = "thức ăn"
 
 SUGGESTION_TEMPLATES = {
+    # Static instructions first and the retrieved dishes last, so every request
+    # for a template shares the same prefix (provider-side prompt caching)
     "like_friends": """\
 🍽️ Gợi ý món ăn từ bạn bè của bạn!
 Hãy dựa trên các món ăn mà bạn bè đã chia sẻ để đưa ra gợi ý phù hợp nhất cho người dùng.
@@ -23,6 +31,11 @@ Hướng dẫn:
     Không trích dẫn nếu không có id.
     Không sử dụng thẻ XML trong phần trả lời.
     Đảm bảo trích dẫn ngắn gọn và liên quan trực tiếp đến thông tin được cung cấp.
+Yêu cầu:
+    Hãy chọn từ 1 đến 3 món ăn trong danh sách của user_query để gợi ý lại cho người dùng với tone chuyên nghiệp, ngắn gọn, súc tích. 
+    Sử dụng thông tin bổ sung để làm rõ về món ăn (giá, địa chỉ, mô tả) nếu có.
+    Không được nói về 1 món ăn quá 1 lần. Mỗi món ăn chỉ được nói 1 lần.
+    Nếu danh sách chỉ có 1 món ăn, hãy chỉ gợi ý món ăn đó.
 Đầu ra (Output):
 Cung cấp câu trả lời rõ ràng, trực tiếp dựa trên ngữ cảnh, Việt hoá hết đoạn chat. Ví dụ không được để là bun dau mam tom, bun cha.... 
 Câu đầu tiên luôn là: Sau đây là những món ăn tôi chọn để gợi ý cho bạn:
@@ -30,59 +43,55 @@ Câu cuối cùng luôn là: Nếu bạn muốn thử món ăn nào, hãy nhắn
 <user_query>
 Dựa trên các món ăn bạn bè bạn đã chia sẻ 🍽️🍜🍲: {context}
 Thông tin bổ sung về các món ăn: {crawled_info}
-Hãy chọn từ 1 đến 3 món ăn trong danh sách trên để gợi ý lại cho người dùng với tone chuyên nghiệp, ngắn gọn, súc tích. 
-Sử dụng thông tin bổ sung để làm rõ về món ăn (giá, địa chỉ, mô tả) nếu có.
-Không được nói về 1 món ăn quá 1 lần. Mỗi món ăn chỉ được nói 1 lần.
-Nếu danh sách chỉ có 1 món ăn, hãy chỉ gợi ý món ăn đó.
 </user_query>
 """,
     "unique_today": """\
 🌟 Gợi ý món ngon hôm nay từ hành trình ẩm thực của bạn & bạn bè! 🍽️✨
-{context}
-Thông tin bổ sung về các món ăn: {crawled_info}
-
-Hãy gợi ý một món ăn từ các món ăn gần đây của bạn và bạn bè.
+Hãy gợi ý một món ăn từ các món ăn gần đây của bạn và bạn bè (danh sách ở cuối).
 Sử dụng thông tin bổ sung để làm rõ về món ăn (giá, địa chỉ, mô tả) nếu có.
 Thêm các thông tin cơ bản về món ăn đó, ví dụ như tên món, nơi bán, giá cả, địa chỉ, thời gian mở cửa, ... với tone chuyên nghiệp, ngắn gọn, súc tích. 
 Hãy viết ngắn gọn dưới 60 từ.
 Đầu ra (Output):
 Cung cấp câu trả lời rõ ràng, trực tiếp dựa trên ngữ cảnh, Việt hoá hết đoạn chat. Ví dụ không được để là bun dau mam tom, bun cha.... 
+
+Các món ăn gần đây:{context}
+Thông tin bổ sung về các món ăn: {crawled_info}
 """,
     "special_day": """\
 Ngày đặc biệt cần bữa ăn đặc biệt, cùng chọn nha! 💖🍽️
-{context}
-Thông tin bổ sung về các món ăn: {crawled_info}
-
-Nếu hôm nay là một ngày đặc biệt, bạn sẽ nên ăn gì? Hãy gợi ý món ăn phù hợp, cảm xúc Gen Z, thêm chút thơ mộng và icon nha!
+Nếu hôm nay là một ngày đặc biệt, bạn sẽ nên ăn gì? Hãy gợi ý món ăn phù hợp từ các món ăn ở cuối, cảm xúc Gen Z, thêm chút thơ mộng và icon nha!
 Sử dụng thông tin bổ sung để làm rõ về món ăn (giá, địa chỉ, mô tả) nếu có.
 Lưu ý là Việt hoá hết đoạn chat. Ví dụ không được để là bun dau mam tom, bun cha.... 
+
+Các món ăn gần đây:{context}
+Thông tin bổ sung về các món ăn: {crawled_info}
 """,
 "mood_based": """\
 💭 Hôm nay bạn thấy sao? Mình sẽ chọn món phù hợp với tâm trạng của bạn nè!
-{context}
-Thông tin bổ sung về các món ăn: {crawled_info}
-
-Dựa trên các món ăn bạn và bạn bè từng chọn gần đây, hãy gợi ý một món ăn thật phù hợp với tâm trạng (vui, buồn, stress, chill, v.v.).  
+Dựa trên các món ăn bạn và bạn bè từng chọn gần đây (danh sách ở cuối), hãy gợi ý một món ăn thật phù hợp với tâm trạng (vui, buồn, stress, chill, v.v.).  
 Hãy Việt hoá hoàn toàn nội dung, ví dụ không được để là bun dau mam tom, bun cha...  
 Gợi ý nên ngắn gọn dưới 60 từ, thêm chút cảm xúc Gen Z, icon dễ thương, và mô tả món ăn rõ ràng nếu có (giá, địa chỉ, mô tả...).
+
+Các món ăn gần đây:{context}
+Thông tin bổ sung về các món ăn: {crawled_info}
 """,
 "weather_fit": """\
 🌦️ Thời tiết thế này thì ăn gì cho đúng vibe? Mình gợi ý giúp bạn nè!
-{context}
-Thông tin bổ sung về các món ăn: {crawled_info}
-
-Dựa trên các món ăn gần đây và thông tin thời tiết hiện tại (mưa, nắng, se lạnh, oi bức,...), hãy chọn ra món ăn phù hợp nhất.  
+Dựa trên các món ăn gần đây (danh sách ở cuối) và thông tin thời tiết hiện tại (mưa, nắng, se lạnh, oi bức,...), hãy chọn ra món ăn phù hợp nhất.  
 Gợi ý cần ngắn gọn, cảm xúc, dễ thương, Việt hoá hoàn toàn món ăn, và bổ sung thông tin như giá, nơi bán nếu có.  
 Không lặp lại món, chỉ chọn 1 món duy nhất cho phù hợp thời tiết nha!
+
+Các món ăn gần đây:{context}
+Thông tin bổ sung về các món ăn: {crawled_info}
 """,
 "late_night_craving": """\
 🌙 Đêm muộn bụng đói reo? Mình gợi ý món ngon đêm khuya cho bạn nè!
-{context}
-Thông tin bổ sung về các món ăn: {crawled_info}
-
 Chọn một món ăn phù hợp để ăn khuya, không quá nặng bụng nhưng vẫn ngon, dễ thương và phù hợp Gen Z.  
-Hãy dựa vào các món bạn từng ăn trước đó để đưa ra gợi ý. Thêm mô tả ngắn gọn (giá, địa chỉ, cảm giác khi ăn...) nếu có.  
+Hãy dựa vào các món bạn từng ăn trước đó (danh sách ở cuối) để đưa ra gợi ý. Thêm mô tả ngắn gọn (giá, địa chỉ, cảm giác khi ăn...) nếu có.  
 Việt hoá toàn bộ món ăn, thêm chút icon và cảm xúc nhẹ nhàng cho vibe đêm khuya nha.
+
+Các món ăn gần đây:{context}
+Thông tin bổ sung về các món ăn: {crawled_info}
 """,
 
 }
@@ -98,19 +107,25 @@ def get_available_prompts():
     ]
 
 
-def retrieve_user_photos(user_id: str, top_k: int = 5) -> List[str]:
-    """Retrieve photos from a specific user - only food items"""
-    results = collection.query(
-        query_texts=["thức ăn"],  # More focused query for food
-        n_results=top_k,
-        where={
-            "$and": [
-                {"user_id": user_id},
-                {"is_own_photo": True},
-                {"is_food": True},  # Only return actual food items
-            ]
-        },
-    )
+def retrieve_user_photos(user_id: str, top_k: int = 5, sources: Optional[Set[str]] = None,
+                         query_embedding: Optional[List[float]] = None) -> List[str]:
+    """Retrieve photos from a specific user - only food items
+
+    `sources`, if given, collects the user_ids of the returned photos.
+    """
+    query_embedding = query_embedding or embed_query(FOOD_QUERY)
+    with stage_timer("chroma_query"):
+        results = get_collection().query(
+            query_embeddings=[query_embedding],  # More focused query for food
+            n_results=top_k,
+            where={
+                "$and": [
+                    {"user_id": user_id},
+                    {"is_own_photo": True},
+                    {"is_food": True},  # Only return actual food items
+                ]
+            },
+        )
 
     documents = results.get("documents", [[]])[0]
 
@@ -118,178 +133,78 @@ def retrieve_user_photos(user_id: str, top_k: int = 5) -> List[str]:
     if not documents:
         return ["Bạn chưa có ảnh món ăn nào. Hãy chia sẻ những món ăn bạn thích!"]
 
+    if sources is not None:
+        sources.update(m.get("user_id") for m in results.get("metadatas", [[]])[0])
     return documents
 
 
-def retrieve_friend_photos(user_id: str, top_k: int = 5) -> List[str]:
+def retrieve_friend_photos(user_id: str, top_k: int = 5, sources: Optional[Set[str]] = None,
+                           query_embedding: Optional[List[float]] = None) -> List[str]:
     """Retrieve photos from friends of the specified user - only food items
 
-    This should return photos where:
-    1. For user_id=1, return photos from user_id=3 (since they're friends)
-    2. For user_id=3, return photos from user_id=1 (since they're friends)
+    Friends come from the friend graph and are pushed down into the Chroma
+    filter, so exactly top_k friend photos are fetched.
     """
-    # We need to find photos where:
-    # - The photo doesn't belong to the current user (user_id)
-    # - The photo is marked as food
-    # BUT critically, we need to consider the reciprocal friendship relationship
-
-    # This complex query isn't easily expressible in ChromaDB's where clause
-    # So first we get all food photos that aren't from the current user
-    results = collection.query(
-        query_texts=["thức ăn"],
-        n_results=50,  # Get more results to filter from
-        where={
-            "$and": [
-                {"user_id": {"$ne": user_id}},  # Not from the current user
-                {"is_food": True},  # Only return actual food items
-            ]
-        },
-    )
-
-    # Then filter for friends' photos by examining each document
-    documents = results.get("documents", [[]])[0]
-    metadatas = results.get("metadatas", [[]])[0]
-
-    # If no photos at all, return explanatory message
-    if not documents:
+    friend_ids = friend_graph.get_friends(user_id)
+    if not friend_ids:
         return ["Hiện tại bạn chưa có ảnh món ăn từ bạn bè để gợi ý."]
 
-    # Filter to get only relevant friend photos
-    friend_photos = []
-    friend_count = 0
-
-    for i, metadata in enumerate(metadatas):
-        # Skip if index out of bounds
-        if i >= len(documents):
-            continue
-
-        # This manual filtering logic helps us find friend photos correctly
-        # For each user_id, we know which other user_ids are their friends
-        other_user_id = metadata.get("user_id")
-
-        is_friend_photo = False
-        # For user_id=1, look for photos from user_id=3
-        if user_id == "1" and other_user_id == "3":
-            is_friend_photo = True
-        # For user_id=3, look for photos from user_id=1
-        elif user_id == "3" and other_user_id == "1":
-            is_friend_photo = True
+    query_embedding = query_embedding or embed_query(FOOD_QUERY)
+    with stage_timer("chroma_query"):
+        results = get_collection().query(
+            query_embeddings=[query_embedding],
+            n_results=top_k,
+            where={
+                "$and": [
+                    {"user_id": {"$in": friend_ids}},
+                    {"is_food": True},  # Only return actual food items
+                ]
+            },
+        )
 
-        if is_friend_photo and friend_count < top_k:
-            friend_photos.append(documents[i])
-            friend_count += 1
+    documents = results.get("documents", [[]])[0]
 
-    # If no friend photos found after filtering, return explanatory message
-    if not friend_photos:
+    # If no friend photos found, return explanatory message
+    if not documents:
         return ["Hiện tại bạn chưa có ảnh món ăn từ bạn bè để gợi ý."]
 
-    return friend_photos
-
-CRAWLED_JSON_PATH = "extracted_food_data.json" 
-
-
-def normalize_food_name(name: str) -> str:
-    name = name.lower().strip()
-    name = re.sub(r"\s+", " ", name)
-    return name
-
-
-def get_closest_food_name(food_name: str, crawled_data: List[Dict]) -> str:
-    normalized_name = normalize_food_name(food_name)
-    food_names = [normalize_food_name(item["name"]) for item in crawled_data]
-    closest = difflib.get_close_matches(normalized_name, food_names, n=1, cutoff=0.8)
-    return closest[0] if closest else None
-
-
-def load_crawled_data() -> List[Dict[str, Any]]:
-    try:
-        if not os.path.exists(CRAWLED_JSON_PATH):
-            logger.error(f"File {CRAWLED_JSON_PATH} không tồn tại")
-            return []
-
-        with open(CRAWLED_JSON_PATH, "r", encoding="utf-8") as f:
-            data = json.load(f)
+    if sources is not None:
+        sources.update(m.get("user_id") for m in results.get("metadatas", [[]])[0])
+    return documents
 
-        # Lọc các mục không có error
-        valid_data = [item for item in data if not item.get("error", False)]
-        logger.debug(f"Đã đọc {len(valid_data)} món ăn hợp lệ từ file JSON")
-        return valid_data
-    except Exception as e:
-        logger.error(f"Lỗi khi đọc file JSON: {str(e)}")
-        return []
-
-
-# def get_crawled_info(food_names: List[str]) -> str:
-#     crawled_data = load_crawled_data()
-#     crawled_info = []
-#     for food_name in food_names:
-#         for item in crawled_data:
-#             if item.get("name", "").lower() == food_name.lower():
-#                 info = f"{item['name']}: {item['description']} Giá: {item['price']}. Địa chỉ: {item['popular_address']}"
-#                 crawled_info.append(info)
-#                 break
-#     return (
-#         "\n- ".join(crawled_info)
-#         if crawled_info
-#         else "Không có thông tin bổ sung cho các món ăn này."
-#     )
-
-
-def get_crawled_info(food_names: List[str]) -> str:
-    crawled_data = load_crawled_data()
-    crawled_info = []
-    normalized_food_names = [normalize_food_name(name) for name in food_names]
+def get_crawled_matches(food_names: List[str]) -> List[CrawledMatch]:
+    matches = []
     logger.debug(f"Tìm thông tin crawl cho các món: {food_names}")
 
-    for food_name, normalized_name in zip(food_names, normalized_food_names):
-        found = False
-        for item in crawled_data:
-            if normalize_food_name(item.get("name", "")) == normalized_name:
-                info = f"{item['name']}: {item['description']} Giá: {item['price']}. Địa chỉ: {item['popular_address']}"
-                crawled_info.append(info)
-                logger.debug(
-                    f"Tìm thấy thông tin khớp chính xác cho món {food_name}: {info}"
-                )
-                found = True
-                break
-
-        if not found:
-            closest_name = get_closest_food_name(food_name, crawled_data)
-            if closest_name:
-                for item in crawled_data:
-                    if normalize_food_name(item.get("name", "")) == closest_name:
-                        info = f"{item['name']} (gần giống {food_name}): {item['description']} Giá: {item['price']}. Địa chỉ: {item['popular_address']}"
-                        crawled_info.append(info)
-                        logger.debug(
-                            f"Tìm thấy thông tin khớp gần giống cho món {food_name}: {info}"
-                        )
-                        found = True
-                        break
-
-        if not found:
+    for food_name in food_names:
+        with stage_timer("crawled_lookup"):
+            item, exact = food_knowledge_base.lookup(food_name)
+        if item is None:
             logger.debug(f"Không tìm thấy thông tin crawl cho món {food_name}")
+            continue
 
-    return (
-        "\n- ".join(crawled_info)
-        if crawled_info
-        else "Không có thông tin bổ sung cho các món ăn này."
-    )
+        matches.append((item, food_name, exact))
+        logger.debug(
+            f"Tìm thấy thông tin khớp {'chính xác' if exact else 'gần giống'} cho món {food_name}: {item['name']}"
+        )
+    return matches
 
 
 def retrieve_context(
-    user_id: str, top_k: int = 5, prompt_key: str = None
-) -> tuple[List[str], str]:
-    """Smart context retrieval based on prompt type, returns context and crawled info"""
+    user_id: str, top_k: int = 5, prompt_key: str = None, sources: Optional[Set[str]] = None,
+    query_embedding: Optional[List[float]] = None,
+) -> tuple[List[str], List[CrawledMatch]]:
+    """Smart context retrieval based on prompt type, returns context and the matched crawled dishes"""
     if isinstance(user_id, int):
         user_id = str(user_id)
 
     if prompt_key == "like_friends":
         # For friend-based prompts, get only friend photos
-        context = retrieve_friend_photos(user_id, top_k)
+        context = retrieve_friend_photos(user_id, top_k, sources, query_embedding)
     elif prompt_key == "unique_today":
         # For mixed prompts, get both user and friend photos
-        user_photos = retrieve_user_photos(user_id, top_k // 2)
-        friend_photos = retrieve_friend_photos(user_id, top_k // 2)
+        user_photos = retrieve_user_photos(user_id, top_k // 2, sources, query_embedding)
+        friend_photos = retrieve_friend_photos(user_id, top_k // 2, sources, query_embedding)
         actual_user_photos = [
             p
             for p in user_photos
@@ -311,7 +226,7 @@ def retrieve_context(
         else:
             context = actual_user_photos + actual_friend_photos
     else:
-        context = retrieve_user_photos(user_id, top_k)
+        context = retrieve_user_photos(user_id, top_k, sources, query_embedding)
 
     # Extract food names from context
     food_names = []
@@ -325,87 +240,186 @@ def retrieve_context(
                 food_names.append(food_name)
 
     # Get crawled info for the extracted food names
-    crawled_info = get_crawled_info(food_names)
-    return context, crawled_info
+    return context, get_crawled_matches(food_names)
+
+
+def prepare_suggestion(user_id: str, prompt_key: str, query_embedding: Optional[List[float]] = None
+                       ) -> Dict[str, Any]:
+    """Retrieve context and build the prompt for a suggestion.
+
+    Returns {"message": ...} when there is nothing to ask the LLM about, otherwise
+    the prompt with its cache fingerprint, source users and retrieved dishes.
+    """
+    # Convert user_id to string for consistent comparison
+    if isinstance(user_id, int):
+        user_id = str(user_id)
+
+    template = SUGGESTION_TEMPLATES.get(prompt_key)
+    if not template:
+        return {"message": "Không hiểu bạn muốn hỏi gì 🤔"}
+
+    # Get context based on prompt type
+    sources = set()
+    context_snippets, crawled_matches = retrieve_context(
+        user_id, top_k=5, prompt_key=prompt_key, sources=sources, query_embedding=query_embedding
+    )
+
+    # Handle special case for friend-based prompts
+    if prompt_key == "like_friends":
+        if not context_snippets or context_snippets[0].startswith("Hiện tại"):
+            # For user_id=3, they should see Super Admin's photos
+            if user_id == "3":
+                return {"message": "Chưa có ảnh món ăn nào từ Super Admin. Hãy nhắc họ chia sẻ nhé! 🍕👫"}
+            # For user_id=1, they should see Hoa Thanh's photos
+            elif user_id == "1":
+                return {"message": "Chưa có ảnh món ăn nào từ Hoa Thanh. Hãy nhắc họ chia sẻ nhé! 🍕👫"}
+            # Generic message for other users
+            else:
+                return {"message": "Bạn bè bạn chưa đăng ảnh món ăn nào. Hãy rủ họ chia sẻ nhé! 🍕👫"}
+
+    # General case - no images at all
+    if not context_snippets:
+        return {"message": "Bạn chưa có ảnh nào để gợi ý. Hãy đăng vài món ăn nhé! 🍜📸"}
+
+    # Handle explanatory messages which aren't actual context
+    if context_snippets[0].startswith("Hiện tại") or context_snippets[0].startswith(
+        "Bạn chưa"
+    ):
+        return {"message": context_snippets[0]}
+
+    # Group similar food items to avoid repetition in context
+    food_items = {}
+    for snippet in context_snippets:
+        # Skip explanatory messages
+        if snippet.startswith("Hiện tại") or snippet.startswith("Bạn chưa"):
+            continue
+
+        # Extract food name using a simple pattern match
+        parts = snippet.split("đăng ảnh món ")
+        if len(parts) > 1:
+            food_name = parts[1].split(" vào ngày")[0].strip()
+            user_name = parts[0].split("(")[0].strip()
+
+            # Group by food name
+            if food_name not in food_items:
+                food_items[food_name] = [f"{user_name} đã chia sẻ món {food_name}"]
+            else:
+                # Only add another mention if it's a different user
+                if not any(user_name in item for item in food_items[food_name]):
+                    food_items[food_name].append(
+                        f"{user_name} cũng đã chia sẻ món {food_name}"
+                    )
+
+    # Format context with deduplicated food items
+    if food_items:
+        formatted_context = []
+        for food, mentions in food_items.items():
+            formatted_context.append(f"{food}: {', '.join(mentions)}")
+
+        context = "\n- " + "\n- ".join(formatted_context)
+    else:
+        # Fallback to original context formatting if pattern matching fails
+        context = "\n- " + "\n- ".join(context_snippets[:5])
+
+    built = build_prompt(prompt_key, template, context, crawled_matches)
+    return {
+        "user_id": user_id,
+        "prompt_key": prompt_key,
+        "prompt": built["prompt"],
+        "tokens": built["tokens"],
+        # Identical retrieved context means an identical prompt
+        "fingerprint": context_fingerprint(context_snippets, built["crawled_info"]),
+        "sources": sources,
+        "dishes": [{"name": food, "mentions": mentions} for food, mentions in food_items.items()],
+    }
+
+
+async def prepare_suggestion_async(user_id: str, prompt_key: str) -> Dict[str, Any]:
+    """Run prepare_suggestion off the event loop.
+
+    The query is embedded on the inference thread, where every model call runs;
+    Chroma, the friend lookup and prompt building run on a worker thread.
+    """
+    query_embedding = await run_inference(embed_query, FOOD_QUERY)
+    return await asyncio.to_thread(prepare_suggestion, user_id, prompt_key, query_embedding)
 
 
 async def generate_suggestion_by_prompt(user_id: str, prompt_key: str) -> str:
     try:
-        # Convert user_id to string for consistent comparison
-        if isinstance(user_id, int):
-            user_id = str(user_id)
+        prepared = await prepare_suggestion_async(user_id, prompt_key)
+        if "message" in prepared:
+            return prepared["message"]
 
-        template = SUGGESTION_TEMPLATES.get(prompt_key)
-        if not template:
-            return "Không hiểu bạn muốn hỏi gì 🤔"
+        # Identical retrieved context means an identical prompt: reuse the last answer
+        cached = suggestion_cache.get(prepared["user_id"], prompt_key, prepared["fingerprint"])
+        if cached is not None:
+            return cached
 
-        # Get context based on prompt type
-        context_snippets, crawled_info = retrieve_context(
-            user_id, top_k=5, prompt_key=prompt_key
+        logger.debug(f"Generating suggestion with prompt:\n{prepared['prompt']}")
+
+        response = await llm_router.complete(prepared["prompt"])
+        suggestion = response.strip()
+        suggestion_cache.set(
+            prepared["user_id"], prompt_key, prepared["fingerprint"], suggestion, related_users=prepared["sources"]
         )
+        return suggestion
+    except Exception as e:
+        ERRORS.labels("suggestion").inc()
+        logger.error(f"Suggestion generation error: {str(e)}")
+        return "Đã xảy ra lỗi khi tạo gợi ý 😢"
 
-        # Handle special case for friend-based prompts
-        if prompt_key == "like_friends":
-            if not context_snippets or context_snippets[0].startswith("Hiện tại"):
-                # For user_id=3, they should see Super Admin's photos
-                if user_id == "3":
-                    return "Chưa có ảnh món ăn nào từ Super Admin. Hãy nhắc họ chia sẻ nhé! 🍕👫"
-                # For user_id=1, they should see Hoa Thanh's photos
-                elif user_id == "1":
-                    return "Chưa có ảnh món ăn nào từ Hoa Thanh. Hãy nhắc họ chia sẻ nhé! 🍕👫"
-                # Generic message for other users
-                else:
-                    return "Bạn bè bạn chưa đăng ảnh món ăn nào. Hãy rủ họ chia sẻ nhé! 🍕👫"
-
-        # General case - no images at all
-        if not context_snippets:
-            return "Bạn chưa có ảnh nào để gợi ý. Hãy đăng vài món ăn nhé! 🍜📸"
-
-        # Handle explanatory messages which aren't actual context
-        if context_snippets[0].startswith("Hiện tại") or context_snippets[0].startswith(
-            "Bạn chưa"
-        ):
-            return context_snippets[0]
-
-        # Group similar food items to avoid repetition in context
-        food_items = {}
-        for snippet in context_snippets:
-            # Skip explanatory messages
-            if snippet.startswith("Hiện tại") or snippet.startswith("Bạn chưa"):
-                continue
-
-            # Extract food name using a simple pattern match
-            parts = snippet.split("đăng ảnh món ")
-            if len(parts) > 1:
-                food_name = parts[1].split(" vào ngày")[0].strip()
-                user_name = parts[0].split("(")[0].strip()
-
-                # Group by food name
-                if food_name not in food_items:
-                    food_items[food_name] = [f"{user_name} đã chia sẻ món {food_name}"]
-                else:
-                    # Only add another mention if it's a different user
-                    if not any(user_name in item for item in food_items[food_name]):
-                        food_items[food_name].append(
-                            f"{user_name} cũng đã chia sẻ món {food_name}"
-                        )
-
-        # Format context with deduplicated food items
-        if food_items:
-            formatted_context = []
-            for food, mentions in food_items.items():
-                formatted_context.append(f"{food}: {', '.join(mentions)}")
-
-            context = "\n- " + "\n- ".join(formatted_context)
-        else:
-            # Fallback to original context formatting if pattern matching fails
-            context = "\n- " + "\n- ".join(context_snippets[:5])
 
-        prompt = template.format(context=context, crawled_info=crawled_info)
-        print(f"[DEBUG] Generating suggestion with prompt:\n{prompt}")
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
-        response = await ask_groq(prompt)
-        return response.strip()
+
+async def stream_suggestion_by_prompt(user_id: str, prompt_key: str) -> AsyncGenerator[str, None]:
+    """Server-sent events: `metadata` with the retrieved dishes, `token` deltas, then `done` with timings"""
+    started = time.perf_counter()
+    first_token_at = None
+    cached = None
+    try:
+        prepared = await prepare_suggestion_async(user_id, prompt_key)
+        if "message" in prepared:
+            yield sse_event("metadata", {"prompt_key": prompt_key, "dishes": [], "cached": False})
+            yield sse_event("token", {"text": prepared["message"]})
+            elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+            yield sse_event("done", {"ttft_ms": elapsed_ms, "total_ms": elapsed_ms, "cached": False})
+            return
+
+        cached = suggestion_cache.get(prepared["user_id"], prompt_key, prepared["fingerprint"])
+        yield sse_event("metadata", {
+            "prompt_key": prompt_key,
+            "dishes": prepared["dishes"],
+            "cached": cached is not None,
+            "prompt_tokens": prepared["tokens"]["total"],
+            "retrieval_ms": round((time.perf_counter() - started) * 1000, 1),
+        })
+
+        if cached is not None:
+            first_token_at = time.perf_counter()
+            yield sse_event("token", {"text": cached})
+        else:
+            parts = []
+            async for content in llm_router.stream(prepared["prompt"]):
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                parts.append(content)
+                yield sse_event("token", {"text": content})
+            suggestion_cache.set(
+                prepared["user_id"], prompt_key, prepared["fingerprint"], "".join(parts).strip(),
+                related_users=prepared["sources"],
+            )
     except Exception as e:
-        logger.error(f"Suggestion generation error: {str(e)}")
-        return "Đã xảy ra lỗi khi tạo gợi ý 😢"
+        ERRORS.labels("suggestion").inc()
+        logger.error(f"Suggestion streaming error: {str(e)}")
+        yield sse_event("error", {"message": "Đã xảy ra lỗi khi tạo gợi ý 😢", "detail": str(e)})
+
+    finished = time.perf_counter()
+    ttft_ms = round((first_token_at - started) * 1000, 1) if first_token_at else None
+    logger.info(f"Suggestion stream {prompt_key} for user {user_id}: ttft={ttft_ms}ms")
+    yield sse_event("done", {
+        "ttft_ms": ttft_ms,
+        "total_ms": round((finished - started) * 1000, 1),
+        "cached": cached is not None,
+    })
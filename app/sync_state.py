@@ -0,0 +1,180 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, Optional, Set, Tuple
+
+from .config import SYNC_STATE_PATH
+
+# Photos are ordered by (createdAt, id); ids are zero-padded so numeric ids sort numerically
+PhotoKey = Tuple[str, str]
+
+
+def photo_key(photo: Dict[str, Any]) -> PhotoKey:
+    return str(photo.get("createdAt", "")), str(photo.get("id", "")).zfill(20)
+
+
+def token_key(token: str) -> str:
+    """Key for per-caller state: a hash of the whole token.
+
+    The token's claims are not verified here, so they cannot identify a user;
+    only a caller holding the exact same token shares its key.
+    """
+    return f"token:{hashlib.sha256(token.encode('utf-8')).hexdigest()}"
+
+
+def watermark_after(photos: Iterable[Dict[str, Any]], failed: Iterable[Dict[str, Any]]) -> Optional[PhotoKey]:
+    """Newest photo key that can be committed: never past the oldest photo that failed"""
+    keys = [photo_key(p) for p in photos]
+    failed_keys = [photo_key(p) for p in failed]
+    if failed_keys:
+        oldest_failure = min(failed_keys)
+        keys = [k for k in keys if k < oldest_failure]
+    return max(keys) if keys else None
+
+
+def extend_watermark(chain: Optional[PhotoKey], segment: Optional[PhotoKey], failed: bool) -> Optional[PhotoKey]:
+    """Watermark over a read split across calls, given the next (older) segment's own watermark.
+
+    Every earlier segment is newer, so a failure in this one caps the whole read at `segment`.
+    """
+    if failed or chain is None:
+        return segment
+    return max(chain, segment) if segment else chain
+
+
+class SyncState:
+    """Per-token sync watermarks for the own-photo and friend-photo streams, and per-user
+    friend lists, shared by every worker through SQLite.
+
+    Each key holds one JSON entry; every change re-reads the entries it touches
+    inside an immediate transaction, so concurrent workers never overwrite each
+    other's keys.
+
+    The friend watermark is tied to the friends seen so far; when a new friend
+    appears their older photos have never been fetched, so the next sync
+    re-reads the friend stream from the start.
+
+    A read that hits the page limit cannot move the watermarks (older photos were
+    not fetched yet); it stores a resume offset instead, and the watermarks move
+    once a read starting there reaches them.
+    """
+
+    def __init__(self, path: str = SYNC_STATE_PATH):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        # Calls come from worker threads (asyncio.to_thread)
+        self._lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, data TEXT NOT NULL)")
+            self._conn = conn
+        return self._conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Write transaction holding SQLite's write lock from the first read, across processes"""
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+
+    @staticmethod
+    def _get(db: sqlite3.Connection, key: str) -> Optional[Dict[str, Any]]:
+        row = db.execute("SELECT data FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    @staticmethod
+    def _put(db: sqlite3.Connection, key: str, entry: Dict[str, Any]):
+        db.execute("INSERT OR REPLACE INTO sync_state (key, data) VALUES (?, ?)", (key, json.dumps(entry)))
+
+    def _read(self, key: str) -> Dict[str, Any]:
+        with self._lock:
+            return self._get(self._db(), key) or {}
+
+    def watermarks(self, key: str) -> Dict[str, Any]:
+        entry = self._read(key)
+        return {
+            "own": tuple(entry["own"]) if entry.get("own") else None,
+            "friends": tuple(entry["friends"]) if entry.get("friends") else None,
+            "resume": dict(entry["resume"]) if entry.get("resume") else None,
+            "friends_read_at": entry.get("friends_read_at"),
+        }
+
+    def advance(self, key: str, own: Optional[PhotoKey], friends: Optional[PhotoKey],
+                friend_ids: Iterable[str] = (), full_friend_read: bool = False):
+        """Move the watermarks forward; photos from a friend not seen before restart the friend stream.
+
+        `full_friend_read` marks a read of the whole friend stream, which refreshed the friend list.
+        """
+        with self._transaction() as db:
+            entry = self._get(db, key) or {}
+            if full_friend_read:
+                entry["friends_read_at"] = time.time()
+            if own and (not entry.get("own") or tuple(entry["own"]) < own):
+                entry["own"] = list(own)
+            known = entry.get("friend_ids")
+            friend_ids = {str(f) for f in friend_ids}
+            if known is not None and friend_ids - set(known):
+                entry.pop("friends", None)
+                friends = None
+            entry["friend_ids"] = sorted(set(known or ()) | friend_ids)
+            if friends and (not entry.get("friends") or tuple(entry["friends"]) < friends):
+                entry["friends"] = list(friends)
+            entry.pop("resume", None)
+            self._put(db, key, entry)
+
+    def set_resume(self, key: str, offset: int, since: Optional[str], friend_ids: Iterable[str] = (),
+                   own: Optional[PhotoKey] = None, friends: Optional[PhotoKey] = None):
+        """Remember where a read cut short by SYNC_MAX_PAGES stopped, so the next call pages on from there.
+
+        `friend_ids` are the friends seen so far in the read and `own`/`friends` the
+        watermarks it has earned, kept until it completes.
+        """
+        with self._transaction() as db:
+            entry = self._get(db, key) or {}
+            entry["resume"] = {
+                "offset": offset,
+                "since": since,
+                "friend_ids": sorted({str(f) for f in friend_ids}),
+                "own": list(own) if own else None,
+                "friends": list(friends) if friends else None,
+            }
+            self._put(db, key, entry)
+
+    def friends(self, user_id: str) -> Set[str]:
+        """Friend list stored for a backend user id; empty until a full read of their feed"""
+        return set(self._read(f"friends:{user_id}").get("friend_list", ()))
+
+    def record_friends(self, user_id: str, friend_ids: Set[str]):
+        """Replace a user's friend list and mirror the change into the stored lists of added and removed friends"""
+        with self._transaction() as db:
+            previous = set((self._get(db, f"friends:{user_id}") or {}).get("friend_list", ()))
+            self._put(db, f"friends:{user_id}", {"friend_list": sorted(friend_ids)})
+            for friend_id in friend_ids | previous:
+                entry = self._get(db, f"friends:{friend_id}")
+                if entry is None:
+                    continue
+                stored = set(entry["friend_list"])
+                updated = stored | {user_id} if friend_id in friend_ids else stored - {user_id}
+                if updated != stored:
+                    entry["friend_list"] = sorted(updated)
+                    self._put(db, f"friends:{friend_id}", entry)
+
+    def reset(self, key: str):
+        with self._transaction() as db:
+            db.execute("DELETE FROM sync_state WHERE key = ?", (key,))
+
+
+sync_state = SyncState()
@@ -0,0 +1,6 @@
+"""
+Offline benchmark suite for the FastAPI app:
+
+- `bench.fake_upstreams`: fake backend, IPFS, OpenAI-compatible and Ollama servers
+- `bench.run`: starts the fakes and the app, drives load and prints JSON results
+"""
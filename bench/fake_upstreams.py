@@ -0,0 +1,208 @@
+"""
+Local stand-ins for every upstream the service talks to, served from one process:
+
+- backend: GET {api_prefix}/photos/ai/user-content (max_photos, offset, since)
+- image server: GET /ipfs/{cid} (deterministic JPEGs)
+- OpenAI-compatible LLM (what the Groq SDK calls): POST /openai/v1/chat/completions
+- Ollama: POST /api/chat (NDJSON), /api/generate, GET /api/tags
+
+Run with `python -m bench.fake_upstreams --port 8900`.
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Header, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from PIL import Image, ImageDraw
+
+_BASE58 = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+_BASE_TIME = datetime(2025, 1, 1)
+_WORDS = ["Hôm ", "nay ", "bạn ", "thử ", "món ", "phở ", "bò ", "nhé, ", "nước ", "dùng ", "rất ", "ngon! "]
+
+
+def fake_token(user_id: int) -> str:
+    """Unsigned JWT whose `sub` is the user id; only the fake backend reads it"""
+    def encode(data: Dict[str, Any]) -> str:
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+    return f"{encode({'alg': 'none', 'typ': 'JWT'})}.{encode({'sub': user_id})}.bench"
+
+
+def _token_user(authorization: Optional[str]) -> int:
+    try:
+        payload = authorization.split(" ", 1)[1].split(".")[1]
+        return int(json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))["sub"])
+    except (AttributeError, IndexError, KeyError, ValueError):
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+
+def fake_cid(photo_id: int) -> str:
+    digest = hashlib.sha256(f"bench-photo-{photo_id}".encode()).digest()
+    return "Qm" + "".join(_BASE58[b % 58] for b in (digest + digest)[:44])
+
+
+class FakeData:
+    """`users` users with `photos_per_user` photos each; user u is friends with u-1 and u+1"""
+
+    def __init__(self, users: int, photos_per_user: int, base_url: str):
+        self.users = users
+        self.photos: Dict[int, List[Dict[str, Any]]] = {}
+        for user_id in range(1, users + 1):
+            photos = []
+            for n in range(photos_per_user):
+                photo_id = user_id * 100000 + n
+                photos.append({
+                    "id": photo_id,
+                    "url": f"{base_url}/ipfs/{fake_cid(photo_id)}",
+                    "userId": user_id,
+                    "userName": f"Bench User {user_id}",
+                    "createdAt": (_BASE_TIME + timedelta(minutes=n, seconds=user_id)).isoformat() + "Z",
+                })
+            # The feed is newest first
+            self.photos[user_id] = sorted(photos, key=lambda p: p["createdAt"], reverse=True)
+
+    def friends(self, user_id: int) -> List[int]:
+        return [f for f in (user_id - 1, user_id + 1) if 1 <= f <= self.users]
+
+    def feed(self, user_id: int, max_photos: int, offset: int, since: Optional[str]) -> Dict[str, Any]:
+        def page(photos):
+            if since:
+                photos = [p for p in photos if p["createdAt"] >= since]
+            return photos[offset:offset + max_photos]
+
+        friend_photos = sorted(
+            (p for f in self.friends(user_id) for p in self.photos[f]), key=lambda p: p["createdAt"], reverse=True
+        )
+        return {
+            "userId": user_id,
+            "userPhotos": page(self.photos.get(user_id, [])),
+            "friendPhotos": page(friend_photos),
+        }
+
+
+@lru_cache(maxsize=4096)
+def fake_jpeg(cid: str, size: int) -> bytes:
+    """A JPEG with a few shapes whose colours depend on the CID"""
+    seed = hashlib.sha256(cid.encode()).digest()
+    image = Image.new("RGB", (size, size), tuple(seed[:3]))
+    draw = ImageDraw.Draw(image)
+    for i in range(4):
+        x, y = seed[3 + i] * size // 256, seed[7 + i] * size // 256
+        draw.ellipse((x, y, x + size // 3, y + size // 3), fill=tuple(seed[11 + 3 * i:14 + 3 * i]))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def create_app(args: argparse.Namespace) -> FastAPI:
+    app = FastAPI(title="TrueGift benchmark upstreams")
+    data = FakeData(args.users, args.photos_per_user, f"http://{args.host}:{args.port}")
+    words = (_WORDS * (args.tokens // len(_WORDS) + 1))[:args.tokens]
+
+    @app.get("/healthz")
+    async def healthz():
+        return {"status": "ok"}
+
+    @app.get("/")
+    async def backend_root():
+        return {"status": "ok"}
+
+    @app.get(f"{args.api_prefix}/photos/ai/user-content")
+    async def user_content(
+        max_photos: int = 50, offset: int = 0, since: Optional[str] = None, authorization: Optional[str] = Header(None)
+    ):
+        await asyncio.sleep(args.backend_delay)
+        return data.feed(_token_user(authorization), max_photos, offset, since)
+
+    @app.get("/ipfs/{cid}")
+    async def image(cid: str):
+        await asyncio.sleep(args.image_delay)
+        return Response(fake_jpeg(cid, args.image_size), media_type="image/jpeg")
+
+    @app.post("/openai/v1/chat/completions")
+    async def openai_chat(request: Request):
+        body = await request.json()
+        created = int(time.time())
+        if not body.get("stream"):
+            await asyncio.sleep(args.first_token_delay + args.token_delay * len(words))
+            return {
+                "id": "bench", "object": "chat.completion", "created": created, "model": body.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(words)},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)},
+            }
+
+        async def events():
+            await asyncio.sleep(args.first_token_delay)
+            for word in words:
+                chunk = {
+                    "id": "bench", "object": "chat.completion.chunk", "created": created, "model": body.get("model"),
+                    "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                await asyncio.sleep(args.token_delay)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/api/chat")
+    async def ollama_chat(request: Request):
+        body = await request.json()
+        # A resumed stream sends the partial answer back as the assistant message
+        messages = body.get("messages") or []
+        partial = messages[-1]["content"] if messages and messages[-1].get("role") == "assistant" else ""
+        sent = 0
+        while sent < len(words) and partial.startswith("".join(words[:sent + 1])):
+            sent += 1
+        remaining = words[sent:]
+
+        async def lines():
+            await asyncio.sleep(args.first_token_delay)
+            for word in remaining:
+                yield json.dumps({"model": body.get("model"), "message": {"role": "assistant", "content": word},
+                                  "done": False}, ensure_ascii=False).encode() + b"\n"
+                await asyncio.sleep(args.token_delay)
+            yield json.dumps({"model": body.get("model"), "message": {"role": "assistant", "content": ""},
+                              "done": True}).encode() + b"\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    @app.post("/api/generate")
+    async def ollama_generate(request: Request):
+        body = await request.json()
+        return {"model": body.get("model"), "response": "", "done": True}
+
+    @app.get("/api/tags")
+    async def ollama_tags():
+        return {"models": [{"name": "bench"}]}
+
+    return app
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Fake backend, IPFS, OpenAI-compatible and Ollama servers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--api-prefix", default="/api/v1")
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--photos-per-user", type=int, default=50)
+    parser.add_argument("--image-size", type=int, default=640, help="Side of the generated JPEGs in pixels")
+    parser.add_argument("--backend-delay", type=float, default=0.0, help="Seconds per backend feed page")
+    parser.add_argument("--image-delay", type=float, default=0.0, help="Seconds per image download")
+    parser.add_argument("--tokens", type=int, default=60, help="Tokens per LLM answer")
+    parser.add_argument("--first-token-delay", type=float, default=0.2, help="Seconds before the first LLM token")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="Seconds between LLM tokens")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    uvicorn.run(create_app(args), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,355 @@
+"""
+Benchmark the service against local fake upstreams and print machine-readable results.
+
+    python -m bench.run --users 4 --photos-per-user 50 --concurrency 8 --output results.json
+    python -m bench.run --baseline results.json   # also print relative changes against an earlier run
+
+The app runs as a uvicorn subprocess in a temporary working directory with a
+generated .env: a fresh Chroma store, sync state and prediction cache per run,
+and every upstream URL pointed at `bench.fake_upstreams`. Model weights and the
+other settings come from the repository's .env (env.sample when there is none).
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+from dotenv import dotenv_values
+
+from .fake_upstreams import fake_token
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_PATH_SETTINGS = ("YOLO_MODEL_PATH", "YOLO_GENERAL_CLS_MODEL_PATH")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    """p50/p95/p99/max in milliseconds"""
+    if not samples:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+    ordered = sorted(samples)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000, 1)
+
+    return {"p50_ms": pick(0.5), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "max_ms": round(ordered[-1] * 1000, 1)}
+
+
+def peak_rss_mb(pid: int) -> Optional[float]:
+    """High-water mark of the process's resident memory (Linux), or its current RSS via psutil"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    try:
+        import psutil
+        return round(psutil.Process(pid).memory_info().rss / 2**20, 1)
+    except Exception:
+        return None
+
+
+def write_env(workdir: str, upstream: str, args: argparse.Namespace) -> Dict[str, str]:
+    """Repository settings with every upstream and every state file redirected for the run"""
+    base_path = os.path.join(REPO_ROOT, ".env")
+    env = dict(dotenv_values(base_path if os.path.exists(base_path) else os.path.join(REPO_ROOT, "env.sample")))
+    for key in _PATH_SETTINGS:
+        if env.get(key) and not os.path.isabs(env[key]):
+            env[key] = os.path.normpath(os.path.join(REPO_ROOT, env[key]))
+    env.update({
+        "BACKEND_URL": upstream,
+        "BACKEND_API_PREFIX": "/api/v1",
+        "REQUEST_TIMEOUT": "30",
+        "DEFAULT_AUTH_TOKEN": fake_token(1),
+        "GROQ_API_KEY": "bench",
+        "GROQ_BASE_URL": upstream,
+        "CLOUD_MODEL": env.get("CLOUD_MODEL") or "bench",
+        "OLLAMA_BASE_URL": upstream,
+        "OLLAMA_PRELOAD": "false",
+        "CHROMA_PATH": os.path.join(workdir, "chroma_db"),
+        "PREDICTION_CACHE_ENABLED": "true" if args.prediction_cache else "false",
+        "PREDICTION_CACHE_PATH": os.path.join(workdir, "prediction_cache.sqlite3"),
+        "SYNC_STATE_PATH": os.path.join(workdir, "sync_state.sqlite3"),
+        "INDEXING_JOBS_PATH": os.path.join(workdir, "indexing_jobs.sqlite3"),
+        # Every suggestion goes to the LLM
+        "SUGGESTION_CACHE_TTL": "0.000001",
+        "INDEXING_WORKERS": str(args.concurrency),
+    })
+    for override in args.set:
+        key, _, value = override.partition("=")
+        env[key.strip()] = value
+    with open(os.path.join(workdir, ".env"), "w", encoding="utf-8") as f:
+        for key, value in env.items():
+            f.write(f"{key}={'' if value is None else value}\n")
+    # Suggestions read the crawled dish data relative to the working directory
+    shutil.copy(os.path.join(REPO_ROOT, "extracted_food_data.json"), workdir)
+    return env
+
+
+async def wait_until(url: str, timeout: float, process: subprocess.Popen):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{url} exited with code {process.returncode} before becoming ready")
+            try:
+                if (await client.get(url, timeout=2.0)).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.25)
+    raise TimeoutError(f"{url} not ready after {timeout}s")
+
+
+async def run_concurrently(count: int, concurrency: int, request) -> float:
+    """Run `request(i)` for i in range(count), at most `concurrency` at a time; returns wall seconds"""
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with slots:
+            await request(i)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    return time.perf_counter() - started
+
+
+async def bench_index(client: httpx.AsyncClient, args: argparse.Namespace) -> Dict[str, Any]:
+    """One full /index-rag per user; photos/sec counts photos indexed across all users"""
+    latencies, photos, errors, pipeline_rates = [], 0, 0, []
+
+    async def request(i: int):
+        nonlocal photos, errors
+        started = time.perf_counter()
+        response = await client.get(
+            "/index-rag", params={"auth_token": fake_token(i + 1), "max_photos": args.max_photos}, timeout=None
+        )
+        latencies.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            errors += 1
+            return
+        result = response.json()
+        photos += result["indexed"]
+        errors += len(result["errors"])
+        if result["pipeline"]["photos_per_sec"]:
+            pipeline_rates.append(result["pipeline"]["photos_per_sec"])
+
+    elapsed = await run_concurrently(args.users, args.concurrency, request)
+    return {
+        "requests": args.users,
+        "photos_indexed": photos,
+        "errors": errors,
+        "wall_seconds": round(elapsed, 3),
+        "photos_per_sec": round(photos / elapsed, 2) if elapsed > 0 else None,
+        "pipeline_photos_per_sec_mean": round(sum(pipeline_rates) / len(pipeline_rates), 2) if pipeline_rates else None,
+        "latency": percentiles(latencies),
+    }
+
+
+async def bench_stream(client: httpx.AsyncClient, count: int, concurrency: int, open_stream, is_token) -> Dict[str, Any]:
+    """TTFT is the time until the first chunk for which `is_token` is true"""
+    latencies, ttfts, errors = [], [], 0
+
+    async def request(i: int):
+        nonlocal errors
+        started = time.perf_counter()
+        first = None
+        try:
+            async with open_stream(i) as response:
+                if response.status_code != 200:
+                    errors += 1
+                    return
+                async for chunk in response.aiter_text():
+                    if first is None and is_token(chunk):
+                        first = time.perf_counter() - started
+        except httpx.HTTPError:
+            errors += 1
+            return
+        latencies.append(time.perf_counter() - started)
+        if first is not None:
+            ttfts.append(first)
+
+    elapsed = await run_concurrently(count, concurrency, request)
+    return {
+        "requests": count,
+        "errors": errors,
+        "wall_seconds": round(elapsed, 3),
+        "requests_per_sec": round(count / elapsed, 2) if elapsed > 0 else None,
+        "latency": percentiles(latencies),
+        "ttft": percentiles(ttfts),
+    }
+
+
+async def bench_suggest(client: httpx.AsyncClient, args: argparse.Namespace) -> Dict[str, Any]:
+    prompts = [p["key"] for p in (await client.get("/suggest/prompts")).json()["available_prompts"]]
+
+    def open_stream(i: int):
+        user_id = i % args.users + 1
+        return client.stream("GET", f"/suggest/{user_id}/{prompts[i % len(prompts)]}/stream", timeout=None)
+
+    return await bench_stream(client, args.requests, args.concurrency, open_stream, lambda c: "event: token" in c)
+
+
+async def bench_chat(client: httpx.AsyncClient, args: argparse.Namespace, provider: str) -> Dict[str, Any]:
+    def open_stream(i: int):
+        payload = {"prompt": f"Gợi ý món ăn tối nay #{i}", "provider": provider, "stream": True}
+        return client.stream("POST", "/api/chat", json=payload, timeout=None)
+
+    return await bench_stream(client, args.requests, args.concurrency, open_stream, lambda c: bool(c))
+
+
+def parse_stage_metrics(text: str) -> Dict[str, Dict[str, float]]:
+    """Mean per stage from the app's truegift_stage_seconds histogram"""
+    sums, counts = {}, {}
+    for match in re.finditer(r'^truegift_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$', text, re.M):
+        (sums if match.group(1) == "sum" else counts)[match.group(2)] = float(match.group(3))
+    return {
+        stage: {"count": int(counts[stage]), "mean_ms": round(sums[stage] / counts[stage] * 1000, 2)}
+        for stage in sorted(counts) if counts[stage]
+    }
+
+
+def flatten(data: Any, prefix: str = "") -> Dict[str, float]:
+    if isinstance(data, dict):
+        flat = {}
+        for key, value in data.items():
+            flat.update(flatten(value, f"{prefix}.{key}" if prefix else key))
+        return flat
+    if isinstance(data, (int, float)) and not isinstance(data, bool):
+        return {prefix: float(data)}
+    return {}
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any]) -> Dict[str, Dict[str, float]]:
+    """Relative change of every numeric result present in both runs"""
+    before, after = flatten(baseline.get("results", {})), flatten(current.get("results", {}))
+    return {
+        key: {"baseline": before[key], "current": after[key], "change": round((after[key] - before[key]) / before[key], 4)}
+        for key in sorted(before.keys() & after.keys()) if before[key]
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    upstream_port, app_port = free_port(), free_port()
+    upstream = f"http://127.0.0.1:{upstream_port}"
+    workdir = tempfile.mkdtemp(prefix="truegift-bench-")
+    write_env(workdir, upstream, args)
+    child_env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get("PYTHONPATH")]))}
+    log = open(os.path.join(workdir, "app.log"), "w")
+
+    fakes = subprocess.Popen(
+        [sys.executable, "-m", "bench.fake_upstreams", "--port", str(upstream_port),
+         "--users", str(args.users), "--photos-per-user", str(args.photos_per_user),
+         "--image-size", str(args.image_size), "--image-delay", str(args.image_delay),
+         "--backend-delay", str(args.backend_delay), "--tokens", str(args.tokens),
+         "--first-token-delay", str(args.first_token_delay), "--token-delay", str(args.token_delay)],
+        cwd=REPO_ROOT, env=child_env,
+    )
+    app = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(app_port), "--log-level", "warning"],
+        cwd=workdir, env=child_env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    try:
+        await wait_until(f"{upstream}/healthz", 30, fakes)
+        await wait_until(f"http://127.0.0.1:{app_port}/ready?scope=indexing", args.startup_timeout, app)
+
+        results: Dict[str, Any] = {}
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{app_port}", limits=httpx.Limits(max_connections=args.concurrency * 2)
+        ) as client:
+            if "index" in args.scenarios:
+                results["index"] = await bench_index(client, args)
+            if "suggest" in args.scenarios:
+                results["suggest"] = await bench_suggest(client, args)
+            for provider in ("groq", "ollama"):
+                if f"chat_{provider}" in args.scenarios:
+                    results[f"chat_{provider}"] = await bench_chat(client, args, provider)
+            stages = parse_stage_metrics((await client.get("/metrics")).text)
+
+        results["peak_rss_mb"] = peak_rss_mb(app.pid)
+        return {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "params": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+            "results": results,
+            "stages": stages,
+        }
+    finally:
+        for process in (app, fakes):
+            process.terminate()
+        for process in (app, fakes):
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        log.close()
+        if args.keep_workdir:
+            print(f"Work directory kept at {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Offline benchmark of /index-rag, /suggest and /api/chat")
+    parser.add_argument("--scenarios", default="index,suggest,chat_groq,chat_ollama",
+                        type=lambda value: [s.strip() for s in value.split(",") if s.strip()])
+    parser.add_argument("--users", type=int, default=4, help="Fake users; each is indexed once")
+    parser.add_argument("--photos-per-user", type=int, default=50)
+    parser.add_argument("--max-photos", type=int, default=200, help="max_photos per /index-rag call")
+    parser.add_argument("--requests", type=int, default=40, help="Requests per suggest/chat scenario")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--image-size", type=int, default=640)
+    parser.add_argument("--image-delay", type=float, default=0.0)
+    parser.add_argument("--backend-delay", type=float, default=0.0)
+    parser.add_argument("--tokens", type=int, default=60)
+    parser.add_argument("--first-token-delay", type=float, default=0.2)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    parser.add_argument("--prediction-cache", action="store_true", help="Keep the classification cache enabled")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="Extra .env setting for the app")
+    parser.add_argument("--startup-timeout", type=float, default=300, help="Seconds to wait for the models to load")
+    parser.add_argument("--keep-workdir", action="store_true", help="Keep the temp directory (app.log, .env)")
+    parser.add_argument("--output", help="Also write the results to this file")
+    parser.add_argument("--baseline", help="Results file of an earlier run to compare against")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    report = asyncio.run(run(args))
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["comparison"] = compare(json.load(f), report)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
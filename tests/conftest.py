@@ -0,0 +1,22 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# app.config reads ./.env on import: run from a scratch directory holding the sample
+# settings, so relative paths (sync state, prediction cache, Chroma) land there
+_workdir = tempfile.mkdtemp(prefix="truegift-tests-")
+shutil.copy(os.path.join(ROOT, "env.sample"), os.path.join(_workdir, ".env"))
+os.chdir(_workdir)
+sys.path.insert(0, ROOT)
+
+from app.sync_state import SyncState  # noqa: E402
+
+
+@pytest.fixture
+def state(tmp_path):
+    return SyncState(str(tmp_path / "sync_state.sqlite3"))
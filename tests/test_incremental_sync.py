@@ -0,0 +1,160 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app import rag_indexer
+from app.friend_graph import FriendGraph
+from app.sync_state import photo_key, token_key
+
+TOKEN = "token"
+
+
+class FakeBackend:
+    """Newest-first feed of one user's photos and their friends' photos"""
+
+    def __init__(self, own=0, friends=0, ignore_offset=False):
+        self.own = [self.photo(i, 1) for i in range(own)]
+        self.friends = [self.photo(1000 + i, 2 + i % 3) for i in range(friends)]
+        self.ignore_offset = ignore_offset
+        self.calls = []
+
+    @staticmethod
+    def photo(photo_id, user_id):
+        return {"id": photo_id, "url": f"u{photo_id}", "userId": user_id, "createdAt": f"2024-01-01T{photo_id:06d}"}
+
+    async def fetch_user_photos(self, max_photos=50, auth_token=None, since=None, offset=0):
+        self.calls.append(offset)
+        if self.ignore_offset:
+            offset = 0
+
+        def page(photos):
+            photos = sorted(photos, key=photo_key, reverse=True)
+            return [dict(p) for p in photos[offset:offset + max_photos]]
+
+        return {"userId": 1, "userPhotos": page(self.own), "friendPhotos": page(self.friends)}
+
+
+class FakeCollection:
+    def count(self):
+        return 1
+
+
+@pytest.fixture
+def indexer(monkeypatch, state):
+    """rag_indexer with a fake backend and a pipeline that only records indexed ids"""
+    indexed, failing = set(), set()
+
+    async def process_photos(photos, progress=None):
+        results = []
+        for p in photos:
+            if p["id"] in failing:
+                results.append({"photo_id": p["id"], "status": "error", "error": "boom"})
+            else:
+                results.append({"photo_id": p["id"], "status": "skipped" if p["id"] in indexed else "indexed"})
+                indexed.add(p["id"])
+        return results, {}
+
+    monkeypatch.setattr(rag_indexer, "SYNC_PAGE_SIZE", 20)
+    monkeypatch.setattr(rag_indexer, "SYNC_MAX_PAGES", 2)
+    monkeypatch.setattr(rag_indexer, "_backend_pages_by_offset", True)
+    monkeypatch.setattr(rag_indexer, "sync_state", state)
+    monkeypatch.setattr(rag_indexer, "friend_graph", FriendGraph(state))
+    monkeypatch.setattr(rag_indexer, "get_collection", FakeCollection)
+    monkeypatch.setattr(rag_indexer, "indexed_photo_ids", lambda ids: {i for i in ids if i in indexed})
+    monkeypatch.setattr(rag_indexer, "process_photos", process_photos)
+
+    def use(backend):
+        monkeypatch.setattr(rag_indexer.client, "fetch_user_photos", backend.fetch_user_photos)
+        return backend
+
+    return SimpleNamespace(indexed=indexed, failing=failing, use=use)
+
+
+def sync(max_photos=1000):
+    return asyncio.run(rag_indexer.process_and_index_photos(TOKEN, max_photos=max_photos))
+
+
+def fetch(marks):
+    return asyncio.run(rag_indexer.fetch_new_photos(TOKEN, marks))
+
+
+def test_fetch_pages_until_short_page(indexer):
+    backend = indexer.use(FakeBackend(own=30))
+    fetched = fetch({"own": None, "friends": None})
+    assert backend.calls == [0, 20]
+    assert fetched["complete"] and len(fetched["user_photos"]) == 30
+
+
+def test_fetch_stops_at_page_cap(indexer):
+    backend = indexer.use(FakeBackend(own=100))
+    fetched = fetch({"own": None, "friends": None})
+    assert backend.calls == [0, 20]
+    assert not fetched["complete"] and fetched["next_offset"] == 40
+
+
+def test_fetch_resumes_from_saved_offset(indexer):
+    backend = indexer.use(FakeBackend(own=100))
+    marks = {"own": None, "friends": None, "resume": {"offset": 40, "since": None}}
+    fetched = fetch(marks)
+    assert backend.calls == [40, 60]
+    assert fetched["start_offset"] == 40
+
+
+def test_resumed_read_advances_to_newest_photo(indexer, state):
+    backend = indexer.use(FakeBackend(own=130))
+    for _ in range(4):
+        sync()
+    assert len(indexer.indexed) == 130
+    marks = state.watermarks(token_key(TOKEN))
+    assert marks["resume"] is None
+    assert marks["own"] == photo_key(backend.photo(129, 1))
+
+
+def test_deferred_photos_are_read_again_before_moving_on(indexer, state):
+    backend = indexer.use(FakeBackend(own=100))
+    sync(max_photos=30)
+    assert state.watermarks(token_key(TOKEN))["resume"] is None
+    backend.calls.clear()
+    sync(max_photos=30)
+    assert backend.calls == [0, 20]
+    assert state.watermarks(token_key(TOKEN))["resume"]["offset"] == 40
+    assert len(indexer.indexed) == 40
+
+
+def test_failure_in_resumed_read_caps_watermark(indexer, state):
+    backend = indexer.use(FakeBackend(own=60))
+    indexer.failing.add(25)
+    sync()
+    sync()
+    marks = state.watermarks(token_key(TOKEN))
+    assert marks["resume"] is None
+    assert marks["own"] == photo_key(backend.photo(24, 1))
+
+
+def test_backend_ignoring_offset_ends_the_read(indexer, state):
+    backend = indexer.use(FakeBackend(own=120, friends=30, ignore_offset=True))
+    result = sync()
+    assert result["sync"]["complete"]
+    assert len(indexer.indexed) == 40
+    marks = state.watermarks(token_key(TOKEN))
+    assert marks["own"] == photo_key(backend.photo(119, 1))
+    assert state.friends("1") == {"2", "3", "4"}
+
+    # Known to ignore offset now: one request per sync
+    backend.calls.clear()
+    result = sync()
+    assert backend.calls == [0]
+    assert result["indexed"] == 0 and result["sync"]["complete"]
+
+
+def test_stale_friend_list_forces_full_friend_read(indexer, state, monkeypatch):
+    backend = indexer.use(FakeBackend(own=5, friends=6))
+    sync()
+    assert state.friends("1") == {"2", "3", "4"}
+    backend.friends = [p for p in backend.friends if p["userId"] != 4]
+    sync()
+    assert state.friends("1") == {"2", "3", "4"}
+    monkeypatch.setattr(rag_indexer, "FRIEND_LIST_MAX_AGE", 0)
+    sync()
+    assert state.friends("1") == {"2", "3"}
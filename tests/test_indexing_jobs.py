@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from app import indexing_jobs as jobs_module
+from app.indexing_jobs import IndexingJobManager, IndexingJobStore
+
+
+@pytest.fixture
+def workers(tmp_path, monkeypatch):
+    """Two job managers standing in for two uvicorn workers, sharing one job store"""
+    started = asyncio.Event()
+    release = asyncio.Event()
+    calls = []
+
+    async def process_and_index_photos(auth_token=None, max_photos=50, full_sync=False, progress=None):
+        calls.append(max_photos)
+        started.set()
+        await release.wait()
+        return {"status": "done", "max_photos": max_photos}
+
+    monkeypatch.setattr(jobs_module, "process_and_index_photos", process_and_index_photos)
+    monkeypatch.setattr(jobs_module, "_POLL_INTERVAL", 0.01)
+    path = str(tmp_path / "jobs.sqlite3")
+    managers = [IndexingJobManager(workers=1, store=IndexingJobStore(path)) for _ in range(2)]
+    return managers, started, release, calls
+
+
+def test_job_is_shared_across_workers(workers):
+    (a, b), started, release, calls = workers
+
+    async def scenario():
+        # The only job slot of worker a is busy, so the next job stays queued
+        await a.submit("other")
+        await started.wait()
+        job = await a.submit("token", max_photos=10)
+        joined = await b.submit("token", max_photos=20)
+        assert joined.id == job.id and not joined.local
+        assert (await b.get(job.id)).max_photos == 20
+
+        waiting = asyncio.create_task(b.wait(joined))
+        release.set()
+        finished = await waiting
+        await a.stop()
+        await b.stop()
+        return finished
+
+    finished = asyncio.run(scenario())
+    # The worker running the job took on the larger request merged in by the other one
+    assert calls == [50, 20]
+    assert finished.state == "done" and finished.result == {"status": "done", "max_photos": 20}
+    assert finished.requests == 2
+
+
+def test_job_of_lost_worker_is_reported_and_replaced(workers, monkeypatch):
+    (a, b), _, release, _ = workers
+    release.set()
+
+    async def scenario():
+        # A job row left behind by a worker that died without finishing it
+        orphan = jobs_module.IndexingJob(jobs_module.token_key("token"), None, 50, False)
+        a.store.claim(orphan)
+        monkeypatch.setattr(jobs_module, "_STALE_AFTER", 0)
+        lost = await b.get(orphan.id)
+        replacement = await b.submit("token")
+        finished = await b.wait(replacement)
+        await b.stop()
+        return orphan, lost, finished
+
+    orphan, lost, finished = asyncio.run(scenario())
+    assert lost.state == "error" and lost.error == "worker lost"
+    assert finished.id != orphan.id and finished.state == "done"
+
+
+def test_unknown_job(workers):
+    (a, _), _, _, _ = workers
+    assert asyncio.run(a.get("missing")) is None
@@ -0,0 +1,87 @@
+from app.friend_graph import FriendGraph
+from app.sync_state import SyncState, extend_watermark, photo_key, watermark_after
+
+
+def photo(photo_id, created_at):
+    return {"id": photo_id, "createdAt": created_at}
+
+
+def test_photo_key_sorts_numeric_ids():
+    assert photo_key(photo(9, "t")) < photo_key(photo(10, "t"))
+
+
+def test_watermark_after_stops_before_oldest_failure():
+    photos = [photo(i, f"2024-01-0{i}") for i in range(1, 6)]
+    assert watermark_after(photos, []) == photo_key(photos[4])
+    assert watermark_after(photos, [photos[3], photos[2]]) == photo_key(photos[1])
+    assert watermark_after(photos, [photos[0]]) is None
+
+
+def test_extend_watermark():
+    newer, older = ("2024-02", "2"), ("2024-01", "1")
+    assert extend_watermark(newer, older, False) == newer
+    assert extend_watermark(None, older, False) == older
+    assert extend_watermark(newer, None, False) == newer
+    # A failure in an older segment caps the whole read there
+    assert extend_watermark(newer, older, True) == older
+    assert extend_watermark(newer, None, True) is None
+
+
+def test_advance_only_moves_forward(state):
+    state.advance("token:a", ("2024-02", "2"), ("2024-02", "3"), ["7"])
+    state.advance("token:a", ("2024-01", "1"), None, ["7"])
+    marks = state.watermarks("token:a")
+    assert marks["own"] == ("2024-02", "2")
+    assert marks["friends"] == ("2024-02", "3")
+
+
+def test_new_friend_restarts_friend_stream(state):
+    state.advance("token:a", None, ("2024-02", "3"), ["7"])
+    state.advance("token:a", None, ("2024-03", "4"), ["7", "8"])
+    assert state.watermarks("token:a")["friends"] is None
+
+
+def test_resume_is_cleared_when_read_completes(state):
+    state.set_resume("token:a", 100, None, ["7"], own=("2024-02", "2"))
+    resume = state.watermarks("token:a")["resume"]
+    assert resume["offset"] == 100 and resume["friend_ids"] == ["7"] and resume["own"] == ["2024-02", "2"]
+    state.advance("token:a", ("2024-02", "2"), None)
+    assert state.watermarks("token:a")["resume"] is None
+
+
+def test_full_friend_read_is_stamped(state):
+    state.advance("token:a", None, None)
+    assert state.watermarks("token:a")["friends_read_at"] is None
+    state.advance("token:a", None, None, full_friend_read=True)
+    assert state.watermarks("token:a")["friends_read_at"] is not None
+
+
+def test_workers_share_state(state):
+    other = SyncState(state.path)
+    state.record_friends("1", {"2"})
+    state.advance("token:a", ("2024-01", "1"), None)
+    other.advance("token:b", ("2024-01", "2"), None)
+    assert other.friends("1") == {"2"}
+    assert state.watermarks("token:b")["own"] == ("2024-01", "2")
+    assert other.watermarks("token:a")["own"] == ("2024-01", "1")
+
+
+def test_record_friends_mirrors_added_and_removed_friends(state):
+    state.record_friends("2", {"3"})
+    state.record_friends("1", {"2"})
+    assert state.friends("2") == {"1", "3"}
+    state.record_friends("1", {"3"})
+    assert state.friends("2") == {"3"}
+    # Users without a stored list are not given a partial one
+    assert state.friends("3") == set()
+
+
+def test_friend_graph_rereads_after_ttl_and_skips_empty_lists(state):
+    graph = FriendGraph(state, ttl=60)
+    assert graph.get_friends("1") == []
+    state.record_friends("1", {"2"})
+    assert graph.get_friends("1") == ["2"]
+    state.record_friends("1", {"3"})
+    assert graph.get_friends("1") == ["2"]
+    graph.ttl = 0
+    assert graph.get_friends("1") == ["3"]